@@ -3,28 +3,141 @@ REST API for distributing and validating crypto-tickets for authorized users.
 Considered the authorization authority for our banking app.
 """
 import auth_db
-import os
-from flask import Flask, g, jsonify, abort, request
+import db_pool
+import io
+import metrics
+import math
+import passwords
+import rate_limit
+import ticket_writer
+import tickets
+import time
+import wav_audio
+from profile_registry import ProfileRegistry
+from settings import SPEECH_PROFILE_CACHE_TTL, SPEECH_PROFILE_REFRESH_AHEAD, MAX_AUDIO_UPLOAD_BYTES, \
+    AUDIO_MIN_DURATION, AUDIO_MAX_DURATION, AUDIO_NORMALIZE, TICKET_BATCH_MAX_SIZE, SPEAKER_SERVICE_HOST, \
+    SPEAKER_SERVICE_HTTPS, SPEAKER_SUBSCRIPTION_KEY, RATE_LIMIT_SPEECH_COST, SPEAKER_CONNECT_TIMEOUT, \
+    SPEAKER_READ_TIMEOUT, SPEAKER_GET_RETRIES, SPEAKER_HEDGE_AFTER, SPEAKER_BREAKER_FAILURE_RATE, \
+    SPEAKER_BREAKER_SLOW_CALL, SPEAKER_BREAKER_OPEN_SECONDS, SPEAKER_BACKEND, SPEAKER_LOCAL_MODEL_DIR, \
+    SPEAKER_LOCAL_WORKERS, SPEAKER_IDENTIFY_CHUNK_SIZE, SPEAKER_IDENTIFY_WORKERS, SPEECH_OPERATION_KEY
+from flask import Flask, Request, Response, g, jsonify, abort, request, url_for
 from flask_sslify import SSLify
-from speech_identification import IdentificationServiceHttpClientHelper
-from werkzeug.utils import secure_filename
+from speech_identification import IdentificationServiceError
 
-UPLOAD_FOLDER = './uploads'
 ALLOWED_EXTENSIONS = {'wav'}
+ALLOWED_MIMETYPES = {'audio/wav', 'audio/x-wav', 'audio/wave'}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class InMemoryRequest(Request):
+    """ Request that keeps uploaded files in memory instead of spooling large ones to disk. """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # total size is already capped by MAX_CONTENT_LENGTH
+        return io.BytesIO()
+
 
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.request_class = InMemoryRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_AUDIO_UPLOAD_BYTES
 application = app
 sslify = SSLify(app)
 
-@app.before_first_request
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "auth_api_request_seconds", "Time spent handling each route.", ["endpoint", "method", "status"])
+SPEAKER_SECONDS = metrics.REGISTRY.histogram(
+    "speaker_service_seconds", "Speaker service request phases and operation poll iterations.", ["phase"])
+metrics.REGISTRY.add_gauges("auth_db_pool", "Database connection pool statistics.",
+                            lambda: auth_db.get_pool().stats())
+metrics.REGISTRY.add_gauges("auth_ticket_cache", "Verified-ticket cache statistics.",
+                            lambda: auth_db.get_ticket_cache().stats())
+metrics.REGISTRY.add_gauges("auth_db_replicas", "Read replica routing statistics.",
+                            lambda: auth_db.get_replica_router().stats() if auth_db.get_replica_router() else {})
+metrics.REGISTRY.add_gauges("auth_ticket_writer", "Batched ticket writer statistics.",
+                            lambda: auth_db.get_ticket_writer().stats() if auth_db.get_ticket_writer() else {})
+metrics.REGISTRY.add_gauges("speaker_circuit", "Speaker service circuit breaker statistics.",
+                            lambda: speaker_circuit_gauges())
+metrics.REGISTRY.add_gauges("auth_rate_limit", "Login throttling statistics.",
+                            lambda: rate_limit.get_rate_limiter().stats() if rate_limit.get_rate_limiter() else {})
+
+
+@app.before_request
+def start_timer():
+    g._request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    start = getattr(g, "_request_start", None)
+    if start is not None:
+        REQUEST_SECONDS.labels(request.endpoint, request.method, response.status_code).observe(
+            time.perf_counter() - start)
+    return response
+
+
+def observe_speaker_request(host, phase, seconds):
+    SPEAKER_SECONDS.labels(phase).observe(seconds)
+
+_identification = None
+
+
 def get_client():
-    i = getattr(g, "_identification", None)
-    if not i:
-        i = g._identification = IdentificationServiceHttpClientHelper.IdentificationServiceHttpClientHelper(r'4a8368646beb44e29eeafd5f86ec86c9')
-    return i
+    # shared by all requests so its keep-alive connections to the speaker service are reused
+    global _identification
+    if not _identification and SPEAKER_BACKEND == "local":
+        # imported on first use to keep numpy off the cold start path
+        from speech_identification import IdentificationServiceLocalClient
+        _identification = IdentificationServiceLocalClient.IdentificationServiceLocalClient(
+            SPEAKER_LOCAL_MODEL_DIR, processes=SPEAKER_LOCAL_WORKERS)
+        _identification.add_profiles_changed_listener(_profiles_changed)
+    elif not _identification:
+        # imported on first use to keep the client and its TLS stack off the cold start path
+        from speech_identification import CircuitBreaker, IdentificationServiceHttpClientHelper
+        _identification = IdentificationServiceHttpClientHelper.IdentificationServiceHttpClientHelper(
+            SPEAKER_SUBSCRIPTION_KEY, connect_timeout=SPEAKER_CONNECT_TIMEOUT, read_timeout=SPEAKER_READ_TIMEOUT,
+            observer=observe_speaker_request, base_uri=SPEAKER_SERVICE_HOST, use_https=SPEAKER_SERVICE_HTTPS,
+            get_retries=SPEAKER_GET_RETRIES, hedge_after=SPEAKER_HEDGE_AFTER,
+            identify_chunk_size=SPEAKER_IDENTIFY_CHUNK_SIZE, identify_workers=SPEAKER_IDENTIFY_WORKERS,
+            circuit_breaker=CircuitBreaker.CircuitBreaker(failure_rate=SPEAKER_BREAKER_FAILURE_RATE,
+                                                          slow_call_duration=SPEAKER_BREAKER_SLOW_CALL,
+                                                          open_duration=SPEAKER_BREAKER_OPEN_SECONDS))
+        _identification.add_profiles_changed_listener(_profiles_changed)
+    return _identification
+
+
+def speaker_circuit_stats():
+    breaker = _identification.get_circuit_breaker() if _identification else None
+    return breaker.stats() if breaker else None
+
+
+def speaker_circuit_gauges():
+    circuit = speaker_circuit_stats()
+    if not circuit:
+        return {}
+    circuit["open"] = int(circuit.pop("state") != "closed")
+    return circuit
+
+
+_profile_registry = None
+
+
+def get_profile_registry():
+    global _profile_registry
+    if not _profile_registry:
+        client = get_client()
+        _profile_registry = ProfileRegistry(
+            lambda: [profile.get_profile_id()
+                     for profile in client.get_all_profiles(enrollment_status="Enrolled")],
+            seed=lambda: auth_db.AuthDBConnection().get_enrolled_speech_profiles(),
+            ttl=SPEECH_PROFILE_CACHE_TTL,
+            refresh_ahead=SPEECH_PROFILE_REFRESH_AHEAD)
+    return _profile_registry
+
+
+def _profiles_changed(profile_id):
+    if _profile_registry:
+        _profile_registry.invalidate()
+
 
-@app.before_first_request
 def get_db():
     db = getattr(g, "_dbconn", None)
     if not db:
@@ -34,36 +147,152 @@ def get_db():
 
 @app.teardown_appcontext
 def shutdown_db(exception):
-    print("Shutting down database!")
+    # hands the handle back; the underlying connections stay pooled for the next request
     db = getattr(g, "_dbconn", None)
     if db:
         db.close()
 
 
+def keep_warm(event=None, context=None):
+    """
+    Entry point for the scheduled Zappa keep-warm event. Besides keeping the Lambda container
+    alive it opens (or health-checks) a pooled DB connection and builds the speaker client, so
+    the next real request finds both ready.
+    """
+    with auth_db.get_pool().connection():
+        pass
+    get_client()
+
+
+@app.errorhandler(db_pool.PoolTimeout)
+def db_pool_exhausted(error):
+    return jsonify({"error": str(error)}), 503
+
+
+@app.errorhandler(passwords.HasherBusy)
+@app.errorhandler(ticket_writer.TicketQueueFull)
+def overloaded(error):
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+@app.errorhandler(IdentificationServiceError.CircuitOpenError)
+@app.errorhandler(IdentificationServiceError.ServiceThrottledError)
+def speaker_service_overloaded(error):
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(int(math.ceil(error.retry_after or 1)))
+    return response
+
+
+@app.errorhandler(IdentificationServiceError.ServiceUnavailableError)
+def speaker_service_unavailable(error):
+    status = 504 if isinstance(error, IdentificationServiceError.ServiceTimeoutError) else 502
+    return jsonify({"error": str(error)}), status
+
+
+@app.errorhandler(IdentificationServiceError.ProfileNotFoundError)
+def speaker_profile_not_found(error):
+    return jsonify({"error": str(error)}), 404
+
+
+@app.errorhandler(IdentificationServiceError.RequestRejectedError)
+def speaker_request_rejected(error):
+    # e.g. audio with too little speech; profile lookups are answered by speaker_profile_not_found
+    return jsonify({"error": str(error)}), 400
+
+
+@app.errorhandler(IdentificationServiceError.OperationFailedError)
+def speaker_operation_failed(error):
+    # the service accepted the clip but could not process it, e.g. too little speech
+    return jsonify({"error": str(error)}), 422
+
+
+@app.errorhandler(IdentificationServiceError.IdentificationServiceError)
+def speaker_service_error(error):
+    return jsonify({"error": str(error)}), 502
+
+
+@app.errorhandler(rate_limit.RateLimited)
+def rate_limited(error):
+    response = jsonify({"error": str(error)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(int(math.ceil(error.retry_after)))
+    return response
+
+
+def throttle(email=None, cost=1):
+    """
+    Count a login attempt against the caller's address and the account's limits.
+    :raises rate_limit.RateLimited: If either is over its limit; answered with 429.
+    """
+    limiter = rate_limit.get_rate_limiter()
+    if limiter is not None:
+        limiter.check(request.remote_addr, email, cost)
+
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def read_capped(stream, limit):
+    """
+    Read a request body in chunks, rejecting it with 413 as soon as it exceeds the limit.
+    :param stream: Readable binary stream.
+    :param limit: Maximum number of bytes accepted.
+    :return: The body bytes.
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            abort(413)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
 def get_wav_file(req):
+    """
+    Get the uploaded audio, either as a raw audio/wav body or as the "file" part of a form upload.
+    :return: (True, audio bytes) or (False, error message)
+    """
+    # raw body upload, read straight off the request stream
+    if req.mimetype in ALLOWED_MIMETYPES:
+        audio = read_capped(req.stream, app.config['MAX_CONTENT_LENGTH'])
+        if not audio:
+            return False, "No audio in request"
+        return prepare_wav(audio)
+
     # check if the post request has the file part
     if 'file' not in req.files:
         return False, "No file in request"
     file = req.files['file']
-    print(file.filename)
     if file.filename == '':
         return False, "No filename in request"
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        curr_folder = os.path.dirname(os.path.abspath(__file__))
-        save_folder = os.path.join(curr_folder, app.config['UPLOAD_FOLDER'])
-        filepath = os.path.join(save_folder, filename)
-        file.save(filepath)
-        #TODO: check if wav file meets requirements
-        return True, filepath
+        return prepare_wav(read_capped(file.stream, app.config['MAX_CONTENT_LENGTH']))
     return False, "File not allowed"
 
 
+def prepare_wav(audio):
+    """
+    Check audio against the speaker service's requirements before sending it anywhere, converting
+    it to 16 kHz, 16-bit mono PCM if AUDIO_NORMALIZE is on.
+    :return: (True, audio bytes) or (False, error message)
+    """
+    try:
+        return True, wav_audio.prepare_wav(audio, AUDIO_MIN_DURATION, AUDIO_MAX_DURATION, AUDIO_NORMALIZE)
+    except wav_audio.WavError as e:
+        return False, str(e)
+
+
 @app.route('/create/speech-profile')
 def speech_create():
     """
@@ -80,56 +309,205 @@ def speech_create():
 @app.route('/enroll/speech', methods=['POST'])
 def speech_enroll():
     """
-    Enroll profile using a voice clip. Must be done three successful times
+    Enroll profile using a voice clip. Must be done three successful times. The profile is bound to
+    the user the ticket was issued to, and audio is refused for a profile bound to another user.
     :return: number of remaining enrollments
     """
     # TODO retrieve id from database instead of getting it from request
     id = request.args.get("id")
+    ticket = request.args.get("ticket")
+    if id is None or ticket is None:
+        abort(400)
+
+    db = get_db()
+    try:
+        email = db.get_ticket_user(ticket)
+        owner = db.get_speech_profile_owner(id)
+    except ValueError:
+        abort(400)
+    if email is None:
+        abort(401)
+    if owner is not None and owner != email:
+        abort(403)
+
     if request.method == 'POST':
         success, response = get_wav_file(request)
         if not success:
             return response
         enroll = get_client().enroll_profile(id, response, force_short_audio=True)
+        if enroll.get_enrollment_status() == "Enrolled":
+            # lets cold starts find the enrolled profiles without listing them remotely
+            db.set_speech_profile(email, id)
         return str(enroll.get_remaining_speech_time())
 
 
+def identification_result(result):
+    """
+    Report who a voice clip was identified as.
+    :param result: Identification result from the speaker service.
+    :return: The name of the user and the confidence, or identified false when the clip matched no
+             profile bound to a user.
+    """
+    try:
+        name = get_db().get_speech_profile_name(result.get_identified_profile_id())
+    except ValueError:
+        name = None
+    if name is None:
+        return jsonify(id=None, confidence=result.get_confidence(), identified=False)
+    return jsonify(id=name, confidence=result.get_confidence(), identified=True)
+
+
 @app.route('/login/speech', methods=['POST'])
 def speech_login():
     """
     Login using a voice clip. This method checks the identity of a speaker and compares against
     speech profiles stored in the auth database.
 
+    With wait=false the request returns as soon as the clip is submitted: if the speaker service
+    has not finished processing it, the response is 202 with a Location header pointing at
+    /login/speech/<operation>, which the client polls instead of holding a worker thread here. The
+    operation token is signed for the submitting address and cannot be polled from another.
+
+    With an e-mail the clip is only compared against that user's enrolled profile, which takes one
+    speaker service call however many users have enrolled, and a High-confidence match issues a
+    ticket as /login/text does. Such logins always wait for the result. They need a backend whose
+    confidences are calibrated: the local backend only qualifies once at least three users have
+    enrolled, and until then these logins are refused with an error.
+
     Request:
-        WAV-encoded audio file
+        WAV-encoded audio, as the raw body with Content-Type audio/wav or as a "file" form upload
         Container    WAV
         Encoding    PCM
         Rate    16K
         Sample Format    16 bit
         Channels    Mono
+        wait: true (default) or false
+        email: optional e-mail address of the user logging in
 
     Response:
         {
             "ticket" : base64,
             "issued" : ISO 8601 datetime,
             "expires" : ISO 8601 datetime,
+            "refresh_token" : string, exchanged at /auth/refresh for a new ticket,
             "authenticated" : true/false,
             "error" : None or message if error
         }
-    """
-    profile_name = {
-        "c3cba575-213b-48d4-82a4-9fd6d5c06366" : "Shae",
-        "459d1f28-37d4-4138-ba8f-b82347f00169" : "Charlie"
-    }
 
+        or, without an e-mail,
+        {
+            "id" : first name of the identified user, or None,
+            "confidence" : "Low", "Normal" or "High",
+            "identified" : true/false
+        }
+
+        or, with wait=false and processing still running, 202 with
+        {
+            "operation" : operation token,
+            "status" : "running"
+        }
+
+        or 429 with a Retry-After header when too many attempts came from the address.
+    """
     if request.method == 'POST':
+        email = request.args.get("email")
+        throttle(email, cost=RATE_LIMIT_SPEECH_COST)
         client = get_client()
         success, response = get_wav_file(request)
         if not success:
             return response
-        all_profiles = [profile.get_profile_id()
-               for profile in client.get_all_profiles() if profile.get_enrollment_status() == "Enrolled"]
-        result = client.identify_file(response, all_profiles, force_short_audio=True)
-        return jsonify(id=profile_name[result.get_identified_profile_id()], confidence=result.get_confidence())
+        if email is not None:
+            return verify_speaker(client, email, response)
+        all_profiles = get_profile_registry().enrolled_profile_ids()
+
+        if request.args.get("wait", "true").lower() != "false":
+            result = client.identify_file(response, all_profiles, force_short_audio=True)
+            return identification_result(result)
+
+        operation_id, result = client.submit_identification(response, all_profiles, force_short_audio=True)
+        if result is not None:
+            return identification_result(result)
+        return operation_pending(operation_id)
+
+
+def verify_speaker(client, email, audio):
+    """
+    Check a voice clip against the enrolled profile of one user and issue a ticket if it matches.
+    :param client: Speaker service client.
+    :param email: E-mail of the user logging in.
+    :param audio: WAV audio bytes.
+    :return: The login response, shaped as /login/text's.
+    """
+    if not client.is_calibrated():
+        # a High match of uncalibrated scores is no evidence of who is speaking
+        return not_logged_in("Speech login is unavailable until more users have enrolled")
+    profile_id = get_db().get_speech_profile(email)
+    if profile_id is not None:
+        result = client.identify_file(audio, [profile_id], force_short_audio=True)
+        # with a single candidate only High confidence tells the user apart from anyone else
+        if result.get_identified_profile_id() == profile_id and result.is_high_confidence_match():
+            return logged_in(email)
+    return not_logged_in()
+
+
+def logged_in(email):
+    """
+    Issue a ticket and a refresh token for a user who just proved who they are.
+    :param email: E-mail of the user.
+    :return: The login response.
+    """
+    ticket, issued, expiry = get_db().issue_ticket(email)
+    return jsonify({
+        "ticket": ticket,
+        "issued": issued,
+        "expiry": expiry,
+        "refresh_token": get_db().issue_refresh_token(email),
+        "authenticated": True
+    })
+
+
+def not_logged_in(error=None):
+    return jsonify({
+        "ticket": None,
+        "issued": None,
+        "expiry": None,
+        "refresh_token": None,
+        "authenticated": False,
+        "error": error
+    })
+
+
+@app.route('/login/speech/<operation>', methods=['GET'])
+def speech_login_status(operation):
+    """
+    Check once on a speech login submitted with wait=false. Only the address that submitted it
+    gets an answer; any other caller gets 404.
+
+    Response:
+        Same as /login/speech once processing has finished, otherwise 202 with
+        {
+            "operation" : operation token,
+            "status" : "running"
+        }
+    """
+    operation_id = tickets.verify_operation(SPEECH_OPERATION_KEY, operation, request.remote_addr)
+    if operation_id is None:
+        abort(404)
+    try:
+        result = get_client().get_identification_result(operation_id)
+    except ValueError:
+        abort(404)
+    if result is None:
+        return operation_pending(operation_id)
+    return identification_result(result)
+
+
+def operation_pending(operation_id):
+    operation = tickets.sign_operation(SPEECH_OPERATION_KEY, operation_id, request.remote_addr)
+    response = jsonify(operation=operation, status="running")
+    response.status_code = 202
+    response.headers["Location"] = url_for("speech_login_status", operation=operation)
+    return response
 
 
 @app.route("/login/text", methods=['POST'])
@@ -146,32 +524,64 @@ def text_login():
             "ticket" : base64,
             "issued" : ISO 8601 datetime,
             "expires" : ISO 8601 datetime,
+            "refresh_token" : string, exchanged at /auth/refresh for a new ticket,
             "authenticated" : true/false,
+            "error" : None, or a message when a failed login had a cause other than the credentials
         }
+
+        or 429 with a Retry-After header when too many attempts came from the address or were
+        made for the e-mail.
     """
 
     try:
         email = request.json['email']
         password = request.json['password']
-    except KeyError:
+    except (KeyError, TypeError):
+        abort(400)
+    if not isinstance(email, str) or not isinstance(password, str):
         abort(400)
 
+    throttle(email)
     if get_db().check_login_text(email, password):
         # valid login - issue ticket
-        ticket, issued, expiry = get_db().issue_ticket()
-        return jsonify({
-            "ticket": ticket,
-            "issued": issued,
-            "expiry": expiry,
-            "authenticated": True
-        })
+        return logged_in(email)
     else:
-        return jsonify({
-            "ticket": None,
-            "issued": None,
-            "expiry": None,
-            "authenticated": False
-        })
+        return not_logged_in()
+
+
+@app.route("/auth/refresh", methods=['POST'])
+def refresh():
+    """
+    Exchange a refresh token for a new ticket without logging in again. Each refresh token can be
+    exchanged once: the response carries the one to use next. Presenting a refresh token that was
+    already exchanged ends its session, since someone else may hold a copy of it.
+
+    Request:
+        refresh_token: Refresh token string from a login or a previous refresh
+
+    Response:
+        Same as /login/text
+    """
+    try:
+        refresh_token = request.json['refresh_token']
+    except (KeyError, TypeError):
+        abort(400)
+
+    try:
+        refreshed = get_db().refresh_ticket(refresh_token)
+    except ValueError:
+        abort(400)
+
+    if refreshed is None:
+        return not_logged_in()
+    ticket, issued, expiry, refresh_token = refreshed
+    return jsonify({
+        "ticket": ticket,
+        "issued": issued,
+        "expiry": expiry,
+        "refresh_token": refresh_token,
+        "authenticated": True
+    })
 
 
 @app.route("/auth/check", methods=['GET'])
@@ -180,23 +590,129 @@ def check_ticket():
     Checks that a provided ticket exists in the database and has not expired.
 
     Request:
-        ticket: Hex string
+        ticket: Hex string (opaque ticket) or signed ticket string
 
     Response:
         {
             "authenticated" : True/False
         }
     """
+    ticket = request.args.get("ticket")
+    if ticket is None:
+        abort(400)
+
     try:
-        ticket = bytes.fromhex(request.args.get("ticket"))
-    except (ValueError, TypeError):
+        authenticated = get_db().check_ticket(ticket)
+    except ValueError:
         abort(400)
 
-    authenticated = get_db().check_ticket(ticket)
     return jsonify({
         "authenticated": authenticated
     })
 
 
+@app.route("/auth/check/batch", methods=['POST'])
+def check_ticket_batch():
+    """
+    Checks many tickets in one request, with at most one database round-trip.
+
+    Request:
+        tickets: list of up to TICKET_BATCH_MAX_SIZE ticket strings
+
+    Response:
+        {
+            "results" : [
+                {
+                    "authenticated" : True/False,
+                    "expiry" : datetime or None
+                }, ...
+            ]
+        }
+    """
+    try:
+        ticket_list = request.json['tickets']
+    except (KeyError, TypeError):
+        abort(400)
+    if not isinstance(ticket_list, list) or len(ticket_list) > TICKET_BATCH_MAX_SIZE:
+        abort(400)
+
+    expiries = get_db().check_tickets(ticket_list)
+    return jsonify({
+        "results": [{"authenticated": expiry is not None, "expiry": expiry} for expiry in expiries]
+    })
+
+
+@app.route("/auth/logout", methods=['POST'])
+def logout():
+    """
+    Revokes a ticket before it expires, and ends its session if the refresh token is given.
+
+    Request:
+        ticket: Hex string (opaque ticket) or signed ticket string
+        refresh_token: optional, the session's current refresh token
+
+    Response:
+        {
+            "revoked" : True/False,
+            "session_ended" : True/False
+        }
+    """
+    try:
+        ticket = request.json['ticket']
+        refresh_token = request.json.get('refresh_token')
+    except (KeyError, TypeError):
+        abort(400)
+    if not isinstance(ticket, str):
+        abort(400)
+
+    try:
+        revoked = get_db().revoke_ticket(ticket)
+        session_ended = refresh_token is not None and get_db().revoke_refresh_token(refresh_token)
+    except ValueError:
+        abort(400)
+
+    return jsonify({
+        "revoked": revoked,
+        "session_ended": session_ended
+    })
+
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    """
+    Process-local runtime statistics for scraping.
+
+    Response:
+        {
+            "db_pool" : {"in_use": int, "idle": int, "wait_time_total": seconds, ...},
+            "db_replicas" : [{"name": host, "up": bool, "latency": seconds, "lag": seconds, ...}, ...],
+            "ticket_cache" : {"entries": int, "hits": int, "misses": int, ...},
+            "ticket_writer" : {"pending": int, "batches": int, "avg_batch_size": float, ...} or None,
+            "rate_limit" : {"allowed": int, "limited_ip": int, "limited_email": int, ...} or None,
+            "speaker_circuit" : {"state": "closed"/"open"/"half_open", "rejected": int, ...} or None
+        }
+    """
+    writer = auth_db.get_ticket_writer()
+    replicas = auth_db.get_replica_router()
+    limiter = rate_limit.get_rate_limiter()
+    return jsonify({
+        "db_pool": auth_db.get_pool().stats(),
+        "db_replicas": replicas.replica_stats() if replicas else [],
+        "ticket_cache": auth_db.get_ticket_cache().stats(),
+        "ticket_writer": writer.stats() if writer else None,
+        "rate_limit": limiter.stats() if limiter else None,
+        "speaker_circuit": speaker_circuit_stats()
+    })
+
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    """
+    Route, SQL and speaker service latency histograms plus pool and cache gauges, in the
+    Prometheus text exposition format.
+    """
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,571 @@
+"""
+Async (ASGI) serving mode of the auth API, exposing the same routes as auth_api.
+
+DB queries go through an asyncpg pool and speaker service calls through aiohttp, so a waiting
+/auth/check or a /login/speech polling the speaker service holds a coroutine rather than a thread.
+Run it under an ASGI server, e.g.
+
+    uvicorn auth_asgi:app --workers 2 --proxy-headers
+
+auth_api.app (the WSGI `application`) is unchanged and remains what Zappa deploys.
+"""
+import asyncio
+import calendar
+import json
+import math
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from email.utils import formatdate
+
+import auth_db
+import auth_db_async
+import db_pool
+import metrics
+import passwords
+import rate_limit
+import tickets
+import wav_audio
+from profile_registry import AsyncProfileRegistry
+from settings import SPEECH_PROFILE_CACHE_TTL, SPEECH_PROFILE_REFRESH_AHEAD, MAX_AUDIO_UPLOAD_BYTES, \
+    AUDIO_MIN_DURATION, AUDIO_MAX_DURATION, AUDIO_NORMALIZE, TICKET_BATCH_MAX_SIZE, SPEAKER_SERVICE_HOST, \
+    SPEAKER_SERVICE_HTTPS, SPEAKER_SUBSCRIPTION_KEY, RATE_LIMIT_SPEECH_COST, \
+    SPEAKER_IDENTIFY_CHUNK_SIZE, SPEECH_OPERATION_KEY
+from speech_identification import IdentificationServiceAsyncClient, IdentificationServiceError
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.formparsers import MultiPartParser
+from starlette.middleware import Middleware
+from starlette.middleware.httpsredirect import HTTPSRedirectMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+ALLOWED_EXTENSIONS = {'wav'}
+ALLOWED_MIMETYPES = {'audio/wav', 'audio/x-wav', 'audio/wave'}
+
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "auth_api_request_seconds", "Time spent handling each route.", ["endpoint", "method", "status"])
+SPEAKER_SECONDS = metrics.REGISTRY.histogram(
+    "speaker_service_seconds", "Speaker service request phases and operation poll iterations.", ["phase"])
+metrics.REGISTRY.add_gauges("auth_db_pool", "Database connection pool statistics.", auth_db_async.pool_stats)
+metrics.REGISTRY.add_gauges("auth_ticket_cache", "Verified-ticket cache statistics.",
+                            lambda: auth_db.get_ticket_cache().stats())
+metrics.REGISTRY.add_gauges("auth_rate_limit", "Login throttling statistics.",
+                            lambda: rate_limit.get_rate_limiter().stats() if rate_limit.get_rate_limiter() else {})
+
+
+def _json_default(o):
+    # datetimes in the format Flask's jsonify uses, so both serving modes agree
+    if isinstance(o, datetime):
+        return formatdate(calendar.timegm(o.utctimetuple()), usegmt=True)
+    raise TypeError("%r is not JSON serializable" % (o,))
+
+
+class JSON(JSONResponse):
+    def render(self, content):
+        return json.dumps(content, default=_json_default, sort_keys=True).encode("utf-8")
+
+
+class RequestTimer(object):
+    """ ASGI middleware recording each request's latency by endpoint, method and status. """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = scope.get("endpoint")
+            REQUEST_SECONDS.labels(getattr(endpoint, "__name__", None), scope["method"], status[0]).observe(
+                time.perf_counter() - start)
+
+
+def observe_speaker_request(host, phase, seconds):
+    SPEAKER_SECONDS.labels(phase).observe(seconds)
+
+_identification = None
+
+
+def get_client():
+    # shared by all requests so its keep-alive connections to the speaker service are reused
+    global _identification
+    if not _identification:
+        _identification = IdentificationServiceAsyncClient.IdentificationServiceAsyncClient(
+            SPEAKER_SUBSCRIPTION_KEY, observer=observe_speaker_request,
+            base_uri=SPEAKER_SERVICE_HOST, use_https=SPEAKER_SERVICE_HTTPS,
+            identify_chunk_size=SPEAKER_IDENTIFY_CHUNK_SIZE)
+        _identification.add_profiles_changed_listener(_profiles_changed)
+    return _identification
+
+
+_profile_registry = None
+
+
+def get_profile_registry():
+    global _profile_registry
+    if not _profile_registry:
+        client = get_client()
+
+        async def fetch():
+            return [profile.get_profile_id()
+                    for profile in await client.get_all_profiles(enrollment_status="Enrolled")]
+
+        async def seed():
+            return await (await get_db()).get_enrolled_speech_profiles()
+
+        _profile_registry = AsyncProfileRegistry(fetch, seed=seed, ttl=SPEECH_PROFILE_CACHE_TTL,
+                                                 refresh_ahead=SPEECH_PROFILE_REFRESH_AHEAD)
+    return _profile_registry
+
+
+def _profiles_changed(profile_id):
+    if _profile_registry:
+        _profile_registry.invalidate()
+
+
+async def get_db():
+    return auth_db_async.AsyncAuthDB(await auth_db_async.get_pool())
+
+
+async def db_pool_exhausted(request, error):
+    return JSON({"error": str(error)}, status_code=503)
+
+
+async def password_hasher_busy(request, error):
+    return JSON({"error": str(error)}, status_code=503, headers={"Retry-After": "1"})
+
+
+async def speaker_service_overloaded(request, error):
+    return JSON({"error": str(error)}, status_code=503,
+                headers={"Retry-After": str(int(math.ceil(error.retry_after or 1)))})
+
+
+async def speaker_service_unavailable(request, error):
+    status = 504 if isinstance(error, IdentificationServiceError.ServiceTimeoutError) else 502
+    return JSON({"error": str(error)}, status_code=status)
+
+
+async def speaker_profile_not_found(request, error):
+    return JSON({"error": str(error)}, status_code=404)
+
+
+async def speaker_request_rejected(request, error):
+    # e.g. audio with too little speech; profile lookups are answered by speaker_profile_not_found
+    return JSON({"error": str(error)}, status_code=400)
+
+
+async def speaker_operation_failed(request, error):
+    return JSON({"error": str(error)}, status_code=422)
+
+
+async def speaker_service_error(request, error):
+    return JSON({"error": str(error)}, status_code=502)
+
+
+async def rate_limited(request, error):
+    return JSON({"error": str(error)}, status_code=429,
+                headers={"Retry-After": str(int(math.ceil(error.retry_after)))})
+
+
+def _client_host(request):
+    return request.client.host if request.client else None
+
+
+async def throttle(request, email=None, cost=1):
+    """ Count a login attempt; see auth_api.throttle. """
+    limiter = rate_limit.get_rate_limiter()
+    if limiter is None:
+        return
+    ip = _client_host(request)
+    if limiter.shared:
+        await asyncio.get_running_loop().run_in_executor(None, limiter.check, ip, email, cost)
+    else:
+        limiter.check(ip, email, cost)
+
+
+def allowed_file(filename):
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+async def read_capped(request, limit):
+    """
+    Read a request body as it arrives, rejecting it with 413 as soon as it exceeds the limit.
+    :return: The body bytes.
+    """
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(413)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _replay(body):
+    yield body
+
+
+async def get_wav_file(request):
+    """
+    Get the uploaded audio, either as a raw audio/wav body or as the "file" part of a form upload.
+    :return: (True, audio bytes) or (False, error message)
+    """
+    body = await read_capped(request, MAX_AUDIO_UPLOAD_BYTES)
+    mimetype = request.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+
+    # raw body upload
+    if mimetype in ALLOWED_MIMETYPES:
+        if not body:
+            return False, "No audio in request"
+        return await prepare_wav(body)
+
+    # check if the post request has the file part
+    if mimetype != "multipart/form-data":
+        return False, "No file in request"
+    form = await MultiPartParser(request.headers, _replay(body)).parse()
+    file = form.get("file")
+    if file is None or isinstance(file, str):
+        return False, "No file in request"
+    if file.filename == '':
+        return False, "No filename in request"
+    if allowed_file(file.filename):
+        return await prepare_wav(await file.read())
+    return False, "File not allowed"
+
+
+async def prepare_wav(audio):
+    """
+    Check audio against the speaker service's requirements, converting it off the event loop if
+    AUDIO_NORMALIZE is on.
+    :return: (True, audio bytes) or (False, error message)
+    """
+    try:
+        return True, await asyncio.get_event_loop().run_in_executor(
+            None, wav_audio.prepare_wav, audio, AUDIO_MIN_DURATION, AUDIO_MAX_DURATION, AUDIO_NORMALIZE)
+    except wav_audio.WavError as e:
+        return False, str(e)
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise HTTPException(400)
+
+
+async def speech_create(request):
+    """
+    Create a new speech profile
+    :return:
+    """
+    response = await get_client().create_profile("en-us")
+    return PlainTextResponse(response.get_profile_id())
+
+
+async def speech_enroll(request):
+    """
+    Enroll profile using a voice clip. Must be done three successful times. The profile is bound to
+    the user the ticket was issued to, and audio is refused for a profile bound to another user.
+    :return: number of remaining enrollments
+    """
+    id = request.query_params.get("id")
+    ticket = request.query_params.get("ticket")
+    if id is None or ticket is None:
+        raise HTTPException(400)
+
+    db = await get_db()
+    try:
+        email = await db.get_ticket_user(ticket)
+        owner = await db.get_speech_profile_owner(id)
+    except ValueError:
+        raise HTTPException(400)
+    if email is None:
+        raise HTTPException(401)
+    if owner is not None and owner != email:
+        raise HTTPException(403)
+
+    success, response = await get_wav_file(request)
+    if not success:
+        return PlainTextResponse(response)
+    enroll = await get_client().enroll_profile(id, response, force_short_audio=True)
+    if enroll.get_enrollment_status() == "Enrolled":
+        await db.set_speech_profile(email, id)
+    return PlainTextResponse(str(enroll.get_remaining_speech_time()))
+
+
+async def identification_result(result):
+    """
+    Report who a voice clip was identified as; see auth_api.identification_result.
+    """
+    try:
+        name = await (await get_db()).get_speech_profile_name(result.get_identified_profile_id())
+    except ValueError:
+        name = None
+    return JSON({"id": name, "confidence": result.get_confidence(), "identified": name is not None})
+
+
+async def speech_login(request):
+    """
+    Login using a voice clip; see auth_api.speech_login for the request and response formats.
+    """
+    email = request.query_params.get("email")
+    await throttle(request, email, cost=RATE_LIMIT_SPEECH_COST)
+    client = get_client()
+    success, response = await get_wav_file(request)
+    if not success:
+        return PlainTextResponse(response)
+    if email is not None:
+        return await verify_speaker(client, email, response)
+    all_profiles = await get_profile_registry().enrolled_profile_ids()
+
+    if request.query_params.get("wait", "true").lower() != "false":
+        result = await client.identify_file(response, all_profiles, force_short_audio=True)
+        return await identification_result(result)
+
+    operation_id, result = await client.submit_identification(response, all_profiles, force_short_audio=True)
+    if result is not None:
+        return await identification_result(result)
+    return operation_pending(request, operation_id)
+
+
+async def verify_speaker(client, email, audio):
+    """
+    Check a voice clip against one user's enrolled profile; see auth_api.verify_speaker, including
+    why uncalibrated backends are refused.
+    """
+    if not client.is_calibrated():
+        return not_logged_in("Speech login is unavailable until more users have enrolled")
+    db = await get_db()
+    profile_id = await db.get_speech_profile(email)
+    if profile_id is not None:
+        result = await client.identify_file(audio, [profile_id], force_short_audio=True)
+        if result.get_identified_profile_id() == profile_id and result.is_high_confidence_match():
+            return await logged_in(db, email)
+    return not_logged_in()
+
+
+async def logged_in(db, email):
+    """ Issue a ticket and a refresh token; see auth_api.logged_in. """
+    ticket, issued, expiry = await db.issue_ticket(email)
+    return JSON({
+        "ticket": ticket,
+        "issued": issued,
+        "expiry": expiry,
+        "refresh_token": await db.issue_refresh_token(email),
+        "authenticated": True
+    })
+
+
+def not_logged_in(error=None):
+    return JSON({
+        "ticket": None,
+        "issued": None,
+        "expiry": None,
+        "refresh_token": None,
+        "authenticated": False,
+        "error": error
+    })
+
+
+async def speech_login_status(request):
+    """
+    Check once on a speech login submitted with wait=false; only its submitter gets an answer.
+    """
+    operation_id = tickets.verify_operation(SPEECH_OPERATION_KEY, request.path_params["operation"],
+                                            _client_host(request))
+    if operation_id is None:
+        raise HTTPException(404)
+    try:
+        result = await get_client().get_identification_result(operation_id)
+    except ValueError:
+        raise HTTPException(404)
+    if result is None:
+        return operation_pending(request, operation_id)
+    return await identification_result(result)
+
+
+def operation_pending(request, operation_id):
+    operation = tickets.sign_operation(SPEECH_OPERATION_KEY, operation_id, _client_host(request))
+    return JSON({"operation": operation, "status": "running"}, status_code=202,
+                headers={"Location": app.url_path_for("speech_login_status", operation=operation)})
+
+
+async def text_login(request):
+    """
+    Login using a traditional e-mail/password approach.
+    """
+    body = await _json_body(request)
+    try:
+        email = body['email']
+        password = body['password']
+    except (KeyError, TypeError):
+        raise HTTPException(400)
+    if not isinstance(email, str) or not isinstance(password, str):
+        raise HTTPException(400)
+
+    await throttle(request, email)
+    db = await get_db()
+    if await db.check_login_text(email, password):
+        return await logged_in(db, email)
+    else:
+        return not_logged_in()
+
+
+async def refresh(request):
+    """
+    Exchange a refresh token for a new ticket; see auth_api.refresh.
+    """
+    body = await _json_body(request)
+    try:
+        refresh_token = body['refresh_token']
+    except (KeyError, TypeError):
+        raise HTTPException(400)
+
+    try:
+        refreshed = await (await get_db()).refresh_ticket(refresh_token)
+    except ValueError:
+        raise HTTPException(400)
+
+    if refreshed is None:
+        return not_logged_in()
+    ticket, issued, expiry, refresh_token = refreshed
+    return JSON({
+        "ticket": ticket,
+        "issued": issued,
+        "expiry": expiry,
+        "refresh_token": refresh_token,
+        "authenticated": True
+    })
+
+
+async def check_ticket(request):
+    """
+    Checks that a provided ticket exists in the database and has not expired.
+    """
+    ticket = request.query_params.get("ticket")
+    if ticket is None:
+        raise HTTPException(400)
+
+    try:
+        authenticated = await (await get_db()).check_ticket(ticket)
+    except ValueError:
+        raise HTTPException(400)
+
+    return JSON({
+        "authenticated": authenticated
+    })
+
+
+async def check_ticket_batch(request):
+    """
+    Checks many tickets in one request, with at most one database round-trip.
+    """
+    body = await _json_body(request)
+    try:
+        ticket_list = body['tickets']
+    except (KeyError, TypeError):
+        raise HTTPException(400)
+    if not isinstance(ticket_list, list) or len(ticket_list) > TICKET_BATCH_MAX_SIZE:
+        raise HTTPException(400)
+
+    expiries = await (await get_db()).check_tickets(ticket_list)
+    return JSON({
+        "results": [{"authenticated": expiry is not None, "expiry": expiry} for expiry in expiries]
+    })
+
+
+async def logout(request):
+    """
+    Revokes a ticket before it expires, and ends its session if the refresh token is given.
+    """
+    body = await _json_body(request)
+    try:
+        ticket = body['ticket']
+        refresh_token = body.get('refresh_token')
+    except (KeyError, TypeError):
+        raise HTTPException(400)
+    if not isinstance(ticket, str):
+        raise HTTPException(400)
+
+    db = await get_db()
+    try:
+        revoked = await db.revoke_ticket(ticket)
+        session_ended = refresh_token is not None and await db.revoke_refresh_token(refresh_token)
+    except ValueError:
+        raise HTTPException(400)
+
+    return JSON({
+        "revoked": revoked,
+        "session_ended": session_ended
+    })
+
+
+async def stats(request):
+    """
+    Process-local runtime statistics for scraping.
+    """
+    limiter = rate_limit.get_rate_limiter()
+    return JSON({
+        "db_pool": auth_db_async.pool_stats(),
+        "ticket_cache": auth_db.get_ticket_cache().stats(),
+        "rate_limit": limiter.stats() if limiter else None
+    })
+
+
+async def prometheus_metrics(request):
+    """
+    Route, SQL and speaker service latency histograms plus pool and cache gauges, in the
+    Prometheus text exposition format.
+    """
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    if _identification:
+        await _identification.close()
+    await auth_db_async.close_pool()
+
+
+app = Starlette(
+    routes=[
+        Route('/create/speech-profile', speech_create),
+        Route('/enroll/speech', speech_enroll, methods=['POST']),
+        Route('/login/speech', speech_login, methods=['POST']),
+        Route('/login/speech/{operation}', speech_login_status, methods=['GET']),
+        Route('/login/text', text_login, methods=['POST']),
+        Route('/auth/check', check_ticket, methods=['GET']),
+        Route('/auth/check/batch', check_ticket_batch, methods=['POST']),
+        Route('/auth/refresh', refresh, methods=['POST']),
+        Route('/auth/logout', logout, methods=['POST']),
+        Route('/stats', stats, methods=['GET']),
+        Route('/metrics', prometheus_metrics, methods=['GET']),
+    ],
+    middleware=[Middleware(RequestTimer), Middleware(HTTPSRedirectMiddleware)],
+    exception_handlers={
+        db_pool.PoolTimeout: db_pool_exhausted,
+        passwords.HasherBusy: password_hasher_busy,
+        rate_limit.RateLimited: rate_limited,
+        IdentificationServiceError.CircuitOpenError: speaker_service_overloaded,
+        IdentificationServiceError.ServiceThrottledError: speaker_service_overloaded,
+        IdentificationServiceError.ServiceUnavailableError: speaker_service_unavailable,
+        IdentificationServiceError.ProfileNotFoundError: speaker_profile_not_found,
+        IdentificationServiceError.RequestRejectedError: speaker_request_rejected,
+        IdentificationServiceError.OperationFailedError: speaker_operation_failed,
+        IdentificationServiceError.IdentificationServiceError: speaker_service_error,
+    },
+    lifespan=lifespan)
@@ -1,68 +1,610 @@
+import atexit
+import logging
 import os
 import hashlib
-import psycopg2
+import threading
+import time
+import uuid
+import metrics
+import passwords
+import tickets
 from datetime import datetime, timedelta
-from settings import DB_NAME, DB_URL, DB_UNAME, DB_PASSWORD, TICKET_EXP_TIME
+from db_pool import ConnectionPool
+from db_replicas import ReplicaRouter
+from settings import DB_NAME, DB_URL, DB_UNAME, DB_PASSWORD, TICKET_EXP_TIME, DB_POOL_MIN_SIZE, \
+    DB_POOL_MAX_SIZE, DB_POOL_MAX_AGE, DB_POOL_WAIT_TIMEOUT, DB_POOL_HEALTH_CHECK_INTERVAL, \
+    DB_REPLICA_URLS, DB_REPLICA_MAX_LAG, DB_REPLICA_LAG_CHECK_INTERVAL, DB_REPLICA_FAILOVER_COOLDOWN, \
+    TICKET_CACHE_MAX_ENTRIES, TICKET_CACHE_TTL, TICKET_MODE, TICKET_SIGNING_KEYS, TICKET_SIGNING_KEY_ID, \
+    PASSWORD_HASH_SCHEME, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P, PASSWORD_PBKDF2_ITERATIONS, \
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT, TICKET_WRITE_MODE, \
+    TICKET_WRITE_MAX_BATCH, TICKET_WRITE_MAX_DELAY, TICKET_WRITE_MAX_PENDING, TICKET_WRITE_TIMEOUT, \
+    REFRESH_TOKEN_IDLE_TIME, REFRESH_TOKEN_MAX_AGE, REFRESH_TOKEN_REUSE_GRACE, TICKET_REVOCATION_SYNC_INTERVAL
+from ticket_cache import TicketCache
+from ticket_writer import TicketWriter
+
+_pool = None
+_replica_router = None
+_pool_lock = threading.Lock()
+_ticket_cache = TicketCache(TICKET_CACHE_MAX_ENTRIES, TICKET_CACHE_TTL)
+_ticket_signer = None
+_revocation_list = tickets.RevocationList(TICKET_REVOCATION_SYNC_INTERVAL)
+_password_hasher = None
+_ticket_writer = None
+
+
+QUERY_SECONDS = metrics.REGISTRY.histogram(
+    "auth_db_query_seconds", "Time spent executing each SQL statement.", ["statement"])
+REFRESHES = metrics.REGISTRY.counter(
+    "auth_refreshes_total", "Refresh token exchanges by outcome.", ["outcome"])
+
+# exchange a refresh token: swap in the next token's hash, sliding the expiry up to the maximum age
+_ROTATE_REFRESH_TOKEN = """
+UPDATE data_refresh_tokens
+SET token_hash=%s, previous_hash=token_hash, rotated=%s, expiry=LEAST(%s, created + %s)
+WHERE family_id=%s AND token_hash=%s AND expiry>%s
+RETURNING user_id;
+"""
+
+# end a session presented with one of its replaced tokens, except the last one within the grace period
+_REVOKE_REUSED_REFRESH_TOKEN = """
+DELETE FROM data_refresh_tokens
+WHERE family_id=%s AND token_hash<>%s AND (previous_hash IS DISTINCT FROM %s OR rotated<%s);
+"""
+
+
+def execute(cur, statement, sql, params=None):
+    """
+    Execute a SQL statement, recording its latency under the given statement name.
+    :param cur: Cursor to execute on.
+    :param statement: Short name the latency is reported under.
+    :param sql: SQL string.
+    :param params: Query parameters.
+    """
+    start = time.perf_counter()
+    try:
+        cur.execute(sql, params)
+    finally:
+        QUERY_SECONDS.labels(statement).observe(time.perf_counter() - start)
+
+
+def connect(host=DB_URL):
+    """
+    Open a new, unpooled connection to the authorization DB.
+    :param host: Server to connect to, the primary unless a replica is given.
+    """
+    # imported here so cold starts only pay for psycopg2 once a query is made
+    import psycopg2
+    return psycopg2.connect("dbname=%s user=%s password=%s host=%s" %
+                            (DB_NAME, DB_UNAME, DB_PASSWORD, host))
+
+
+def _new_pool(host, min_size):
+    return ConnectionPool(lambda: connect(host),
+                          min_size=min_size,
+                          max_size=DB_POOL_MAX_SIZE,
+                          max_age=DB_POOL_MAX_AGE,
+                          wait_timeout=DB_POOL_WAIT_TIMEOUT,
+                          health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL)
+
+
+def get_pool():
+    """ Return the process-wide connection pool of the primary, creating it on first use. """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _new_pool(DB_URL, DB_POOL_MIN_SIZE)
+    return _pool
+
+
+def get_replica_router():
+    """ Return the process-wide read replica router, or None when DB_REPLICA_URLS is empty. """
+    global _replica_router
+    if _replica_router is None and DB_REPLICA_URLS:
+        with _pool_lock:
+            if _replica_router is None:
+                # replica pools start empty so an unreachable replica cannot fail start-up
+                _replica_router = ReplicaRouter(
+                    [(host, _new_pool(host, 0)) for host in DB_REPLICA_URLS],
+                    max_lag=DB_REPLICA_MAX_LAG,
+                    lag_check_interval=DB_REPLICA_LAG_CHECK_INTERVAL,
+                    failover_cooldown=DB_REPLICA_FAILOVER_COOLDOWN,
+                    execute=execute)
+    return _replica_router
+
+
+def get_ticket_cache():
+    """ Return the process-wide cache of verified tickets. """
+    return _ticket_cache
+
+
+def get_ticket_signer():
+    """ Return the signer for stateless tickets built from the configured keys. """
+    global _ticket_signer
+    if _ticket_signer is None:
+        _ticket_signer = tickets.TicketSigner(
+            dict((kid, bytes.fromhex(key)) for kid, key in TICKET_SIGNING_KEYS.items()),
+            TICKET_SIGNING_KEY_ID)
+    return _ticket_signer
+
+
+def get_revocation_list():
+    """
+    Return the process-wide list of signed tickets revoked before expiry, a copy of
+    data_revoked_tickets that AuthDBConnection reloads periodically.
+    """
+    return _revocation_list
+
+
+def get_password_hasher():
+    """ Return the process-wide password hasher and its worker pool. """
+    global _password_hasher
+    if _password_hasher is None:
+        with _pool_lock:
+            if _password_hasher is None:
+                _password_hasher = passwords.PasswordHasher(
+                    PASSWORD_HASH_SCHEME, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P,
+                    PASSWORD_PBKDF2_ITERATIONS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING,
+                    PASSWORD_HASH_TIMEOUT)
+    return _password_hasher
+
+
+def get_ticket_writer():
+    """ Return the process-wide batching ticket writer, or None when TICKET_WRITE_MODE is "sync". """
+    global _ticket_writer
+    if _ticket_writer is None and TICKET_WRITE_MODE != "sync":
+        pool = get_pool()
+        with _pool_lock:
+            if _ticket_writer is None:
+                _ticket_writer = TicketWriter(pool,
+                                              max_batch=TICKET_WRITE_MAX_BATCH,
+                                              max_delay=TICKET_WRITE_MAX_DELAY,
+                                              max_pending=TICKET_WRITE_MAX_PENDING,
+                                              execute=execute)
+                # write out what is still queued when the process exits normally
+                atexit.register(_ticket_writer.close, TICKET_WRITE_TIMEOUT)
+    return _ticket_writer
 
 
 class AuthDBConnection(object):
-    """ Class for accessing and persisting a connection to the authorization DB. """
-    def __init__(self):
-        self._conn = psycopg2.connect("dbname=%s user=%s password=%s host=%s" %
-                                      (DB_NAME, DB_UNAME, DB_PASSWORD, DB_URL))
+    """
+    Class for accessing the authorization DB through the shared connection pools. Writes go to the
+    primary; reads go to a read replica when DB_REPLICA_URLS lists any.
+    """
+    def __init__(self, pool=None, ticket_cache=None, ticket_writer=None, replicas=None):
+        self._pool = pool if pool is not None else get_pool()
+        self._ticket_cache = ticket_cache if ticket_cache is not None else get_ticket_cache()
+        self._ticket_writer = ticket_writer if ticket_writer is not None else get_ticket_writer()
+        self._replicas = replicas if replicas is not None else get_replica_router()
+
+    def _read(self, query, on_primary_if=None):
+        """
+        Run a read-only query on a replica when there are any, otherwise on the primary.
+        :param query: Callable taking a connection and returning the query's result.
+        :param on_primary_if: Optional predicate on a replica's result; when it holds the query is
+                              repeated on the primary, e.g. for rows a lagging replica may not have yet.
+        :return: The query's result.
+        """
+        if self._replicas is not None:
+            served, result = self._replicas.read(query)
+            if served and not (on_primary_if is not None and on_primary_if(result)):
+                return result
+            if served:
+                self._replicas.note_fallback()
+
+        with self._pool.connection() as conn:
+            return query(conn)
 
     def check_login_text(self, email, password):
         """
-        Validate a traditional username/password login.
+        Validate a traditional username/password login. Legacy SHA-256 hashes are upgraded to the
+        current scheme on success.
         :param email: Email string.
         :param password: Password string.
         :return: True/false validity of login.
+        :raises passwords.HasherBusy: If too many logins are already being verified.
         """
-        password_hash = hashlib.sha256(password.encode('ascii')).digest()
+        def select_user(conn):
+            cur = conn.cursor()
+            execute(cur, "select_user", "SELECT pwd_hash FROM data_users WHERE email=%s", (email,))
+            return cur.fetchone()
 
-        cur = self._conn.cursor()
-        cur.execute("SELECT * FROM data_users WHERE email=%s AND pwd_hash=%s",
-                    (email, password_hash))
+        # a user missing on a replica may just have signed up
+        row = self._read(select_user, lambda row: row is None)
 
-        if cur.fetchone():
-            # login success
-            return True
-        else:
-            return False
+        # verify outside the connection so hashing never holds a pooled connection
+        stored = bytes(row[0]) if row and row[0] is not None else None
+        hasher = get_password_hasher()
+        valid, needs_rehash = hasher.verify(password, stored)
+
+        if valid and needs_rehash:
+            new_hash = hasher.hash(password)
+            with self._pool.connection() as conn:
+                cur = conn.cursor()
+                execute(cur, "rehash_password",
+                        "UPDATE data_users SET pwd_hash=%s WHERE email=%s AND pwd_hash=%s;",
+                        (new_hash, email, stored))
+                conn.commit()
+
+        return valid
 
     def check_ticket(self, ticket):
         """
         Check whether or not a ticket is valid (not expired and issued by this server).
-        :param ticket: Ticket bytes.
+        Signed tickets are verified in memory; opaque tickets are looked up by hash.
+        :param ticket: Ticket string as returned by issue_ticket.
         :return True/false validity of the ticket.
+        :raises ValueError: If an opaque ticket is not valid hex.
         """
+        if tickets.is_signed(ticket):
+            signed = get_ticket_signer().verify(ticket)
+            return signed is not None and not self._is_revoked(signed)
+
+        return self._check_opaque_ticket(bytes.fromhex(ticket))
+
+    def _is_revoked(self, signed):
+        revocations = get_revocation_list()
+        if revocations.claim_sync():
+            def select_revoked(conn):
+                cur = conn.cursor()
+                execute(cur, "select_revoked_tickets",
+                        "SELECT ticket_id, expiry FROM data_revoked_tickets WHERE expiry>now();", None)
+                return cur.fetchall()
+
+            revocations.update(self._read(select_revoked))
+        return revocations.is_revoked(signed)
+
+    def _check_opaque_ticket(self, ticket):
         ticket_hash = hashlib.sha256(ticket).digest()
+        if self._ticket_cache.get(ticket_hash) is not None:
+            return True
+        if self._ticket_writer is not None and self._ticket_writer.pending(ticket_hash) is not None:
+            return True
 
-        cur = self._conn.cursor()
-        cur.execute("SELECT * FROM data_tickets WHERE ticket_val_hash=%s AND expiry>now();",
-                    (psycopg2.Binary(ticket_hash),))
+        def select_ticket(conn):
+            cur = conn.cursor()
+            execute(cur, "check_ticket",
+                    "SELECT expiry FROM data_tickets WHERE ticket_val_hash=%s AND expiry>now();",
+                    (ticket_hash,))
+            return cur.fetchone()
 
-        if cur.fetchone():
+        # a ticket missing on a replica may have been issued within its replication lag
+        row = self._read(select_ticket, lambda row: row is None)
+
+        if row:
+            self._ticket_cache.put(ticket_hash, row[0])
             return True
         else:
             return False
 
-    def issue_ticket(self):
-        # generate 1024 random bits
-        ticket = os.urandom(128)
-        ticket_hash = hashlib.sha256(ticket).digest()
+    def get_ticket_user(self, ticket):
+        """
+        Find who a valid ticket was issued to, for requests that act on the ticket holder's account.
+        Unlike check_ticket this always reads the ticket row, as the ticket cache holds expiries only.
+        :param ticket: Ticket string as returned by issue_ticket.
+        :return: E-mail of the ticket's user, or None if the ticket is not valid or has no user recorded.
+        :raises ValueError: If an opaque ticket is not valid hex.
+        """
+        if tickets.is_signed(ticket):
+            signed = get_ticket_signer().verify(ticket)
+            if signed is None or self._is_revoked(signed):
+                return None
+            return signed.user_id or None
+
+        ticket_hash = hashlib.sha256(bytes.fromhex(ticket)).digest()
+        if self._ticket_writer is not None:
+            user_id = self._ticket_writer.pending_user(ticket_hash)
+            if user_id is not None:
+                return user_id
+
+        def select_ticket_user(conn):
+            cur = conn.cursor()
+            execute(cur, "select_ticket_user",
+                    "SELECT user_id FROM data_tickets WHERE ticket_val_hash=%s AND expiry>now();",
+                    (ticket_hash,))
+            return cur.fetchone()
+
+        row = self._read(select_ticket_user, lambda row: row is None)
+
+        return row[0] or None if row else None
+
+    def check_tickets(self, ticket_list):
+        """
+        Check many tickets at once. Signed and cached tickets are resolved in memory and all the
+        remaining opaque tickets with a single query.
+        :param ticket_list: List of ticket strings as returned by issue_ticket.
+        :return: List in the same order holding each valid ticket's expiry datetime, or None for
+                 tickets that are invalid, expired or malformed.
+        """
+        results = [None] * len(ticket_list)
+        pending = {}
+
+        for i, ticket in enumerate(ticket_list):
+            if not isinstance(ticket, str):
+                continue
+            if tickets.is_signed(ticket):
+                signed = get_ticket_signer().verify(ticket)
+                if signed is not None and not self._is_revoked(signed):
+                    results[i] = signed.expiry
+                continue
+            try:
+                ticket_hash = hashlib.sha256(bytes.fromhex(ticket)).digest()
+            except ValueError:
+                continue
+            expiry = self._ticket_cache.get(ticket_hash)
+            if expiry is None and self._ticket_writer is not None:
+                expiry = self._ticket_writer.pending(ticket_hash)
+            if expiry is not None:
+                results[i] = expiry
+            else:
+                pending.setdefault(ticket_hash, []).append(i)
+
+        if pending:
+            def select_tickets(conn, hashes):
+                cur = conn.cursor()
+                execute(cur, "check_tickets",
+                        "SELECT ticket_val_hash, expiry FROM data_tickets "
+                        "WHERE ticket_val_hash=ANY(%s) AND expiry>now();",
+                        (hashes,))
+                return [(bytes(ticket_hash), expiry) for ticket_hash, expiry in cur.fetchall()]
+
+            hashes = list(pending)
+            served, rows = self._replicas.read(lambda conn: select_tickets(conn, hashes)) \
+                if self._replicas is not None else (False, None)
+            if served:
+                # ask the primary only about tickets the replica may not have caught up with
+                found = set(ticket_hash for ticket_hash, _ in rows)
+                hashes = [ticket_hash for ticket_hash in hashes if ticket_hash not in found]
+                if hashes:
+                    self._replicas.note_fallback()
+            else:
+                rows = []
+            if hashes:
+                with self._pool.connection() as conn:
+                    rows.extend(select_tickets(conn, hashes))
+
+            for ticket_hash, expiry in rows:
+                self._ticket_cache.put(ticket_hash, expiry)
+                for i in pending.get(ticket_hash, ()):
+                    results[i] = expiry
+
+        return results
+
+    def revoke_ticket(self, ticket):
+        """
+        Invalidate a ticket before its expiry.
+        :param ticket: Ticket string as returned by issue_ticket.
+        :return: True if a live ticket was revoked.
+        :raises ValueError: If an opaque ticket is not valid hex.
+        """
+        if tickets.is_signed(ticket):
+            signed = get_ticket_signer().verify(ticket)
+            if signed is None:
+                return False
+            with self._pool.connection() as conn:
+                cur = conn.cursor()
+                execute(cur, "revoke_signed_ticket",
+                        "INSERT INTO data_revoked_tickets (ticket_id, expiry) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
+                        (signed.ticket_id, signed.expiry))
+                conn.commit()
+            get_revocation_list().revoke(signed)
+            return True
+
+        ticket_hash = hashlib.sha256(bytes.fromhex(ticket)).digest()
+        self._ticket_cache.invalidate(ticket_hash)
+        if self._ticket_writer is not None and self._ticket_writer.cancel(ticket_hash, TICKET_WRITE_TIMEOUT):
+            # never reached the database
+            return True
+
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            execute(cur, "revoke_ticket", "DELETE FROM data_tickets WHERE ticket_val_hash=%s;",
+                    (ticket_hash,))
+            revoked = cur.rowcount > 0
+            conn.commit()
 
+        return revoked
+
+    def issue_ticket(self, user_id=""):
+        """
+        Issue a new ticket in the configured TICKET_MODE. Opaque tickets are stored according to
+        TICKET_WRITE_MODE, and are valid for check_ticket in this process as soon as this returns.
+        :param user_id: E-mail of the authenticated user, embedded in signed tickets.
+        :return: Tuple of ticket string, issued datetime and expiry datetime.
+        :raises ticket_writer.TicketQueueFull: If too many tickets are waiting to be written.
+        """
         # determine issue and expiry time
-        issued_time = datetime.utcnow()
+        issued_time = datetime.utcnow().replace(microsecond=0)
         expiry_time = issued_time + timedelta(seconds=TICKET_EXP_TIME)
 
+        if TICKET_MODE == "signed":
+            return get_ticket_signer().issue(user_id, issued_time, expiry_time), issued_time, expiry_time
+
+        # generate 1024 random bits
+        ticket = os.urandom(128)
+        ticket_hash = hashlib.sha256(ticket).digest()
+
         # log hash of ticket (SHA256), issued time, expiry time
-        cur = self._conn.cursor()
-        cur.execute("INSERT INTO data_tickets VALUES (%s, %s, %s);",
-                    (ticket_hash, issued_time, expiry_time))
-        self._conn.commit()
+        if self._ticket_writer is not None:
+            written = self._ticket_writer.submit(ticket_hash, issued_time, expiry_time, user_id)
+            if TICKET_WRITE_MODE == "group":
+                written.result(TICKET_WRITE_TIMEOUT)
+        else:
+            with self._pool.connection() as conn:
+                cur = conn.cursor()
+                execute(cur, "issue_ticket",
+                        "INSERT INTO data_tickets (ticket_val_hash, issued, expiry, user_id) VALUES (%s, %s, %s, %s);",
+                        (ticket_hash, issued_time, expiry_time, user_id))
+                conn.commit()
+        self._ticket_cache.put(ticket_hash, expiry_time)
 
         return ticket.hex(), issued_time, expiry_time
 
+    def issue_refresh_token(self, user_id):
+        """
+        Start a session that refresh_ticket renews without the user logging in again.
+        :param user_id: E-mail of the authenticated user.
+        :return: Refresh token string.
+        """
+        token, family_id, token_hash = tickets.new_refresh_token()
+        now = datetime.utcnow().replace(microsecond=0)
+        expiry = now + timedelta(seconds=min(REFRESH_TOKEN_IDLE_TIME, REFRESH_TOKEN_MAX_AGE))
+
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            execute(cur, "issue_refresh_token",
+                    "INSERT INTO data_refresh_tokens (family_id, user_id, token_hash, created, expiry) "
+                    "VALUES (%s, %s, %s, %s, %s);",
+                    (family_id, user_id, token_hash, now, expiry))
+            conn.commit()
+
+        return token
+
+    def refresh_ticket(self, refresh_token):
+        """
+        Exchange a refresh token for a new ticket and the refresh token replacing it. Presenting a
+        refresh token that was already exchanged ends its session, as the token has been copied.
+        :param refresh_token: Refresh token string from issue_refresh_token or a previous refresh.
+        :return: Tuple of ticket string, issued datetime, expiry datetime and new refresh token string,
+        or None if the refresh token is not valid.
+        :raises ValueError: If the refresh token is malformed.
+        """
+        family_id, token_hash = tickets.parse_refresh_token(refresh_token)
+        new_token, _, new_hash = tickets.new_refresh_token(family_id)
+        now = datetime.utcnow().replace(microsecond=0)
+
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            execute(cur, "rotate_refresh_token", _ROTATE_REFRESH_TOKEN,
+                    (new_hash, now, now + timedelta(seconds=REFRESH_TOKEN_IDLE_TIME),
+                     timedelta(seconds=REFRESH_TOKEN_MAX_AGE), family_id, token_hash, now))
+            row = cur.fetchone()
+            reused = False
+            if row is None:
+                execute(cur, "revoke_reused_refresh_token", _REVOKE_REUSED_REFRESH_TOKEN,
+                        (family_id, token_hash, token_hash, now - timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE)))
+                reused = cur.rowcount > 0
+            conn.commit()
+
+        if row is None:
+            if reused:
+                logging.warning("Refresh token reused, ended session %s", family_id.hex())
+            REFRESHES.labels("reused" if reused else "rejected").inc()
+            return None
+
+        REFRESHES.labels("rotated").inc()
+        return self.issue_ticket(row[0]) + (new_token,)
+
+    def revoke_refresh_token(self, refresh_token):
+        """
+        End the session of a refresh token, e.g. on logout.
+        :param refresh_token: The session's current refresh token string.
+        :return: True if a live session was ended.
+        :raises ValueError: If the refresh token is malformed.
+        """
+        family_id, token_hash = tickets.parse_refresh_token(refresh_token)
+
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            execute(cur, "revoke_refresh_token",
+                    "DELETE FROM data_refresh_tokens WHERE family_id=%s AND token_hash=%s;",
+                    (family_id, token_hash))
+            revoked = cur.rowcount > 0
+            conn.commit()
+
+        return revoked
+
+    def get_enrolled_speech_profiles(self):
+        """
+        List the speaker profiles of users whose speech enrollment has completed.
+        :return: List of profile id strings.
+        """
+        def select_profiles(conn):
+            cur = conn.cursor()
+            execute(cur, "enrolled_speech_profiles",
+                    "SELECT speech_profile_hash FROM data_users WHERE length(speech_profile_hash)=16;")
+            return cur.fetchall()
+
+        rows = self._read(select_profiles)
+
+        return [str(uuid.UUID(bytes=bytes(row[0]))) for row in rows]
+
+    def get_speech_profile(self, email):
+        """
+        Find the speaker profile a user enrolled, to verify a speech login against that profile alone.
+        :param email: Email string.
+        :return: Profile id string, or None if the user does not exist or has not enrolled.
+        """
+        def select_profile(conn):
+            cur = conn.cursor()
+            execute(cur, "select_speech_profile",
+                    "SELECT speech_profile_hash FROM data_users WHERE email=%s "
+                    "AND length(speech_profile_hash)=16;", (email,))
+            return cur.fetchone()
+
+        # a user missing on a replica may just have enrolled
+        row = self._read(select_profile, lambda row: row is None)
+
+        return str(uuid.UUID(bytes=bytes(row[0]))) if row else None
+
+    def get_speech_profile_owner(self, profile_id):
+        """
+        Find the user a speaker profile is bound to, so audio is only enrolled into a profile by its owner.
+        :param profile_id: Speaker profile id string.
+        :return: E-mail of the user, or None if no user has the profile.
+        :raises ValueError: If profile_id is not a UUID.
+        """
+        profile_hash = uuid.UUID(profile_id).bytes
+
+        def select_owner(conn):
+            cur = conn.cursor()
+            execute(cur, "select_speech_profile_owner",
+                    "SELECT email FROM data_users WHERE speech_profile_hash=%s "
+                    "AND length(speech_profile_hash)=16;", (profile_hash,))
+            return cur.fetchone()
+
+        # a profile missing on a replica may just have been bound
+        row = self._read(select_owner, lambda row: row is None)
+
+        return row[0] if row else None
+
+    def get_speech_profile_name(self, profile_id):
+        """
+        Find the name of the user a speaker profile is bound to, to report who a voice clip identified.
+        :param profile_id: Speaker profile id string.
+        :return: Preferred first name of the user, or None if no user has the profile.
+        :raises ValueError: If profile_id is not a UUID.
+        """
+        profile_hash = uuid.UUID(profile_id).bytes
+
+        def select_name(conn):
+            cur = conn.cursor()
+            execute(cur, "select_speech_profile_name",
+                    "SELECT COALESCE(preferred_first_name, first_name) FROM data_users "
+                    "WHERE speech_profile_hash=%s AND length(speech_profile_hash)=16;", (profile_hash,))
+            return cur.fetchone()
+
+        # a profile missing on a replica may just have been bound
+        row = self._read(select_name, lambda row: row is None)
+
+        return row[0] if row else None
+
+    def set_speech_profile(self, email, profile_id):
+        """
+        Record the enrolled speaker profile of a user, stored as the 16 raw bytes of its UUID.
+        :param email: Email string.
+        :param profile_id: Speaker profile id string.
+        :return: True if the user exists.
+        """
+        with self._pool.connection() as conn:
+            cur = conn.cursor()
+            execute(cur, "set_speech_profile", "UPDATE data_users SET speech_profile_hash=%s WHERE email=%s;",
+                    (uuid.UUID(profile_id).bytes, email))
+            updated = cur.rowcount > 0
+            conn.commit()
+
+        return updated
+
     def close(self):
-        self._conn.close()
+        """ Release this handle. Pooled connections stay open for reuse by later requests. """
+        self._pool = None
@@ -0,0 +1,424 @@
+"""
+asyncpg counterpart of auth_db for the ASGI app (auth_asgi.py).
+
+Queries and results match AuthDBConnection; the ticket cache, ticket signer, revocation list and
+password hasher are the same process-wide objects auth_db hands out.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import asyncpg
+
+import auth_db
+import passwords
+import tickets
+from db_pool import PoolTimeout
+from settings import DB_NAME, DB_URL, DB_UNAME, DB_PASSWORD, TICKET_EXP_TIME, DB_POOL_MIN_SIZE, \
+    DB_POOL_MAX_SIZE, DB_POOL_MAX_AGE, DB_POOL_WAIT_TIMEOUT, TICKET_MODE, REFRESH_TOKEN_IDLE_TIME, \
+    REFRESH_TOKEN_MAX_AGE, REFRESH_TOKEN_REUSE_GRACE
+
+_pool = None
+_pool_lock = None
+
+
+async def get_pool():
+    """ Return the event loop's connection pool, creating it on first use. """
+    global _pool, _pool_lock
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(host=DB_URL, database=DB_NAME, user=DB_UNAME,
+                                                  password=DB_PASSWORD,
+                                                  min_size=DB_POOL_MIN_SIZE,
+                                                  max_size=DB_POOL_MAX_SIZE,
+                                                  max_inactive_connection_lifetime=DB_POOL_MAX_AGE)
+    return _pool
+
+
+async def close_pool():
+    """ Close the pool's connections, e.g. on application shutdown. """
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+def pool_stats():
+    """ :return: Dict of pool size figures, empty before the pool exists. """
+    if _pool is None:
+        return {}
+    size, idle = _pool.get_size(), _pool.get_idle_size()
+    return {"size": size, "idle": idle, "in_use": size - idle, "max_size": _pool.get_max_size()}
+
+
+class _Acquire(object):
+    """ pool.acquire() that raises db_pool.PoolTimeout, like the synchronous pool, when it times out. """
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    async def __aenter__(self):
+        try:
+            self._conn = await self._pool.acquire(timeout=DB_POOL_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolTimeout("No database connection available within %ss" % DB_POOL_WAIT_TIMEOUT)
+        return self._conn
+
+    async def __aexit__(self, *exc_info):
+        await self._pool.release(self._conn)
+
+
+async def query(conn, statement, method, sql, *args):
+    """
+    Run a query on a connection, recording its latency under the given statement name.
+    :param conn: asyncpg connection.
+    :param statement: Short name the latency is reported under.
+    :param method: Connection method to call: "fetch", "fetchrow", "fetchval" or "execute".
+    :param sql: SQL string with $n placeholders.
+    :param args: Query parameters.
+    """
+    start = time.perf_counter()
+    try:
+        return await getattr(conn, method)(sql, *args)
+    finally:
+        auth_db.QUERY_SECONDS.labels(statement).observe(time.perf_counter() - start)
+
+
+_ROTATE_REFRESH_TOKEN = """
+UPDATE data_refresh_tokens
+SET token_hash=$1, previous_hash=token_hash, rotated=$2, expiry=LEAST($3, created + $4::interval)
+WHERE family_id=$5 AND token_hash=$6 AND expiry>$2
+RETURNING user_id;
+"""
+
+_REVOKE_REUSED_REFRESH_TOKEN = """
+DELETE FROM data_refresh_tokens
+WHERE family_id=$1 AND token_hash<>$2 AND (previous_hash IS DISTINCT FROM $2 OR rotated<$3);
+"""
+
+
+async def _hashed(future, timeout):
+    """
+    Await a password hasher future.
+    :raises passwords.HasherBusy: If it does not finish within timeout seconds.
+    """
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        raise passwords.HasherBusy("Password hash did not finish within %s seconds" % timeout)
+
+
+def _rowcount(status):
+    # asyncpg returns the command tag, e.g. "DELETE 1"
+    return int(status.rsplit(" ", 1)[-1])
+
+
+class AsyncAuthDB(object):
+    """ Class for accessing the authorization DB through the event loop's connection pool. """
+    def __init__(self, pool, ticket_cache=None):
+        self._pool = pool
+        self._ticket_cache = ticket_cache if ticket_cache is not None else auth_db.get_ticket_cache()
+
+    def _connection(self):
+        return _Acquire(self._pool)
+
+    async def check_login_text(self, email, password):
+        """
+        Validate a traditional username/password login. Legacy SHA-256 hashes are upgraded to the
+        current scheme on success.
+        :param email: Email string.
+        :param password: Password string.
+        :return: True/false validity of login.
+        :raises passwords.HasherBusy: If too many logins are already being verified.
+        """
+        async with self._connection() as conn:
+            stored = await query(conn, "select_user", "fetchval",
+                                 "SELECT pwd_hash FROM data_users WHERE email=$1", email)
+
+        # hashing runs on the hasher's own threads and never holds a pooled connection
+        hasher = auth_db.get_password_hasher()
+        valid, needs_rehash = await _hashed(hasher.submit_verify(password, stored), hasher.timeout)
+
+        if valid and needs_rehash:
+            new_hash = await _hashed(hasher.submit_hash(password), hasher.timeout)
+            async with self._connection() as conn:
+                await query(conn, "rehash_password", "execute",
+                            "UPDATE data_users SET pwd_hash=$1 WHERE email=$2 AND pwd_hash=$3;",
+                            new_hash, email, bytes(stored))
+
+        return valid
+
+    async def check_ticket(self, ticket):
+        """
+        Check whether or not a ticket is valid (not expired and issued by this server).
+        :param ticket: Ticket string as returned by issue_ticket.
+        :return True/false validity of the ticket.
+        :raises ValueError: If an opaque ticket is not valid hex.
+        """
+        if tickets.is_signed(ticket):
+            signed = auth_db.get_ticket_signer().verify(ticket)
+            return signed is not None and not await self._is_revoked(signed)
+
+        ticket_hash = hashlib.sha256(bytes.fromhex(ticket)).digest()
+        if self._ticket_cache.get(ticket_hash) is not None:
+            return True
+
+        async with self._connection() as conn:
+            expiry = await query(conn, "check_ticket", "fetchval",
+                                 "SELECT expiry FROM data_tickets WHERE ticket_val_hash=$1 AND expiry>now();",
+                                 ticket_hash)
+
+        if expiry is not None:
+            self._ticket_cache.put(ticket_hash, expiry)
+            return True
+        return False
+
+    async def _is_revoked(self, signed):
+        revocations = auth_db.get_revocation_list()
+        if revocations.claim_sync():
+            async with self._connection() as conn:
+                rows = await query(conn, "select_revoked_tickets", "fetch",
+                                   "SELECT ticket_id, expiry FROM data_revoked_tickets WHERE expiry>now();")
+            revocations.update(rows)
+        return revocations.is_revoked(signed)
+
+    async def get_ticket_user(self, ticket):
+        """
+        Find who a valid ticket was issued to; see AuthDBConnection.get_ticket_user.
+        :param ticket: Ticket string as returned by issue_ticket.
+        :return: E-mail of the ticket's user, or None if the ticket is not valid or has no user recorded.
+        :raises ValueError: If an opaque ticket is not valid hex.
+        """
+        if tickets.is_signed(ticket):
+            signed = auth_db.get_ticket_signer().verify(ticket)
+            if signed is None or await self._is_revoked(signed):
+                return None
+            return signed.user_id or None
+
+        ticket_hash = hashlib.sha256(bytes.fromhex(ticket)).digest()
+        async with self._connection() as conn:
+            user_id = await query(conn, "select_ticket_user", "fetchval",
+                                  "SELECT user_id FROM data_tickets WHERE ticket_val_hash=$1 AND expiry>now();",
+                                  ticket_hash)
+        return user_id or None
+
+    async def check_tickets(self, ticket_list):
+        """
+        Check many tickets at once, with at most one query.
+        :param ticket_list: List of ticket strings as returned by issue_ticket.
+        :return: List in the same order holding each valid ticket's expiry datetime, or None.
+        """
+        results = [None] * len(ticket_list)
+        pending = {}
+
+        for i, ticket in enumerate(ticket_list):
+            if not isinstance(ticket, str):
+                continue
+            if tickets.is_signed(ticket):
+                signed = auth_db.get_ticket_signer().verify(ticket)
+                if signed is not None and not await self._is_revoked(signed):
+                    results[i] = signed.expiry
+                continue
+            try:
+                ticket_hash = hashlib.sha256(bytes.fromhex(ticket)).digest()
+            except ValueError:
+                continue
+            expiry = self._ticket_cache.get(ticket_hash)
+            if expiry is not None:
+                results[i] = expiry
+            else:
+                pending.setdefault(ticket_hash, []).append(i)
+
+        if pending:
+            async with self._connection() as conn:
+                rows = await query(conn, "check_tickets", "fetch",
+                                   "SELECT ticket_val_hash, expiry FROM data_tickets "
+                                   "WHERE ticket_val_hash=ANY($1::bytea[]) AND expiry>now();",
+                                   list(pending))
+
+            for ticket_hash, expiry in rows:
+                self._ticket_cache.put(ticket_hash, expiry)
+                for i in pending.get(ticket_hash, ()):
+                    results[i] = expiry
+
+        return results
+
+    async def revoke_ticket(self, ticket):
+        """
+        Invalidate a ticket before its expiry.
+        :param ticket: Ticket string as returned by issue_ticket.
+        :return: True if a live ticket was revoked.
+        :raises ValueError: If an opaque ticket is not valid hex.
+        """
+        if tickets.is_signed(ticket):
+            signed = auth_db.get_ticket_signer().verify(ticket)
+            if signed is None:
+                return False
+            async with self._connection() as conn:
+                await query(conn, "revoke_signed_ticket", "execute",
+                            "INSERT INTO data_revoked_tickets (ticket_id, expiry) VALUES ($1, $2) ON CONFLICT DO NOTHING;",
+                            signed.ticket_id, signed.expiry)
+            auth_db.get_revocation_list().revoke(signed)
+            return True
+
+        ticket_hash = hashlib.sha256(bytes.fromhex(ticket)).digest()
+        self._ticket_cache.invalidate(ticket_hash)
+
+        async with self._connection() as conn:
+            status = await query(conn, "revoke_ticket", "execute",
+                                 "DELETE FROM data_tickets WHERE ticket_val_hash=$1;", ticket_hash)
+        return _rowcount(status) > 0
+
+    async def issue_ticket(self, user_id=""):
+        """
+        Issue a new ticket in the configured TICKET_MODE.
+        :param user_id: E-mail of the authenticated user, embedded in signed tickets.
+        :return: Tuple of ticket string, issued datetime and expiry datetime.
+        """
+        issued_time = datetime.utcnow().replace(microsecond=0)
+        expiry_time = issued_time + timedelta(seconds=TICKET_EXP_TIME)
+
+        if TICKET_MODE == "signed":
+            return auth_db.get_ticket_signer().issue(user_id, issued_time, expiry_time), issued_time, expiry_time
+
+        ticket = os.urandom(128)
+        ticket_hash = hashlib.sha256(ticket).digest()
+
+        async with self._connection() as conn:
+            await query(conn, "issue_ticket", "execute",
+                        "INSERT INTO data_tickets (ticket_val_hash, issued, expiry, user_id) VALUES ($1, $2, $3, $4);",
+                        ticket_hash, issued_time, expiry_time, user_id)
+        self._ticket_cache.put(ticket_hash, expiry_time)
+
+        return ticket.hex(), issued_time, expiry_time
+
+    async def issue_refresh_token(self, user_id):
+        """
+        Start a session that refresh_ticket renews; see AuthDBConnection.issue_refresh_token.
+        :param user_id: E-mail of the authenticated user.
+        :return: Refresh token string.
+        """
+        token, family_id, token_hash = tickets.new_refresh_token()
+        now = datetime.utcnow().replace(microsecond=0)
+        expiry = now + timedelta(seconds=min(REFRESH_TOKEN_IDLE_TIME, REFRESH_TOKEN_MAX_AGE))
+
+        async with self._connection() as conn:
+            await query(conn, "issue_refresh_token", "execute",
+                        "INSERT INTO data_refresh_tokens (family_id, user_id, token_hash, created, expiry) "
+                        "VALUES ($1, $2, $3, $4, $5);", family_id, user_id, token_hash, now, expiry)
+        return token
+
+    async def refresh_ticket(self, refresh_token):
+        """
+        Exchange a refresh token for a new ticket and the refresh token replacing it; see
+        AuthDBConnection.refresh_ticket.
+        :param refresh_token: Refresh token string from issue_refresh_token or a previous refresh.
+        :return: Tuple of ticket string, issued datetime, expiry datetime and new refresh token string,
+        or None if the refresh token is not valid.
+        :raises ValueError: If the refresh token is malformed.
+        """
+        family_id, token_hash = tickets.parse_refresh_token(refresh_token)
+        new_token, _, new_hash = tickets.new_refresh_token(family_id)
+        now = datetime.utcnow().replace(microsecond=0)
+
+        async with self._connection() as conn:
+            user_id = await query(conn, "rotate_refresh_token", "fetchval", _ROTATE_REFRESH_TOKEN,
+                                  new_hash, now, now + timedelta(seconds=REFRESH_TOKEN_IDLE_TIME),
+                                  timedelta(seconds=REFRESH_TOKEN_MAX_AGE), family_id, token_hash)
+            reused = False
+            if user_id is None:
+                status = await query(conn, "revoke_reused_refresh_token", "execute", _REVOKE_REUSED_REFRESH_TOKEN,
+                                     family_id, token_hash, now - timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE))
+                reused = _rowcount(status) > 0
+
+        if user_id is None:
+            if reused:
+                logging.warning("Refresh token reused, ended session %s", family_id.hex())
+            auth_db.REFRESHES.labels("reused" if reused else "rejected").inc()
+            return None
+
+        auth_db.REFRESHES.labels("rotated").inc()
+        return await self.issue_ticket(user_id) + (new_token,)
+
+    async def revoke_refresh_token(self, refresh_token):
+        """
+        End the session of a refresh token, e.g. on logout.
+        :param refresh_token: The session's current refresh token string.
+        :return: True if a live session was ended.
+        :raises ValueError: If the refresh token is malformed.
+        """
+        family_id, token_hash = tickets.parse_refresh_token(refresh_token)
+
+        async with self._connection() as conn:
+            status = await query(conn, "revoke_refresh_token", "execute",
+                                 "DELETE FROM data_refresh_tokens WHERE family_id=$1 AND token_hash=$2;",
+                                 family_id, token_hash)
+        return _rowcount(status) > 0
+
+    async def get_enrolled_speech_profiles(self):
+        """
+        List the speaker profiles of users whose speech enrollment has completed.
+        :return: List of profile id strings.
+        """
+        async with self._connection() as conn:
+            rows = await query(conn, "enrolled_speech_profiles", "fetch",
+                               "SELECT speech_profile_hash FROM data_users WHERE length(speech_profile_hash)=16;")
+        return [str(uuid.UUID(bytes=row[0])) for row in rows]
+
+    async def get_speech_profile(self, email):
+        """
+        Find the speaker profile a user enrolled, to verify a speech login against that profile alone.
+        :param email: Email string.
+        :return: Profile id string, or None if the user does not exist or has not enrolled.
+        """
+        async with self._connection() as conn:
+            profile = await query(conn, "select_speech_profile", "fetchval",
+                                  "SELECT speech_profile_hash FROM data_users WHERE email=$1 "
+                                  "AND length(speech_profile_hash)=16;", email)
+        return str(uuid.UUID(bytes=profile)) if profile is not None else None
+
+    async def get_speech_profile_owner(self, profile_id):
+        """
+        Find the user a speaker profile is bound to, so audio is only enrolled into a profile by its owner.
+        :param profile_id: Speaker profile id string.
+        :return: E-mail of the user, or None if no user has the profile.
+        :raises ValueError: If profile_id is not a UUID.
+        """
+        profile_hash = uuid.UUID(profile_id).bytes
+        async with self._connection() as conn:
+            return await query(conn, "select_speech_profile_owner", "fetchval",
+                               "SELECT email FROM data_users WHERE speech_profile_hash=$1 "
+                               "AND length(speech_profile_hash)=16;", profile_hash)
+
+    async def get_speech_profile_name(self, profile_id):
+        """
+        Find the name of the user a speaker profile is bound to, to report who a voice clip identified.
+        :param profile_id: Speaker profile id string.
+        :return: Preferred first name of the user, or None if no user has the profile.
+        :raises ValueError: If profile_id is not a UUID.
+        """
+        profile_hash = uuid.UUID(profile_id).bytes
+        async with self._connection() as conn:
+            return await query(conn, "select_speech_profile_name", "fetchval",
+                               "SELECT COALESCE(preferred_first_name, first_name) FROM data_users "
+                               "WHERE speech_profile_hash=$1 AND length(speech_profile_hash)=16;", profile_hash)
+
+    async def set_speech_profile(self, email, profile_id):
+        """
+        Record the enrolled speaker profile of a user, stored as the 16 raw bytes of its UUID.
+        :param email: Email string.
+        :param profile_id: Speaker profile id string.
+        :return: True if the user exists.
+        """
+        async with self._connection() as conn:
+            status = await query(conn, "set_speech_profile", "execute",
+                                 "UPDATE data_users SET speech_profile_hash=$1 WHERE email=$2;",
+                                 uuid.UUID(profile_id).bytes, email)
+        return _rowcount(status) > 0
@@ -0,0 +1,102 @@
+"""
+Cold start report: how long a fresh interpreter takes to import the app, and where the time goes.
+
+Each run imports the module in a new process with `-X importtime` (Python 3.7+), so every import
+is paid in full as on a new Lambda container. Results are saved like the other benchmarks so the
+numbers can be tracked per release with --compare.
+
+    python benchmarks/coldstart.py
+    python benchmarks/coldstart.py --runs 20 --compare benchmarks/results/coldstart-....json
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import report  # noqa: E402
+
+# heavy modules the app should only import once they are needed
+DEFERRED_MODULES = ("psycopg2", "asyncio", "numpy", "speech_identification.IdentificationServiceHttpClientHelper")
+
+_PROBE = """
+import sys
+import %s
+print(",".join(name for name in %r if name in sys.modules))
+"""
+
+
+def import_once(module):
+    """
+    Import a module in a fresh interpreter.
+    :return: Tuple (import ms of the module, dict of its direct imports -> cumulative ms,
+             deferred modules that were loaded).
+    """
+    env = dict(os.environ)
+    env.setdefault("DB_UNAME", "benchmark")
+    env.setdefault("DB_PASSWORD", "benchmark")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE % (module, DEFERRED_MODULES)],
+                          cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+    # importtime prints each module after everything it imported, one level deeper than itself
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), depth, int(cumulative_us) / 1000.0))
+        if name.strip() == module:
+            break
+    name, depth, total = entries.pop()
+    if name != module:
+        raise RuntimeError("%s was not imported" % module)
+
+    direct = {}
+    for name, child_depth, cumulative in reversed(entries):
+        if child_depth <= depth:
+            break
+        if child_depth == depth + 1:
+            direct[name] = cumulative
+    loaded = [name for name in proc.stdout.strip().split(",") if name]
+    return total, direct, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="auth_api")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="number of direct imports to list")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    runs = sorted((import_once(args.module) for _ in range(args.runs)), key=lambda run: run[0])
+    totals = [total for total, _, _ in runs]
+
+    # per-module figures from the median run, to keep the breakdown consistent with the total
+    median_total, direct, loaded = runs[len(runs) // 2]
+    direct = sorted(direct.items(), key=lambda item: -item[1])
+
+    print("import %s: median %.1f ms, min %.1f ms, max %.1f ms over %d runs" % (
+        args.module, median_total, totals[0], totals[-1], len(totals)))
+    print("\n%-40s %12s" % ("direct import", "cumulative ms"))
+    for name, cumulative in direct[:args.top]:
+        print("%-40s %12.1f" % (name, cumulative))
+    print("\nDeferred modules loaded at import: %s" % (", ".join(loaded) or "none"))
+
+    results = {
+        "import": {"median_ms": median_total, "min_ms": totals[0], "max_ms": totals[-1]},
+        "modules": dict(direct),
+    }
+    if not args.no_save:
+        print("\nSaved %s" % report.save("coldstart", results, dict(vars(args), deferred_loaded=loaded)))
+    if args.compare:
+        report.compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
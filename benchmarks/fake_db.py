@@ -0,0 +1,181 @@
+"""
+In-memory stand-in for the auth database, for benchmarking without Postgres.
+
+FakePool replaces auth_db's connection pool, so the real AuthDBConnection code (ticket cache,
+password hashing, signing) runs unchanged and only the SQL round-trip is simulated. Statements are
+recognised by their leading text; an optional per-statement latency approximates the network hop.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# dummy users from sql/generate_dummy_users.sql
+DUMMY_USERS = ["charlie.friend@teamcraps.com", "rhys.lawson@teamcraps.com", "paul.sajna@teamcraps.com",
+               "shae.brown@teamcraps.com", "aj.podeziel@teamcraps.com"]
+DUMMY_PASSWORD = "iliketurtles"
+
+
+class FakeStore(object):
+    """ Tables held as dicts, shared by every FakeConnection of a pool. """
+    def __init__(self, users=None, latency=0.0):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.users = dict(users or {})
+        self.speech_profiles = {}
+        self.tickets = {}
+        self.ticket_users = {}
+        self.revoked_tickets = {}
+        # family id -> [user id, token hash, previous hash, created, rotated, expiry]
+        self.refresh_tokens = {}
+        self.statements = 0
+
+
+class _FakeCursor(object):
+    def __init__(self, store):
+        self._store = store
+        self._rows = []
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        store = self._store
+        if store.latency:
+            time.sleep(store.latency)
+        sql = " ".join(sql.split())
+        now = datetime.utcnow()
+        self._rows = []
+        self.rowcount = 0
+
+        with store.lock:
+            store.statements += 1
+            if sql.startswith("SELECT pwd_hash FROM data_users"):
+                pwd_hash = store.users.get(params[0])
+                self._rows = [(pwd_hash,)] if pwd_hash is not None else []
+            elif sql.startswith("UPDATE data_users SET pwd_hash"):
+                new_hash, email, old_hash = params
+                if email in store.users and bytes(store.users[email]) == bytes(old_hash):
+                    store.users[email] = bytes(new_hash)
+                    self.rowcount = 1
+            elif sql.startswith("SELECT expiry FROM data_tickets"):
+                expiry = store.tickets.get(bytes(params[0]))
+                self._rows = [(expiry,)] if expiry is not None and expiry > now else []
+            elif sql.startswith("SELECT ticket_val_hash, expiry FROM data_tickets"):
+                for ticket_hash in params[0]:
+                    expiry = store.tickets.get(bytes(ticket_hash))
+                    if expiry is not None and expiry > now:
+                        self._rows.append((bytes(ticket_hash), expiry))
+            elif sql.startswith("SELECT user_id FROM data_tickets"):
+                expiry = store.tickets.get(bytes(params[0]))
+                if expiry is not None and expiry > now:
+                    self._rows = [(store.ticket_users.get(bytes(params[0])),)]
+            elif sql.startswith("INSERT INTO data_tickets"):
+                # single row, or the ticket writer's multi-row batches
+                for i in range(0, len(params), 4):
+                    store.tickets[bytes(params[i])] = params[i + 2]
+                    store.ticket_users[bytes(params[i])] = params[i + 3]
+                self.rowcount = len(params) // 4
+            elif sql.startswith("DELETE FROM data_tickets WHERE ticket_val_hash"):
+                store.ticket_users.pop(bytes(params[0]), None)
+                self.rowcount = 1 if store.tickets.pop(bytes(params[0]), None) else 0
+            elif sql.startswith("SELECT speech_profile_hash FROM data_users WHERE email"):
+                profile = store.speech_profiles.get(params[0])
+                self._rows = [(profile,)] if profile is not None else []
+            elif sql.startswith("INSERT INTO data_revoked_tickets"):
+                self.rowcount = 0 if bytes(params[0]) in store.revoked_tickets else 1
+                store.revoked_tickets.setdefault(bytes(params[0]), params[1])
+            elif sql.startswith("SELECT ticket_id, expiry FROM data_revoked_tickets"):
+                self._rows = [(ticket_id, expiry) for ticket_id, expiry in store.revoked_tickets.items()
+                              if expiry > now]
+            elif sql.startswith("SELECT email FROM data_users WHERE speech_profile_hash"):
+                self._rows = [(email,) for email, profile in store.speech_profiles.items()
+                              if profile == bytes(params[0])]
+            elif sql.startswith("SELECT COALESCE(preferred_first_name, first_name) FROM data_users"):
+                # no name columns here: the first part of the e-mail stands in for the first name
+                self._rows = [(email.split(".")[0].capitalize(),) for email, profile in store.speech_profiles.items()
+                              if profile == bytes(params[0])]
+            elif sql.startswith("SELECT speech_profile_hash FROM data_users"):
+                self._rows = [(profile,) for profile in store.speech_profiles.values()]
+            elif sql.startswith("UPDATE data_users SET speech_profile_hash"):
+                store.speech_profiles[params[1]] = bytes(params[0])
+                self.rowcount = 1
+            elif sql.startswith("INSERT INTO data_refresh_tokens"):
+                family_id, user_id, token_hash, created, expiry = params
+                store.refresh_tokens[bytes(family_id)] = [user_id, bytes(token_hash), None, created, None, expiry]
+                self.rowcount = 1
+            elif sql.startswith("UPDATE data_refresh_tokens"):
+                new_hash, rotated, idle_expiry, max_age, family_id, token_hash, now = params
+                row = store.refresh_tokens.get(bytes(family_id))
+                if row is not None and row[1] == bytes(token_hash) and row[5] > now:
+                    row[1:] = [bytes(new_hash), row[1], row[3], rotated, min(idle_expiry, row[3] + max_age)]
+                    self._rows = [(row[0],)]
+                    self.rowcount = 1
+            elif sql.startswith("DELETE FROM data_refresh_tokens WHERE family_id=%s AND token_hash<>%s"):
+                family_id, token_hash, _, cutoff = params
+                row = store.refresh_tokens.get(bytes(family_id))
+                if row is not None and row[1] != bytes(token_hash) and \
+                        (row[2] != bytes(token_hash) or row[4] < cutoff):
+                    del store.refresh_tokens[bytes(family_id)]
+                    self.rowcount = 1
+            elif sql.startswith("DELETE FROM data_refresh_tokens WHERE family_id=%s AND token_hash=%s"):
+                row = store.refresh_tokens.get(bytes(params[0]))
+                if row is not None and row[1] == bytes(params[1]):
+                    del store.refresh_tokens[bytes(params[0])]
+                    self.rowcount = 1
+            elif sql.startswith("SELECT 1"):
+                self._rows = [(1,)]
+            else:
+                raise NotImplementedError("FakeStore does not understand: %s" % sql)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+class FakeConnection(object):
+    closed = 0
+
+    def __init__(self, store):
+        self._store = store
+
+    def cursor(self):
+        return _FakeCursor(self._store)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(object):
+    """ Drop-in replacement for db_pool.ConnectionPool backed by a FakeStore. """
+    def __init__(self, store):
+        self.store = store
+        self._conn = FakeConnection(store)
+
+    @contextmanager
+    def connection(self):
+        yield self._conn
+
+    def stats(self):
+        return {"size": 0, "in_use": 0, "idle": 0, "statements": self.store.statements}
+
+
+def install(latency=0.0):
+    """
+    Point auth_db at a fresh in-memory store seeded with the dummy users.
+    :param latency: Seconds added to every statement.
+    :return: The FakePool installed.
+    """
+    import auth_db
+
+    hasher = auth_db.get_password_hasher()
+    users = dict((email, hasher.hash(DUMMY_PASSWORD)) for email in DUMMY_USERS)
+    pool = FakePool(FakeStore(users, latency))
+    auth_db._pool = pool
+    return pool
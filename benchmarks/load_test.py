@@ -0,0 +1,188 @@
+"""
+Load test for /login/text, /auth/check and /login/speech.
+
+By default the API runs in-process against the in-memory auth DB (benchmarks/fake_db.py) and a
+local speaker service stub (benchmarks/speaker_stub.py); pass --db postgres to use the database in
+settings.py, or --url to drive an already running deployment.
+
+    python benchmarks/load_test.py --concurrency 16 --duration 10
+    python benchmarks/load_test.py --scenarios auth_check --compare benchmarks/results/load-....json
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import report  # noqa: E402
+
+SCENARIOS = ("text_login", "auth_check", "speech_login")
+_HEADERS = {"X-Forwarded-Proto": "https"}
+
+
+def make_wav(seconds=2.0, rate=16000):
+    """ :return: A 16 kHz, 16-bit mono WAV of a 220 Hz tone. """
+    samples = int(seconds * rate)
+    data = struct.pack("<%dh" % samples, *(int(8000 * math.sin(2 * math.pi * 220 * i / rate))
+                                            for i in range(samples)))
+    return b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVEfmt " + \
+        struct.pack("<IHHIIHH", 16, 1, 1, rate, rate * 2, 2, 16) + b"data" + struct.pack("<I", len(data)) + data
+
+
+class Target(object):
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self._https = parsed.scheme == "https"
+        self._host = parsed.netloc
+
+    def request(self, method, path, body=None, headers=None):
+        cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+        conn = cls(self._host, timeout=60)
+        try:
+            all_headers = dict(_HEADERS)
+            all_headers.update(headers or {})
+            conn.request(method, path, body, all_headers)
+            res = conn.getresponse()
+            return res.status, res.read()
+        finally:
+            conn.close()
+
+
+def _login(target, email, password):
+    status, body = target.request("POST", "/login/text", json.dumps({"email": email, "password": password}),
+                                  {"Content-Type": "application/json"})
+    return status == 200 and json.loads(body.decode("utf-8")).get("authenticated"), body
+
+
+def build_scenarios(target, email, password):
+    """ :return: Dict of scenario name -> zero-argument callable returning True on success. """
+    ok, body = _login(target, email, password)
+    if not ok:
+        raise SystemExit("Could not log in as %s: %r" % (email, body))
+    tickets = [json.loads(_login(target, email, password)[1].decode("utf-8"))["ticket"] for _ in range(32)]
+    audio = make_wav()
+
+    def text_login():
+        return _login(target, email, password)[0]
+
+    def auth_check():
+        status, body = target.request("GET", "/auth/check?ticket=" + urllib.parse.quote(random.choice(tickets)))
+        return status == 200 and json.loads(body.decode("utf-8"))["authenticated"]
+
+    def speech_login():
+        status, _ = target.request("POST", "/login/speech", audio, {"Content-Type": "audio/wav"})
+        return status == 200
+
+    return {"text_login": text_login, "auth_check": auth_check, "speech_login": speech_login}
+
+
+def run(scenario, concurrency, duration):
+    """ Call scenario() from `concurrency` threads for `duration` seconds and summarize. """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker():
+        local, failed = [], 0
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                ok = scenario()
+            except Exception:
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - start)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return report.summarize(latencies, time.monotonic() - started, errors[0])
+
+
+def start_local_api(db, db_latency_ms, stub_processing_ms, stub_profiles, ticket_write_mode=None):
+    """ Serve auth_api in-process with local stand-ins and return its base URL. """
+    os.environ.setdefault("DB_UNAME", "benchmark")
+    os.environ.setdefault("DB_PASSWORD", "benchmark")
+    if ticket_write_mode:
+        os.environ["TICKET_WRITE_MODE"] = ticket_write_mode
+    # every simulated client logs in as the same user from 127.0.0.1
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    import speaker_stub
+    stub = speaker_stub.start(profiles=stub_profiles, processing_ms=stub_processing_ms)
+    os.environ["SPEAKER_SERVICE_HOST"] = stub.host
+    os.environ["SPEAKER_SERVICE_HTTPS"] = "false"
+
+    if db == "fake":
+        import fake_db
+        fake_db.install(db_latency_ms / 1000.0)
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import auth_api
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, auth_api.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:%d" % server.server_port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="drive a running deployment instead of an in-process API")
+    parser.add_argument("--db", choices=("fake", "postgres"), default="fake")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="per-statement latency of the fake DB")
+    parser.add_argument("--stub-processing-ms", type=int, default=300)
+    parser.add_argument("--stub-profiles", type=int, default=20)
+    parser.add_argument("--ticket-write-mode", choices=("sync", "group", "async"),
+                        help="TICKET_WRITE_MODE of the in-process API")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--email", default="charlie.friend@teamcraps.com")
+    parser.add_argument("--password", default="iliketurtles")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    url = args.url or start_local_api(args.db, args.db_latency_ms, args.stub_processing_ms, args.stub_profiles,
+                                      args.ticket_write_mode)
+    scenarios = build_scenarios(Target(url), args.email, args.password)
+
+    results = {}
+    print("%-14s %8s %7s %10s %9s %9s %9s" % ("scenario", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+    for name in args.scenarios:
+        result = results[name] = run(scenarios[name], args.concurrency, args.duration)
+        print("%-14s %8d %7d %10.1f %9.2f %9.2f %9.2f" % (
+            name, result["requests"], result["errors"], result["throughput"],
+            result["p50_ms"], result["p95_ms"], result["p99_ms"]))
+
+    config = dict(vars(args))
+    if not args.no_save:
+        print("\nSaved %s" % report.save("load", results, config))
+    if args.compare:
+        report.compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Micro-benchmarks for the hot paths behind the endpoints: ticket issuance and hashing, signed tickets,
+speaker profile parsing and WAV parsing. Ticket issuance runs against the in-memory auth DB.
+
+    python benchmarks/micro.py
+    python benchmarks/micro.py --only issue_ticket --compare benchmarks/results/micro-....json
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("DB_UNAME", "benchmark")
+os.environ.setdefault("DB_PASSWORD", "benchmark")
+
+import auth_db  # noqa: E402
+import fake_db  # noqa: E402
+import report  # noqa: E402
+import speaker_stub  # noqa: E402
+import tickets  # noqa: E402
+import wav_audio  # noqa: E402
+from load_test import make_wav  # noqa: E402
+from speech_identification.IdentificationProfile import parse_profiles  # noqa: E402
+
+
+def bench_issue_ticket():
+    fake_db.install()
+    db = auth_db.AuthDBConnection()
+    return lambda: db.issue_ticket("charlie.friend@teamcraps.com")
+
+
+def bench_hash_ticket():
+    ticket = os.urandom(128).hex()
+    return lambda: hashlib.sha256(bytes.fromhex(ticket)).digest()
+
+
+def bench_signed_issue():
+    signer = tickets.TicketSigner({"bench": os.urandom(32)}, "bench")
+    issued = datetime.utcnow().replace(microsecond=0)
+    expiry = issued + timedelta(hours=1)
+    return lambda: signer.issue("charlie.friend@teamcraps.com", issued, expiry)
+
+
+def bench_signed_verify():
+    signer = tickets.TicketSigner({"bench": os.urandom(32)}, "bench")
+    issued = datetime.utcnow().replace(microsecond=0)
+    ticket = signer.issue("charlie.friend@teamcraps.com", issued, issued + timedelta(hours=1))
+    return lambda: signer.verify(ticket)
+
+
+def bench_parse_profiles():
+    message = json.dumps([speaker_stub._profile(str(uuid.uuid4()), "Enrolled") for _ in range(1000)])
+
+    return lambda: parse_profiles(message)
+
+
+def bench_parse_enrolled_profiles():
+    message = json.dumps([speaker_stub._profile(str(uuid.uuid4()), "Enrolled" if i % 4 else "Enrolling")
+                          for i in range(1000)])
+    return lambda: parse_profiles(message, "Enrolled")
+
+
+def bench_parse_wav():
+    audio = make_wav(seconds=10.0)
+    return lambda: wav_audio.parse_wav(audio)
+
+
+BENCHMARKS = {
+    "issue_ticket": bench_issue_ticket,
+    "hash_ticket": bench_hash_ticket,
+    "signed_issue": bench_signed_issue,
+    "signed_verify": bench_signed_verify,
+    "parse_profiles_1000": bench_parse_profiles,
+    "parse_enrolled_profiles_1000": bench_parse_enrolled_profiles,
+    "parse_wav_10s": bench_parse_wav,
+}
+
+
+def measure(func, repeat, min_time):
+    """ :return: Dict with the best and median per-call time in microseconds over `repeat` runs. """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    runs = sorted(t / number * 1e6 for t in timer.repeat(repeat, number))
+    return {"calls": number, "best_us": runs[0], "median_us": runs[len(runs) // 2]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="approximate seconds per repeat")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    print("%-22s %10s %12s %12s" % ("benchmark", "calls", "best us", "median us"))
+    for name in args.only:
+        result = results[name] = measure(BENCHMARKS[name](), args.repeat, args.min_time)
+        print("%-22s %10d %12.2f %12.2f" % (name, result["calls"], result["best_us"], result["median_us"]))
+
+    if not args.no_save:
+        print("\nSaved %s" % report.save("micro", results, vars(args)))
+    if args.compare:
+        report.compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Saving benchmark results and comparing them with an earlier run.
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(sorted_values, fraction):
+    """ :return: The value at the given fraction (0..1) of an already sorted list. """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    :param latencies: Per-request latencies in seconds.
+    :param elapsed: Wall-clock seconds the run took.
+    :param errors: Number of failed requests.
+    :return: Dict of throughput and latency percentiles (in milliseconds).
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(kind, results, config):
+    """
+    Write a run to benchmarks/results/<kind>-<timestamp>.json.
+    :return: Path of the file written.
+    """
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    path = os.path.join(RESULTS_DIR, "%s-%s.json" % (kind, time.strftime("%Y%m%d-%H%M%S")))
+    with open(path, "w") as f:
+        json.dump({
+            "kind": kind,
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "config": config,
+            "results": results
+        }, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare(previous_path, results):
+    """ Print how each metric of each scenario moved relative to a saved run. """
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print("\nCompared with %s (revision %s):" % (os.path.basename(previous_path), previous.get("revision")))
+    for scenario, metrics in sorted(results.items()):
+        before = previous["results"].get(scenario)
+        if not before:
+            continue
+        changes = []
+        for key, value in sorted(metrics.items()):
+            old = before.get(key)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                changes.append("%s %+.1f%%" % (key, (value - old) * 100.0 / old))
+        print("  %-20s %s" % (scenario, ", ".join(changes)))
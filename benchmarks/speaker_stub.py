@@ -0,0 +1,164 @@
+"""
+Local stand-in for the speaker identification service at westus.api.cognitive.microsoft.com.
+
+Serves the identificationProfiles, identify, enroll and operations endpoints the client helper
+uses. Identify and enroll answer 202 with an Operation-Location that reports "running" until a
+configurable processing delay has passed, like the real service.
+
+    python benchmarks/speaker_stub.py --port 8081 --profiles 50 --processing-ms 300
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# profiles the API maps to names; identification always picks one of them when it is a candidate,
+# and answers with the all-zero "no match" ID otherwise
+KNOWN_PROFILE_IDS = ["c3cba575-213b-48d4-82a4-9fd6d5c06366", "459d1f28-37d4-4138-ba8f-b82347f00169"]
+NO_MATCH_PROFILE_ID = "00000000-0000-0000-0000-000000000000"
+# like the real service, one identify call takes at most this many candidate profiles
+MAX_IDENTIFY_PROFILES = 10
+
+_PROFILES_PATH = "/spid/v1.0/identificationProfiles"
+_IDENTIFY_PATH = "/spid/v1.0/identify"
+_OPERATIONS_PATH = "/spid/v1.0/operations/"
+_ENROLL_PATH = re.compile(r"^/spid/v1\.0/identificationProfiles/([^/]+)/enroll$")
+
+
+class SpeakerServiceStub(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, profiles=20, processing_ms=300, latency_ms=0):
+        HTTPServer.__init__(self, address, _Handler)
+        self.processing = processing_ms / 1000.0
+        self.latency = latency_ms / 1000.0
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.profiles = {}
+        for profile_id in KNOWN_PROFILE_IDS + [str(uuid.uuid4()) for _ in range(max(0, profiles - 2))]:
+            self.profiles[profile_id] = _profile(profile_id, "Enrolled")
+
+    @property
+    def host(self):
+        return "%s:%d" % self.server_address[:2]
+
+    def start_operation(self, result):
+        operation_id = str(uuid.uuid4())
+        with self.lock:
+            self.operations[operation_id] = (time.monotonic() + self.processing, result)
+        return "http://%s%s%s" % (self.host, _OPERATIONS_PATH, operation_id)
+
+
+def _profile(profile_id, status):
+    return {
+        "identificationProfileId": profile_id,
+        "locale": "en-us",
+        "enrollmentSpeechTime": 30.0 if status == "Enrolled" else 0.0,
+        "remainingEnrollmentSpeechTime": 0.0 if status == "Enrolled" else 30.0,
+        "createdDateTime": "2018-01-14T00:00:00.000Z",
+        "lastActionDateTime": "2018-01-14T00:00:00.000Z",
+        "enrollmentStatus": status
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None, headers=None):
+        payload = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        path = self.path.split("?", 1)[0]
+        if path == _PROFILES_PATH:
+            with self.server.lock:
+                profiles = list(self.server.profiles.values())
+            return self._reply(200, profiles)
+        if path.startswith(_PROFILES_PATH + "/"):
+            profile = self.server.profiles.get(path[len(_PROFILES_PATH) + 1:])
+            return self._reply(200, profile) if profile else self._reply(404, {"error": "not found"})
+        if path.startswith(_OPERATIONS_PATH):
+            with self.server.lock:
+                operation = self.server.operations.get(path[len(_OPERATIONS_PATH):])
+            if operation is None:
+                return self._reply(404, {"error": "not found"})
+            ready_at, result = operation
+            if time.monotonic() < ready_at:
+                return self._reply(200, {"status": "running"})
+            return self._reply(200, {"status": "succeeded", "processingResult": result})
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        self._read_body()
+        time.sleep(self.server.latency)
+        path, _, query = self.path.partition("?")
+        if path == _PROFILES_PATH:
+            profile_id = str(uuid.uuid4())
+            with self.server.lock:
+                self.server.profiles[profile_id] = _profile(profile_id, "Enrolling")
+            return self._reply(200, {"identificationProfileId": profile_id})
+        if path == _IDENTIFY_PATH:
+            ids = urllib.parse.parse_qs(query)["identificationProfileIds"][0].split(",")
+            if len(ids) > MAX_IDENTIFY_PROFILES:
+                return self._reply(400, {"error": {"code": "BadRequest", "message": "Too many profiles."}})
+            known = [profile_id for profile_id in ids if profile_id in KNOWN_PROFILE_IDS]
+            result = {"identifiedProfileId": known[0] if known else NO_MATCH_PROFILE_ID,
+                      "confidence": "High" if known else "Normal"}
+            return self._reply(202, None, {"Operation-Location": self.server.start_operation(result)})
+        match = _ENROLL_PATH.match(path)
+        if match:
+            result = {"enrollmentStatus": "Enrolled", "enrollmentSpeechTime": 30.0,
+                      "remainingEnrollmentSpeechTime": 0.0, "speechTime": 10.0}
+            return self._reply(202, None, {"Operation-Location": self.server.start_operation(result)})
+        self._reply(404, {"error": "not found"})
+
+
+def start(port=0, profiles=20, processing_ms=300, latency_ms=0):
+    """ Start the stub on a background thread and return the server; its host is server.host. """
+    server = SpeakerServiceStub(("127.0.0.1", port), profiles, processing_ms, latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--profiles", type=int, default=20)
+    parser.add_argument("--processing-ms", type=int, default=300)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    server = SpeakerServiceStub(("127.0.0.1", args.port), args.profiles, args.processing_ms, args.latency_ms)
+    print("Speaker service stub listening on %s" % server.host)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
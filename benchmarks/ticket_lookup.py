@@ -0,0 +1,73 @@
+"""
+Ticket lookup latency vs. table size, with and without the indexes added by migration 0002.
+
+Builds throwaway copies of data_tickets in a temporary schema, so it is safe to point at a shared
+database, and times the exact statement check_ticket runs.
+
+    python benchmarks/ticket_lookup.py --sizes 1000 10000 100000 --lookups 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth_db  # noqa: E402
+
+_LOOKUP = "SELECT expiry FROM {table} WHERE ticket_val_hash=%s AND expiry>now();"
+
+
+def _fill(cur, table, size, indexed):
+    cur.execute("CREATE TEMP TABLE {0} (ticket_val_hash BYTEA, issued TIMESTAMP, expiry TIMESTAMP);".format(table))
+    cur.execute("INSERT INTO {0} SELECT decode(md5(i::text) || md5((-i)::text), 'hex'), now(), "
+                "now() + (i % 7 - 3) * interval '1 hour' FROM generate_series(1, %s) AS i;".format(table),
+                (size,))
+    if indexed:
+        cur.execute("ALTER TABLE {0} ADD PRIMARY KEY (ticket_val_hash);".format(table))
+        cur.execute("CREATE INDEX ON {0} (expiry);".format(table))
+    cur.execute("ANALYZE {0};".format(table))
+
+
+def _time_lookups(cur, table, size, lookups):
+    cur.execute("SELECT decode(md5(i::text) || md5((-i)::text), 'hex') FROM generate_series(1, %s) AS i;",
+                (size,))
+    hashes = [row[0] for row in cur.fetchall()]
+    sample = [random.choice(hashes) for _ in range(lookups)]
+
+    query = _LOOKUP.format(table=table)
+    timings = []
+    for ticket_hash in sample:
+        start = time.perf_counter()
+        cur.execute(query, (ticket_hash,))
+        cur.fetchone()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    conn = auth_db.connect()
+    cur = conn.cursor()
+    print("%10s  %-9s  %10s  %10s" % ("rows", "indexes", "p50 ms", "p99 ms"))
+    try:
+        for size in args.sizes:
+            for indexed in (False, True):
+                table = "bench_tickets_%d_%s" % (size, "idx" if indexed else "seq")
+                _fill(cur, table, size, indexed)
+                p50, p99 = _time_lookups(cur, table, size, args.lookups)
+                print("%10d  %-9s  %10.3f  %10.3f" % (size, "yes" if indexed else "no", p50 * 1000, p99 * 1000))
+                cur.execute("DROP TABLE {0};".format(table))
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Process-wide bounded pool of PostgreSQL connections shared by every AuthDBConnection.
+
+psycopg2 is only imported once a pool is in use, which keeps it off the cold start import path.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """ Raised when no connection becomes available within the pool's wait timeout. """
+
+
+class _PooledConnection(object):
+    """ A raw connection plus the bookkeeping the pool needs to age and health-check it. """
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe bounded connection pool.
+
+    Connections are handed out LIFO so the hottest ones stay warm, checked for liveness on checkout
+    when they have been idle for a while, and retired once they exceed their maximum age.
+    """
+    def __init__(self, connect, min_size=1, max_size=10, max_age=1800.0, wait_timeout=5.0,
+                 health_check_interval=30.0):
+        """
+        :param connect: Zero-argument callable returning a new DB-API connection.
+        :param min_size: Connections opened eagerly when the pool is created.
+        :param max_size: Hard cap on open connections (idle + in use).
+        :param max_age: Seconds after which a connection is closed instead of reused.
+        :param wait_timeout: Seconds a checkout waits for a free connection before PoolTimeout.
+        :param health_check_interval: Idle seconds after which a connection is pinged on checkout.
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size bounds: min=%d max=%d" % (min_size, max_size))
+
+        self._connect = connect
+        self._min_size = min_size
+        self._max_size = max_size
+        self._max_age = max_age
+        self._wait_timeout = wait_timeout
+        self._health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+
+        # stats
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+        for _ in range(min_size):
+            self._idle.append(_PooledConnection(self._connect()))
+            self._size += 1
+
+    def _is_usable(self, pooled, now):
+        if pooled.conn.closed or now - pooled.created > self._max_age:
+            return False
+        if now - pooled.last_used < self._health_check_interval:
+            return True
+        import psycopg2
+        try:
+            cur = pooled.conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.fetchone()
+            pooled.conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _close_quietly(self, pooled):
+        import psycopg2
+        self._discarded += 1
+        try:
+            pooled.conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """
+        Check a connection out of the pool, opening a new one if there is headroom.
+        :return: A _PooledConnection that must be handed back through putconn().
+        """
+        start = time.monotonic()
+        deadline = start + self._wait_timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._size < self._max_size:
+                    # reserve the slot now, connect outside the lock
+                    self._size += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout("No database connection available after %.1fs" % self._wait_timeout)
+                waited = True
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                wait_time = time.monotonic() - start
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        if pooled is not None and not self._is_usable(pooled, time.monotonic()):
+            self._close_quietly(pooled)
+            pooled = None
+
+        if pooled is None:
+            try:
+                pooled = _PooledConnection(self._connect())
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+        return pooled
+
+    def putconn(self, pooled, broken=False):
+        """
+        Return a connection to the pool, rolling back any transaction left open on it.
+        :param pooled: The _PooledConnection obtained from getconn().
+        :param broken: True if the caller saw a connection-level error and it must not be reused.
+        """
+        import psycopg2.extensions
+        now = time.monotonic()
+        conn = pooled.conn
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        reuse = not broken and not conn.closed and now - pooled.created <= self._max_age
+        if not reuse:
+            self._close_quietly(pooled)
+
+        with self._cond:
+            self._in_use -= 1
+            if reuse:
+                pooled.last_used = now
+                self._idle.append(pooled)
+            else:
+                self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """ Context manager that checks out a raw connection and always returns it. """
+        import psycopg2
+        pooled = self.getconn()
+        broken = False
+        try:
+            yield pooled.conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(pooled, broken)
+
+    def stats(self):
+        """ :return: Snapshot of pool occupancy and checkout wait times. """
+        with self._cond:
+            return {
+                "size": self._size,
+                "max_size": self._max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": self._wait_time_total,
+                "wait_time_max": self._wait_time_max,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+            }
+
+    def close(self):
+        """ Close every idle connection; connections still checked out are closed on return. """
+        with self._cond:
+            while self._idle:
+                self._close_quietly(self._idle.pop())
+                self._size -= 1
+            self._max_age = -1.0
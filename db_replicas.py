@@ -0,0 +1,179 @@
+"""
+Routing of read-only queries across PostgreSQL read replicas, each with its own ConnectionPool.
+
+Reads go to the healthy replica with the lowest smoothed latency. A replica is skipped while it is
+down (connection errors put it in a cooldown) or lagging further behind the primary than allowed;
+when no replica is usable the caller falls back to the primary.
+"""
+import logging
+import random
+import threading
+import time
+
+from db_pool import PoolTimeout
+
+
+class _Replica(object):
+    """ A replica's pool plus what the router knows about its latency, lag and health. """
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.latency = None
+        self.lag = 0.0
+        self.lag_checked = 0.0
+        self.checking_lag = False
+        self.down_until = 0.0
+        self.reads = 0
+        self.failures = 0
+
+
+class ReplicaRouter(object):
+    """
+    Thread-safe selection of a read replica per query.
+
+    Latency is an exponentially weighted moving average of each replica's query time. Lag is measured
+    by the query that happens to pick a replica once its last measurement is older than
+    lag_check_interval, so an idle process never polls; a lagging replica is offered to queries
+    again on that schedule just for the measurement.
+    """
+    def __init__(self, replicas, max_lag=5.0, lag_check_interval=10.0, failover_cooldown=30.0,
+                 latency_decay=0.2, execute=None):
+        """
+        :param replicas: List of (name, ConnectionPool) pairs, one per replica.
+        :param max_lag: Seconds of replication lag beyond which a replica is not read from.
+        :param lag_check_interval: Seconds between lag measurements of a replica.
+        :param failover_cooldown: Seconds a replica is skipped after a connection error.
+        :param latency_decay: Weight of the newest sample in the latency average.
+        :param execute: Optional callable(cur, statement, sql, params), e.g. auth_db.execute.
+        """
+        self._replicas = [_Replica(name, pool) for name, pool in replicas]
+        self._max_lag = max_lag
+        self._lag_check_interval = lag_check_interval
+        self._failover_cooldown = failover_cooldown
+        self._latency_decay = latency_decay
+        self._execute = execute or (lambda cur, statement, sql, params: cur.execute(sql, params))
+        self._lock = threading.Lock()
+        self._fallbacks = 0
+
+    def _candidates(self, now):
+        """
+        :return: Usable replicas, fastest first; unmeasured replicas first so each gets sampled. A
+                 lagging replica is included once its lag is due to be measured again, so it is
+                 read from again after catching up.
+        """
+        with self._lock:
+            usable = [replica for replica in self._replicas
+                      if replica.down_until <= now and (replica.lag <= self._max_lag or
+                                                        now - replica.lag_checked >= self._lag_check_interval)]
+        # shuffle before the stable sort so equally fast replicas share the load
+        random.shuffle(usable)
+        usable.sort(key=lambda replica: -1.0 if replica.latency is None else replica.latency)
+        return usable
+
+    def _mark_down(self, replica, now):
+        with self._lock:
+            replica.failures += 1
+            replica.down_until = now + self._failover_cooldown
+            replica.latency = None
+
+    def _record(self, replica, elapsed):
+        with self._lock:
+            replica.reads += 1
+            if replica.latency is None:
+                replica.latency = elapsed
+            else:
+                replica.latency += self._latency_decay * (elapsed - replica.latency)
+
+    def _claim_lag_check(self, replica, now):
+        with self._lock:
+            if replica.checking_lag or now - replica.lag_checked < self._lag_check_interval:
+                return False
+            replica.checking_lag = True
+            return True
+
+    def _check_lag(self, replica, conn):
+        # an idle primary sends no WAL, so a replica that has replayed everything it received is current
+        lag = None
+        try:
+            cur = conn.cursor()
+            self._execute(cur, "replica_lag",
+                          "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                          "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END;", None)
+            row = cur.fetchone()
+            lag = float(row[0]) if row and row[0] is not None else 0.0
+        finally:
+            with self._lock:
+                replica.checking_lag = False
+                replica.lag_checked = time.monotonic()
+                if lag is not None:
+                    replica.lag = lag
+                    if lag > self._max_lag:
+                        logging.warning("Replica %s is %.1fs behind the primary; reading elsewhere.",
+                                        replica.name, lag)
+        return lag
+
+    def read(self, query):
+        """
+        Run a read-only query on the best available replica, failing over to the next on connection
+        errors.
+        :param query: Callable taking a connection and returning the query's result.
+        :return: Tuple (True, result), or (False, None) if no replica could serve the query.
+        """
+        import psycopg2
+        now = time.monotonic()
+        for replica in self._candidates(now):
+            try:
+                with replica.pool.connection() as conn:
+                    if self._claim_lag_check(replica, now):
+                        if self._check_lag(replica, conn) > self._max_lag:
+                            continue
+                    elif replica.lag > self._max_lag:
+                        # another query is re-measuring it
+                        continue
+                    start = time.perf_counter()
+                    result = query(conn)
+                    self._record(replica, time.perf_counter() - start)
+                return True, result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout):
+                logging.exception("Replica %s failed; skipping it for %ss.", replica.name, self._failover_cooldown)
+                self._mark_down(replica, time.monotonic())
+
+        with self._lock:
+            self._fallbacks += 1
+        return False, None
+
+    def note_fallback(self):
+        """ Count a read that a replica answered but that had to be repeated on the primary. """
+        with self._lock:
+            self._fallbacks += 1
+
+    def stats(self):
+        """ :return: Totals across replicas, for gauges. """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "replicas": len(self._replicas),
+                "healthy": sum(1 for replica in self._replicas
+                               if replica.down_until <= now and replica.lag <= self._max_lag),
+                "reads": sum(replica.reads for replica in self._replicas),
+                "failures": sum(replica.failures for replica in self._replicas),
+                "primary_fallbacks": self._fallbacks,
+            }
+
+    def replica_stats(self):
+        """ :return: List of per-replica latency, lag and health figures. """
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "name": replica.name,
+                "up": replica.down_until <= now,
+                "latency": replica.latency,
+                "lag": replica.lag,
+                "reads": replica.reads,
+                "failures": replica.failures,
+            } for replica in self._replicas]
+
+    def close(self):
+        """ Close the idle connections of every replica pool. """
+        for replica in self._replicas:
+            replica.pool.close()
@@ -0,0 +1,200 @@
+"""
+Low-overhead latency histograms and counters, exposed in the Prometheus text format.
+
+Every thread records into its own pre-allocated shard, so observing a value never takes a lock;
+shards are only summed when /metrics is scraped.
+"""
+import bisect
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+# seconds; covers in-memory ticket checks up to slow remote speaker calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for name, value in pairs)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Sharded(object):
+    """
+    A fixed-size list of numbers with one copy per thread. The shard of a thread that has exited is
+    folded into a base total and dropped, so short-lived threads do not accumulate shards.
+    """
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = []
+        self._base = [0] * size
+        self._lock = threading.Lock()
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [0] * self._size
+            with self._lock:
+                self._fold_exited()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            return shard
+
+    def _fold_exited(self):
+        # an exited thread no longer writes its shard, so it can be added up without a race
+        live = []
+        for thread, shard in self._shards:
+            owner = thread()
+            if owner is not None and owner.is_alive():
+                live.append((thread, shard))
+            else:
+                self._base = [base + value for base, value in zip(self._base, shard)]
+        self._shards = live
+
+    def totals(self):
+        with self._lock:
+            self._fold_exited()
+            shards = [shard for _, shard in self._shards]
+            base = self._base
+        return [sum(column) for column in zip(base, *shards)]
+
+
+class _HistogramChild(object):
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # one slot per bucket, then +Inf, then the running sum
+        self._values = _Sharded(len(buckets) + 2)
+
+    def observe(self, value):
+        shard = self._values.shard()
+        shard[bisect.bisect_left(self._buckets, value)] += 1
+        shard[-1] += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name, label_names, label_values):
+        totals = self._values.totals()
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float("inf"),), totals):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield "%s_bucket%s %d" % (name, _format_labels(label_names, label_values, [("le", le)]), cumulative)
+        yield "%s_sum%s %r" % (name, _format_labels(label_names, label_values), float(totals[-1]))
+        yield "%s_count%s %d" % (name, _format_labels(label_names, label_values), cumulative)
+
+
+class _CounterChild(object):
+    def __init__(self):
+        self._values = _Sharded(1)
+
+    def inc(self, amount=1):
+        self._values.shard()[0] += amount
+
+    def samples(self, name, label_names, label_values):
+        yield "%s%s %s" % (name, _format_labels(label_names, label_values), _format_value(self._values.totals()[0]))
+
+
+class _Metric(object):
+    _type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self._documentation = documentation
+        self._label_names = tuple(label_names)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """ :return: The child metric for one combination of label values. """
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self._label_names):
+                raise ValueError("%s expects labels %s" % (self.name, self._label_names))
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        yield "# HELP %s %s" % (self.name, self._documentation)
+        yield "# TYPE %s %s" % (self.name, self._type)
+        for values, child in sorted(self._children.items()):
+            for line in child.samples(self.name, self._label_names, values):
+                yield line
+
+
+class Histogram(_Metric):
+    _type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, label_names)
+
+    def _new_child(self):
+        return _HistogramChild(self._buckets)
+
+
+class Counter(_Metric):
+    _type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Registry(object):
+    """ Holds the process's metrics and renders them for scraping. """
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def add_gauges(self, prefix, documentation, collect):
+        """
+        Expose a stats dict as gauges computed at scrape time.
+        :param prefix: Metric name prefix; each key of the dict becomes <prefix>_<key>.
+        :param documentation: Help text shared by the gauges.
+        :param collect: Zero-argument callable returning a dict of numbers.
+        """
+        self._collectors.append((prefix, documentation, collect))
+
+    def render(self):
+        """ :return: All metrics in the Prometheus text exposition format. """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, documentation, collect in self._collectors:
+            for key, value in sorted(collect().items()):
+                name = "%s_%s" % (prefix, key)
+                lines.append("# HELP %s %s" % (name, documentation))
+                lines.append("# TYPE %s gauge" % name)
+                lines.append("%s %s" % (name, _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
@@ -0,0 +1,91 @@
+"""
+Applies the versioned SQL migrations in sql/migrations to the authorization DB.
+
+Run at deploy time with `python migrate.py` or `zappa invoke production migrate.run`. Each migration
+runs in its own transaction and is recorded in schema_migrations, so re-running is a no-op and
+concurrent deploys serialize on an advisory lock.
+"""
+import os
+import re
+
+import auth_db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql", "migrations")
+
+_MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+_ADVISORY_LOCK_ID = 0x64617368
+
+
+def list_migrations(directory=MIGRATIONS_DIR):
+    """
+    Find migration files named <version>_<name>.sql.
+    :param directory: Directory holding the migration files.
+    :return: List of (version, name, path) tuples sorted by version.
+    """
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError("Duplicate migration versions in %s" % directory)
+    return migrations
+
+
+def migrate(conn, directory=MIGRATIONS_DIR):
+    """
+    Apply every migration that has not been applied yet, in version order.
+    :param conn: psycopg2 connection to the authorization DB.
+    :param directory: Directory holding the migration files.
+    :return: List of (version, name) tuples applied by this call.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s);", (_ADVISORY_LOCK_ID,))
+    try:
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied TIMESTAMP NOT NULL DEFAULT now());")
+        conn.commit()
+
+        cur.execute("SELECT version FROM schema_migrations;")
+        done = set(row[0] for row in cur.fetchall())
+        conn.commit()
+
+        applied = []
+        for version, name, path in list_migrations(directory):
+            if version in done:
+                continue
+            with open(path) as f:
+                sql = f.read()
+            try:
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append((version, name))
+        return applied
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s);", (_ADVISORY_LOCK_ID,))
+        conn.commit()
+
+
+def run(event=None, context=None):
+    """ Entry point for `zappa invoke`; connects with the deployment's settings and migrates. """
+    conn = auth_db.connect()
+    try:
+        applied = migrate(conn)
+    finally:
+        conn.close()
+    for version, name in applied:
+        print("Applied migration %04d_%s" % (version, name))
+    if not applied:
+        print("Database schema is up to date")
+    return ["%04d_%s" % migration for migration in applied]
+
+
+if __name__ == "__main__":
+    run()
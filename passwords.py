@@ -0,0 +1,180 @@
+"""
+Salted, memory-hard password hashing run on a bounded worker pool.
+
+Stored hashes are self-describing ASCII strings so cost parameters can be raised over time:
+
+    $scrypt$n=16384,r=8,p=1$<salt>$<hash>
+    $pbkdf2-sha256$i=200000$<salt>$<hash>
+
+Hashes written before this module existed are a bare, unsalted SHA-256 digest (32 raw bytes). They
+still verify and are upgraded to the current scheme on the next successful login.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+SCRYPT = "scrypt"
+PBKDF2 = "pbkdf2-sha256"
+
+_SALT_BYTES = 16
+_HASH_BYTES = 32
+_LEGACY_SHA256_BYTES = 32
+
+
+class HasherBusy(Exception):
+    """ Raised instead of queueing when too many hashes are already pending. """
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords on a small dedicated thread pool.
+
+    hashlib's scrypt and PBKDF2 release the GIL, so the pool's threads hash in parallel while
+    request threads wait. The number of pending hashes is capped; beyond that callers get
+    HasherBusy immediately, so a login burst is shed rather than piling up behind the pool.
+    """
+    def __init__(self, scheme=SCRYPT, scrypt_n=2 ** 14, scrypt_r=8, scrypt_p=1, pbkdf2_iterations=200000,
+                 workers=2, max_pending=16, timeout=10.0):
+        """
+        :param scheme: Scheme for new hashes, SCRYPT or PBKDF2. Falls back to PBKDF2 if this
+                       Python's OpenSSL has no scrypt.
+        :param scrypt_n: scrypt CPU/memory cost (power of two).
+        :param scrypt_r: scrypt block size.
+        :param scrypt_p: scrypt parallelism.
+        :param pbkdf2_iterations: PBKDF2-HMAC-SHA256 iteration count.
+        :param workers: Threads dedicated to hashing.
+        :param max_pending: Hashes allowed queued or running at once.
+        :param timeout: Seconds a caller waits for its hash before giving up.
+        """
+        if scheme == SCRYPT and not hasattr(hashlib, "scrypt"):
+            scheme = PBKDF2
+        if scheme not in (SCRYPT, PBKDF2):
+            raise ValueError("Unknown password hash scheme %r" % scheme)
+
+        self._scheme = scheme
+        self._scrypt_params = (scrypt_n, scrypt_r, scrypt_p)
+        self._pbkdf2_iterations = pbkdf2_iterations
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._dummy_hash = None
+
+    def hash(self, password):
+        """
+        Hash a password with the current scheme and a fresh salt.
+        :param password: Password string.
+        :return: Encoded hash bytes, suitable for data_users.pwd_hash.
+        :raises HasherBusy: If the pool is saturated or the hash does not finish within the timeout.
+        """
+        return self._wait(self.submit_hash(password))
+
+    def verify(self, password, stored):
+        """
+        Check a password against a stored hash of any supported scheme.
+        :param password: Password string.
+        :param stored: Stored hash bytes, or None for an unknown user (a dummy hash is checked so
+                       the response time does not reveal whether the e-mail exists).
+        :return: Tuple (valid, needs_rehash); needs_rehash is True when a valid hash uses an old
+                 scheme or cost parameters and should be replaced.
+        :raises HasherBusy: If the pool is saturated or the hash does not finish within the timeout.
+        """
+        return self._wait(self.submit_verify(password, stored))
+
+    def submit_hash(self, password):
+        """
+        Like hash, but return a concurrent.futures.Future instead of waiting, for async callers.
+        :raises HasherBusy: If the pool is saturated.
+        """
+        return self._submit(self._hash, password)
+
+    def submit_verify(self, password, stored):
+        """
+        Like verify, but return a concurrent.futures.Future instead of waiting, for async callers.
+        :raises HasherBusy: If the pool is saturated.
+        """
+        if stored is None:
+            return self._submit(self._verify_unknown, password)
+        return self._submit(self._verify, password, bytes(stored))
+
+    @property
+    def timeout(self):
+        """ Seconds a caller should wait for a submitted hash. """
+        return self._timeout
+
+    def _wait(self, future):
+        try:
+            return future.result(self._timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HasherBusy("Password hash did not finish within %s seconds" % self._timeout)
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many password hashes pending")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _hash(self, password):
+        salt = os.urandom(_SALT_BYTES)
+        if self._scheme == SCRYPT:
+            n, r, p = self._scrypt_params
+            params = "n=%d,r=%d,p=%d" % (n, r, p)
+            digest = self._scrypt(password, salt, n, r, p)
+        else:
+            params = "i=%d" % self._pbkdf2_iterations
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, self._pbkdf2_iterations)
+        return ("$%s$%s$%s$%s" % (self._scheme, params, _b64encode(salt), _b64encode(digest))).encode("ascii")
+
+    def _verify_unknown(self, password):
+        if self._dummy_hash is None:
+            self._dummy_hash = self._hash(os.urandom(_SALT_BYTES).hex())
+        self._verify(password, self._dummy_hash)
+        return False, False
+
+    def _verify(self, password, stored):
+        # encoded hashes are far longer, and a raw digest may well start with "$"
+        if len(stored) == _LEGACY_SHA256_BYTES:
+            digest = hashlib.sha256(password.encode("utf-8")).digest()
+            return hmac.compare_digest(digest, stored), True
+
+        try:
+            _, scheme, params, salt, expected = stored.decode("ascii").split("$")
+            params = dict(param.split("=", 1) for param in params.split(","))
+            salt = _b64decode(salt)
+            expected = _b64decode(expected)
+            if scheme == SCRYPT:
+                cost = (int(params["n"]), int(params["r"]), int(params["p"]))
+                digest = self._scrypt(password, salt, *cost)
+                current = self._scheme == SCRYPT and cost == self._scrypt_params
+            elif scheme == PBKDF2:
+                iterations = int(params["i"])
+                digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+                current = self._scheme == PBKDF2 and iterations == self._pbkdf2_iterations
+            else:
+                return False, False
+        except (ValueError, KeyError, UnicodeDecodeError):
+            return False, False
+
+        valid = hmac.compare_digest(digest, expected)
+        return valid, valid and not current
+
+    @staticmethod
+    def _scrypt(password, salt, n, r, p):
+        return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * r * (n + p + 2), dklen=_HASH_BYTES)
@@ -0,0 +1,170 @@
+"""
+Cache of enrolled speaker profile ids, the candidate set for speech identification.
+"""
+import logging
+import threading
+import time
+
+
+class ProfileRegistry(object):
+    """
+    Keeps the list of enrolled profile ids so a speech login does not have to list every profile on
+    the speaker service first.
+
+    Entries are refreshed in the background once they reach refresh_ahead * ttl, so callers only
+    wait on the remote listing when the cache is empty or fully expired. On a cold start the list is
+    seeded from the auth DB instead.
+    """
+    def __init__(self, fetch, seed=None, ttl=300.0, refresh_ahead=0.8):
+        """
+        :param fetch: Callable returning the enrolled profile ids from the speaker service.
+        :param seed: Optional callable returning enrolled profile ids known locally (auth DB).
+        :param ttl: Seconds a fetched list may be served.
+        :param refresh_ahead: Fraction of the TTL after which a background refresh is started.
+        """
+        self._fetch = fetch
+        self._seed = seed
+        self._ttl = ttl
+        self._refresh_after = ttl * refresh_ahead
+        self._lock = threading.Lock()
+        self._ids = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._refreshing = False
+
+    def enrolled_profile_ids(self):
+        """ :return: List of enrolled profile id strings. """
+        with self._lock:
+            ids, age = self._ids, time.monotonic() - self._loaded_at
+            if ids is not None and age < self._ttl:
+                if age >= self._refresh_after and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._background_refresh, daemon=True).start()
+                return ids
+            seed = self._seed
+            self._seed = None
+
+        if seed is not None and ids is None:
+            try:
+                ids = list(seed())
+            except Exception:
+                logging.exception('Error seeding speech profile registry.')
+                ids = None
+            if ids:
+                with self._lock:
+                    # serve the seeded list now and have the next call refresh it in the background
+                    self._store(ids, self._generation, time.monotonic() - self._refresh_after)
+                return ids
+
+        return self.refresh()
+
+    def refresh(self):
+        """ Fetch the enrolled profile ids from the speaker service now. """
+        with self._lock:
+            generation = self._generation
+        ids = list(self._fetch())
+        with self._lock:
+            self._store(ids, generation, time.monotonic())
+        return ids
+
+    def invalidate(self, *args):
+        """ Forget the cached list; called whenever profiles or enrollments change. """
+        with self._lock:
+            self._generation += 1
+            self._ids = None
+
+    def _store(self, ids, generation, loaded_at):
+        # a list fetched before the last invalidation may be missing the change, so drop it
+        if generation == self._generation:
+            self._ids = ids
+            self._loaded_at = loaded_at
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logging.exception('Error refreshing speech profile registry.')
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+class AsyncProfileRegistry(object):
+    """
+    ProfileRegistry for the asyncio app: fetch and seed are coroutine functions, background refreshes
+    are tasks on the event loop, and concurrent misses share a single remote listing.
+    """
+    def __init__(self, fetch, seed=None, ttl=300.0, refresh_ahead=0.8):
+        """
+        :param fetch: Coroutine function returning the enrolled profile ids from the speaker service.
+        :param seed: Optional coroutine function returning enrolled profile ids known locally (auth DB).
+        :param ttl: Seconds a fetched list may be served.
+        :param refresh_ahead: Fraction of the TTL after which a background refresh is started.
+        """
+        self._fetch = fetch
+        self._seed = seed
+        self._ttl = ttl
+        self._refresh_after = ttl * refresh_ahead
+        self._ids = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._pending = None
+
+    async def enrolled_profile_ids(self):
+        """ :return: List of enrolled profile id strings. """
+        ids, age = self._ids, time.monotonic() - self._loaded_at
+        if ids is not None and age < self._ttl:
+            if age >= self._refresh_after and self._pending is None:
+                self._start_refresh().add_done_callback(self._log_refresh_error)
+            return ids
+
+        seed, self._seed = self._seed, None
+        if seed is not None and ids is None:
+            try:
+                ids = list(await seed())
+            except Exception:
+                logging.exception('Error seeding speech profile registry.')
+                ids = None
+            if ids:
+                self._store(ids, self._generation, time.monotonic() - self._refresh_after)
+                return ids
+
+        return await self.refresh()
+
+    async def refresh(self):
+        """ Fetch the enrolled profile ids from the speaker service, joining a fetch in progress. """
+        # asyncio is imported lazily so the WSGI app does not load it on cold starts
+        import asyncio
+        pending = self._pending if self._pending is not None else self._start_refresh()
+        return await asyncio.shield(pending)
+
+    def invalidate(self, *args):
+        """ Forget the cached list; called whenever profiles or enrollments change. """
+        self._generation += 1
+        self._ids = None
+        self._pending = None
+
+    def _start_refresh(self):
+        import asyncio
+        self._pending = asyncio.ensure_future(self._refresh(self._generation))
+        return self._pending
+
+    async def _refresh(self, generation):
+        try:
+            ids = list(await self._fetch())
+            self._store(ids, generation, time.monotonic())
+            return ids
+        finally:
+            if generation == self._generation:
+                self._pending = None
+
+    def _store(self, ids, generation, loaded_at):
+        # a list fetched before the last invalidation may be missing the change, so drop it
+        if generation == self._generation:
+            self._ids = ids
+            self._loaded_at = loaded_at
+
+    @staticmethod
+    def _log_refresh_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('Error refreshing speech profile registry.', exc_info=task.exception())
@@ -0,0 +1,272 @@
+"""
+Throttling of login attempts by client IP and by e-mail, checked before any DB or speaker service work.
+
+Per-IP limits are token buckets held in a bounded LRU map. Per-email limits are a sliding window
+counted in a count-min sketch, so memory stays fixed however many addresses an attacker cycles
+through; the sketch can only over-count, so a collision may throttle an address early but never
+lets one through late. With RATE_LIMIT_REDIS_URL set, both limits are shared between instances
+through Redis (sliding-window counters) and the in-process limits take over whenever Redis fails.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from settings import RATE_LIMIT_ENABLED, RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_MAX_KEYS, \
+    RATE_LIMIT_EMAIL_ATTEMPTS, RATE_LIMIT_EMAIL_WINDOW, RATE_LIMIT_SKETCH_WIDTH, RATE_LIMIT_SKETCH_DEPTH, \
+    RATE_LIMIT_REDIS_URL
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """ Raised when a client or account has used up its login attempts. """
+    def __init__(self, message, retry_after):
+        """
+        :param message: Error message.
+        :param retry_after: Seconds until another attempt would be allowed.
+        """
+        super(RateLimited, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBuckets(object):
+    """
+    Token bucket per key, refilled at `rate` tokens per second up to `burst`.
+
+    At most max_keys buckets are kept; the least recently used is dropped first, and as it has had the
+    longest to refill it is the one most likely to be full anyway.
+    """
+    def __init__(self, rate, burst, max_keys=100000):
+        """
+        :param rate: Tokens added per second.
+        :param burst: Bucket capacity, i.e. attempts allowed back to back.
+        :param max_keys: Most buckets held.
+        """
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def hit(self, key, cost=1):
+        """
+        Take `cost` tokens from a key's bucket.
+        :return: None if allowed, otherwise seconds until enough tokens will be available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self._burst, now))
+            tokens = min(self._burst, tokens + (now - last) * self._rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return None if allowed else (cost - tokens) / self._rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SlidingWindowSketch(object):
+    """
+    Approximate count of hits per key over the last `window` seconds, in fixed memory.
+
+    Counts for the current and previous fixed window are kept in count-min sketches; the sliding
+    count weights the previous window by how much of it still overlaps the last `window` seconds.
+    """
+    def __init__(self, limit, window, width=16384, depth=4):
+        """
+        :param limit: Hits allowed per key within the window.
+        :param window: Window length in seconds.
+        :param width: Counters per sketch row; more means fewer collisions.
+        :param depth: Sketch rows, each with an independent hash.
+        """
+        self._limit = limit
+        self._window = float(window)
+        self._width = width
+        self._depth = depth
+        self._lock = threading.Lock()
+        self._index = None
+        self._current = array("I", bytes(4 * width * depth))
+        self._previous = array("I", bytes(4 * width * depth))
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * self._depth).digest()
+        return [row * self._width + int.from_bytes(digest[4 * row:4 * row + 4], "little") % self._width
+                for row in range(self._depth)]
+
+    def _rotate(self, index):
+        if index == self._index:
+            return
+        if self._index is not None and index == self._index + 1:
+            self._previous = self._current
+        else:
+            self._previous = array("I", bytes(4 * self._width * self._depth))
+        self._current = array("I", bytes(4 * self._width * self._depth))
+        self._index = index
+
+    def hit(self, key, cost=1):
+        """
+        Count a hit for a key unless it is already at its limit.
+        :return: None if allowed, otherwise seconds until the window has moved on enough.
+        """
+        index, offset = divmod(time.time(), self._window)
+        cells = self._cells(key)
+        with self._lock:
+            self._rotate(int(index))
+            current = min(self._current[cell] for cell in cells)
+            previous = min(self._previous[cell] for cell in cells)
+            room = self._limit - cost
+            if previous * (1.0 - offset / self._window) + current <= room:
+                for cell in cells:
+                    self._current[cell] += cost
+                return None
+
+        if current > room:
+            # the current window becomes the previous one and must partly slide out as well
+            return self._window - offset + self._window * (1.0 - room / float(current))
+        return self._window * (1.0 - (room - current) / float(previous)) - offset
+
+
+class RedisSlidingWindow(object):
+    """
+    Sliding-window counter per key shared between instances through Redis.
+
+    Every attempt is counted, including rejected ones, so a client that keeps retrying stays throttled.
+    """
+    def __init__(self, client, prefix, limit, window):
+        """
+        :param client: redis.Redis client.
+        :param prefix: Namespace for this limit's keys.
+        :param limit: Hits allowed per key within the window.
+        :param window: Window length in seconds.
+        """
+        self._client = client
+        self._prefix = prefix
+        self._limit = limit
+        self._window = float(window)
+
+    def hit(self, key, cost=1):
+        """
+        Count a hit for a key.
+        :return: None if allowed, otherwise seconds until the window has moved on enough.
+        :raises redis.RedisError: If Redis cannot be reached.
+        """
+        now = time.time()
+        index, offset = divmod(now, self._window)
+        # hashed so keys have a fixed size and e-mail addresses are not stored in Redis
+        name = "%s:%s" % (self._prefix, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32])
+        pipe = self._client.pipeline()
+        pipe.get("%s:%d" % (name, index - 1))
+        pipe.incrby("%s:%d" % (name, index), cost)
+        pipe.expire("%s:%d" % (name, index), int(math.ceil(2 * self._window)))
+        previous, current, _ = pipe.execute()
+        count = int(previous or 0) * (1.0 - offset / self._window) + current
+        return None if count <= self._limit else self._window - offset
+
+
+class RateLimiter(object):
+    """ Login throttle applying a per-IP and a per-email limit. """
+    def __init__(self, ip_limit, email_limit, fallback=None):
+        """
+        :param ip_limit: Limit keyed by client address, with a hit(key, cost) method.
+        :param email_limit: Limit keyed by normalized e-mail, with a hit(key, cost) method.
+        :param fallback: Optional RateLimiter used while ip_limit or email_limit raise, e.g. a local
+                         limiter standing in for an unreachable Redis.
+        """
+        self._ip_limit = ip_limit
+        self._email_limit = email_limit
+        self._fallback = fallback
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._limited_ip = 0
+        self._limited_email = 0
+        self._backend_errors = 0
+
+    @property
+    def shared(self):
+        """ True if checks make network calls, so async callers should run them off the event loop. """
+        return self._fallback is not None
+
+    def check(self, ip, email=None, cost=1):
+        """
+        Count a login attempt.
+        :param ip: Client address.
+        :param email: E-mail the attempt is for, if known.
+        :param cost: Tokens the attempt takes from the IP's bucket, higher for expensive logins.
+        :raises RateLimited: If the IP or the e-mail is over its limit.
+        """
+        try:
+            self._check(ip, email, cost)
+        except RateLimited:
+            raise
+        except Exception:
+            if self._fallback is None:
+                raise
+            with self._lock:
+                self._backend_errors += 1
+            logging.warning("Shared rate limit backend failed; using in-process limits.", exc_info=True)
+            self._fallback.check(ip, email, cost)
+
+    def _check(self, ip, email, cost):
+        retry_after = self._ip_limit.hit(ip or "", cost)
+        if retry_after is not None:
+            with self._lock:
+                self._limited_ip += 1
+            raise RateLimited("Too many login attempts from this address", retry_after)
+
+        if email:
+            retry_after = self._email_limit.hit(email.strip().lower())
+            if retry_after is not None:
+                with self._lock:
+                    self._limited_email += 1
+                raise RateLimited("Too many login attempts for this account", retry_after)
+
+        with self._lock:
+            self._allowed += 1
+
+    def stats(self):
+        """ :return: Snapshot of allowed and throttled attempt counters. """
+        with self._lock:
+            return {
+                "allowed": self._allowed,
+                "limited_ip": self._limited_ip,
+                "limited_email": self._limited_email,
+                "backend_errors": self._backend_errors,
+            }
+
+
+def _local_limiter():
+    return RateLimiter(TokenBuckets(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_MAX_KEYS),
+                       SlidingWindowSketch(RATE_LIMIT_EMAIL_ATTEMPTS, RATE_LIMIT_EMAIL_WINDOW,
+                                           RATE_LIMIT_SKETCH_WIDTH, RATE_LIMIT_SKETCH_DEPTH))
+
+
+def get_rate_limiter():
+    """ Return the process-wide login rate limiter, or None when RATE_LIMIT_ENABLED is off. """
+    global _limiter
+    if _limiter is None and RATE_LIMIT_ENABLED:
+        with _limiter_lock:
+            if _limiter is None:
+                if RATE_LIMIT_REDIS_URL:
+                    # imported here as Redis is an optional dependency
+                    import redis
+                    client = redis.Redis.from_url(RATE_LIMIT_REDIS_URL, socket_timeout=0.1,
+                                                  socket_connect_timeout=0.1)
+                    # the shared IP limit allows a full bucket per refill period of one
+                    _limiter = RateLimiter(
+                        RedisSlidingWindow(client, "auth:rl:ip", RATE_LIMIT_IP_BURST,
+                                           RATE_LIMIT_IP_BURST / float(RATE_LIMIT_IP_RATE)),
+                        RedisSlidingWindow(client, "auth:rl:email", RATE_LIMIT_EMAIL_ATTEMPTS,
+                                           RATE_LIMIT_EMAIL_WINDOW),
+                        fallback=_local_limiter())
+                else:
+                    _limiter = _local_limiter()
+    return _limiter
@@ -0,0 +1,153 @@
+"""
+Deletes expired tickets from data_tickets, expired refresh token sessions from
+data_refresh_tokens and revocations of expired signed tickets from data_revoked_tickets, in small
+batches.
+
+Run by hand with `python reaper.py`, or on a schedule through the Zappa `events` entry that calls
+reaper.scheduled_reap. Each batch is its own short transaction and skips rows locked by other
+sessions, so the reaper never blocks ticket issuance or checks for long.
+"""
+import argparse
+import time
+
+import auth_db
+from settings import REAPER_BATCH_SIZE, REAPER_BATCH_PAUSE, REAPER_TIME_BUDGET
+
+_DELETE_BATCH = """
+DELETE FROM data_tickets WHERE ticket_val_hash IN (
+    SELECT ticket_val_hash FROM data_tickets WHERE expiry<now() LIMIT %s FOR UPDATE SKIP LOCKED
+);
+"""
+
+_DELETE_REFRESH_BATCH = """
+DELETE FROM data_refresh_tokens WHERE family_id IN (
+    SELECT family_id FROM data_refresh_tokens WHERE expiry<now() LIMIT %s FOR UPDATE SKIP LOCKED
+);
+"""
+
+_DELETE_REVOKED_BATCH = """
+DELETE FROM data_revoked_tickets WHERE ticket_id IN (
+    SELECT ticket_id FROM data_revoked_tickets WHERE expiry<now() LIMIT %s FOR UPDATE SKIP LOCKED
+);
+"""
+
+
+def reap_expired_tickets(conn, batch_size=REAPER_BATCH_SIZE, pause=REAPER_BATCH_PAUSE,
+                         time_budget=REAPER_TIME_BUDGET):
+    """
+    Delete expired tickets until none are left or the time budget runs out.
+    :param conn: psycopg2 connection to the authorization DB.
+    :param batch_size: Maximum rows deleted per transaction.
+    :param pause: Seconds to sleep between batches to leave room for other writers.
+    :param time_budget: Seconds after which no new batch is started.
+    :return: Dict with rows reaped, batches run, elapsed seconds and whether the backlog was cleared.
+    """
+    return _reap(conn, "reap_expired_tickets", _DELETE_BATCH, batch_size, pause, time_budget)
+
+
+def reap_expired_refresh_tokens(conn, batch_size=REAPER_BATCH_SIZE, pause=REAPER_BATCH_PAUSE,
+                                time_budget=REAPER_TIME_BUDGET):
+    """
+    Delete expired refresh token sessions until none are left or the time budget runs out.
+    Arguments and result as for reap_expired_tickets.
+    """
+    return _reap(conn, "reap_expired_refresh_tokens", _DELETE_REFRESH_BATCH, batch_size, pause, time_budget)
+
+
+def reap_expired_revocations(conn, batch_size=REAPER_BATCH_SIZE, pause=REAPER_BATCH_PAUSE,
+                             time_budget=REAPER_TIME_BUDGET):
+    """
+    Delete revocations of signed tickets that have expired anyway.
+    Arguments and result as for reap_expired_tickets.
+    """
+    return _reap(conn, "reap_expired_revocations", _DELETE_REVOKED_BATCH, batch_size, pause, time_budget)
+
+
+def _reap(conn, statement, sql, batch_size, pause, time_budget):
+    """
+    Run a batched delete until it removes fewer rows than a batch or the time budget runs out.
+    :param conn: psycopg2 connection to the authorization DB.
+    :param statement: Statement name the batches are timed under.
+    :param sql: DELETE statement taking the batch size as its only parameter.
+    :param batch_size: Maximum rows deleted per transaction.
+    :param pause: Seconds to sleep between batches to leave room for other writers.
+    :param time_budget: Seconds after which no new batch is started.
+    :return: Dict with rows reaped, batches run, elapsed seconds and whether the backlog was cleared.
+    """
+    start = time.monotonic()
+    reaped = 0
+    batches = 0
+    finished = False
+
+    cur = conn.cursor()
+    while time.monotonic() - start < time_budget:
+        cur.execute("SET LOCAL statement_timeout = '5s';")
+        auth_db.execute(cur, statement, sql, (batch_size,))
+        deleted = cur.rowcount
+        conn.commit()
+
+        reaped += deleted
+        batches += 1
+        if deleted < batch_size:
+            finished = True
+            break
+        time.sleep(pause)
+
+    return {
+        "reaped": reaped,
+        "batches": batches,
+        "seconds": round(time.monotonic() - start, 3),
+        "finished": finished
+    }
+
+
+def reap_all(conn, batch_size=REAPER_BATCH_SIZE, pause=REAPER_BATCH_PAUSE, time_budget=REAPER_TIME_BUDGET):
+    """
+    Delete expired tickets, then expired refresh token sessions and revocations with what is left of
+    the time budget.
+    :return: The tickets' report of reap_expired_tickets, with the sessions' under "refresh_tokens"
+             and the revocations' under "revocations".
+    """
+    report = reap_expired_tickets(conn, batch_size, pause, time_budget)
+    report["refresh_tokens"] = reap_expired_refresh_tokens(conn, batch_size, pause,
+                                                           max(0.0, time_budget - report["seconds"]))
+    report["revocations"] = reap_expired_revocations(
+        conn, batch_size, pause, max(0.0, time_budget - report["seconds"] - report["refresh_tokens"]["seconds"]))
+    return report
+
+
+def _print_report(report):
+    print("Reaped %(reaped)d expired tickets in %(batches)d batches (%(seconds).3fs)" % report)
+    print("Reaped %(reaped)d expired refresh token sessions in %(batches)d batches (%(seconds).3fs)"
+          % report["refresh_tokens"])
+    print("Reaped %(reaped)d expired ticket revocations in %(batches)d batches (%(seconds).3fs)"
+          % report["revocations"])
+
+
+def scheduled_reap(event=None, context=None):
+    """ Entry point for the scheduled Zappa event; reuses the warm connection pool. """
+    with auth_db.get_pool().connection() as conn:
+        report = reap_all(conn)
+    _print_report(report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete expired tickets, refresh token sessions and revocations.")
+    parser.add_argument("--batch-size", type=int, default=REAPER_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=REAPER_BATCH_PAUSE)
+    parser.add_argument("--time-budget", type=float, default=REAPER_TIME_BUDGET)
+    args = parser.parse_args()
+
+    conn = auth_db.connect()
+    try:
+        report = reap_all(conn, args.batch_size, args.pause, args.time_budget)
+    finally:
+        conn.close()
+    _print_report(report)
+    if not all(part["finished"] for part in (report, report["refresh_tokens"], report["revocations"])):
+        print("Time budget exhausted; expired rows remain")
+
+
+if __name__ == "__main__":
+    main()
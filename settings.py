@@ -8,5 +8,146 @@ DB_URL = r'aa1sbw4dz894udn.cv1nhpusk2zj.us-west-2.rds.amazonaws.com'
 DB_UNAME = os.environ["DB_UNAME"]
 DB_PASSWORD = os.environ["DB_PASSWORD"]
 
-# expiry time after issue of a ticket (seconds)
-TICKET_EXP_TIME = 3 * 60 * 60
+# expiry time after issue of a ticket (seconds); clients holding a refresh token renew tickets
+# through /auth/refresh, so this can be short
+TICKET_EXP_TIME = int(os.environ.get("TICKET_EXP_TIME", 3 * 60 * 60))
+
+# refresh tokens (seconds): a session ends REFRESH_TOKEN_IDLE_TIME after its last refresh or
+# REFRESH_TOKEN_MAX_AGE after the login that started it. Presenting a refresh token that was already
+# exchanged ends the session, unless it is the one replaced less than REFRESH_TOKEN_REUSE_GRACE ago
+# (a client retrying a refresh whose response it lost)
+REFRESH_TOKEN_IDLE_TIME = 14 * 24 * 60 * 60
+REFRESH_TOKEN_MAX_AGE = 90 * 24 * 60 * 60
+REFRESH_TOKEN_REUSE_GRACE = 10
+
+# database connection pool (sizes are per process, times in seconds)
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_MAX_AGE = 30 * 60
+DB_POOL_WAIT_TIMEOUT = 5
+DB_POOL_HEALTH_CHECK_INTERVAL = 30
+
+# read replicas as comma-separated hosts, each with its own pool sized like the primary's. Ticket
+# checks, password lookups and profile listings read from the fastest replica that is up and no
+# more than DB_REPLICA_MAX_LAG seconds behind (measured every DB_REPLICA_LAG_CHECK_INTERVAL);
+# a replica that fails is skipped for DB_REPLICA_FAILOVER_COOLDOWN seconds. Writes always go to DB_URL.
+DB_REPLICA_URLS = [host for host in os.environ.get("DB_REPLICA_URLS", "").split(",") if host]
+DB_REPLICA_MAX_LAG = 5
+DB_REPLICA_LAG_CHECK_INTERVAL = 10
+DB_REPLICA_FAILOVER_COOLDOWN = 30
+
+# verified-ticket cache: entries never outlive the ticket, nor TICKET_CACHE_TTL seconds
+TICKET_CACHE_MAX_ENTRIES = int(os.environ.get("TICKET_CACHE_MAX_ENTRIES", 10000))
+TICKET_CACHE_TTL = 5 * 60
+
+# ticket format handed out on login: "opaque" (random bytes, hash stored in data_tickets) or
+# "signed" (HMAC over issued/expiry/user, verified in memory). Both formats are always accepted.
+TICKET_MODE = os.environ.get("TICKET_MODE", "opaque")
+
+# ticket signing keys as "kid:hexkey,kid:hexkey"; the active key signs, every listed key verifies
+TICKET_SIGNING_KEYS = dict(entry.split(":", 1) for entry in
+                           os.environ.get("TICKET_SIGNING_KEYS", "").split(",") if entry)
+TICKET_SIGNING_KEY_ID = os.environ.get("TICKET_SIGNING_KEY_ID")
+
+# signed tickets revoked on logout are stored in data_revoked_tickets; each process reloads them at
+# most this often (seconds), so another process may still accept a revoked ticket for that long
+TICKET_REVOCATION_SYNC_INTERVAL = float(os.environ.get("TICKET_REVOCATION_SYNC_INTERVAL", 10))
+
+# how opaque tickets reach data_tickets: "sync" (INSERT and commit per login), "group" (logins wait
+# for a shared multi-row INSERT and commit) or "async" (write-behind: logins return before the
+# commit, so a crash can lose tickets issued in the last few ms; not for Lambda, which freezes the
+# writer between invocations). Batches hold up to TICKET_WRITE_MAX_BATCH rows and wait at most
+# TICKET_WRITE_MAX_DELAY seconds to fill; "group" logins wait up to TICKET_WRITE_TIMEOUT seconds.
+TICKET_WRITE_MODE = os.environ.get("TICKET_WRITE_MODE", "sync")
+TICKET_WRITE_MAX_BATCH = 500
+TICKET_WRITE_MAX_DELAY = 0.005
+TICKET_WRITE_MAX_PENDING = 10000
+TICKET_WRITE_TIMEOUT = 10
+
+# expired ticket reaper: rows per delete transaction, pause between batches and total run time (s)
+REAPER_BATCH_SIZE = 5000
+REAPER_BATCH_PAUSE = 0.05
+REAPER_TIME_BUDGET = 20
+
+# enrolled speaker profile list: seconds it is served, and fraction of that after which it is
+# refreshed in the background
+SPEECH_PROFILE_CACHE_TTL = 5 * 60
+SPEECH_PROFILE_REFRESH_AHEAD = 0.8
+
+# largest audio upload accepted (bytes); uploads are held in memory, never written to disk
+MAX_AUDIO_UPLOAD_BYTES = 10 * 1024 * 1024
+
+# accepted audio length (seconds) and whether non-16 kHz/16-bit/mono uploads are converted
+# (requires numpy) rather than rejected
+AUDIO_MIN_DURATION = 1.0
+AUDIO_MAX_DURATION = 5 * 60
+AUDIO_NORMALIZE = os.environ.get("AUDIO_NORMALIZE", "true").lower() == "true"
+
+# password hashing: scheme for new hashes ("scrypt" or "pbkdf2-sha256"), its cost, and the
+# dedicated hashing pool (threads, hashes allowed pending before logins are shed, wait seconds)
+PASSWORD_HASH_SCHEME = os.environ.get("PASSWORD_HASH_SCHEME", "scrypt")
+PASSWORD_SCRYPT_N = 2 ** 14
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+PASSWORD_PBKDF2_ITERATIONS = 200000
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 16))
+PASSWORD_HASH_TIMEOUT = 10
+
+# most tickets accepted by one /auth/check/batch request
+TICKET_BATCH_MAX_SIZE = 100
+
+# login throttling, checked before any DB or speaker service work: each client address gets a token
+# bucket of RATE_LIMIT_IP_BURST attempts refilled at RATE_LIMIT_IP_RATE per second (a speech login
+# costs RATE_LIMIT_SPEECH_COST tokens, as it is a paid remote call), and each e-mail address
+# RATE_LIMIT_EMAIL_ATTEMPTS attempts per sliding RATE_LIMIT_EMAIL_WINDOW seconds, counted in a
+# fixed-size sketch. RATE_LIMIT_REDIS_URL (requires the redis package) shares the limits between
+# instances; the in-process limits are used whenever Redis is unreachable.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_IP_RATE = 1
+RATE_LIMIT_IP_BURST = 20
+RATE_LIMIT_IP_MAX_KEYS = 100000
+RATE_LIMIT_SPEECH_COST = 5
+RATE_LIMIT_EMAIL_ATTEMPTS = 10
+RATE_LIMIT_EMAIL_WINDOW = 15 * 60
+RATE_LIMIT_SKETCH_WIDTH = 2 ** 14
+RATE_LIMIT_SKETCH_DEPTH = 4
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL")
+
+# speaker recognition service endpoint and key; plain HTTP is only meant for local stand-ins
+SPEAKER_SERVICE_HOST = os.environ.get("SPEAKER_SERVICE_HOST", "westus.api.cognitive.microsoft.com")
+SPEAKER_SERVICE_HTTPS = os.environ.get("SPEAKER_SERVICE_HTTPS", "true").lower() == "true"
+SPEAKER_SUBSCRIPTION_KEY = os.environ.get("SPEAKER_SUBSCRIPTION_KEY", r'4a8368646beb44e29eeafd5f86ec86c9')
+
+# speaker identification backend: "remote" (the speaker service above) or "local" (MFCC embeddings
+# computed in-process with numpy, one .npz file per profile in SPEAKER_LOCAL_MODEL_DIR). Lambda's
+# file system is ephemeral, so there the directory must be a mounted EFS path; Lambda also lacks
+# the shared memory process pools need, so features are extracted in the request thread
+# (SPEAKER_LOCAL_WORKERS=0) unless configured otherwise.
+SPEAKER_BACKEND = os.environ.get("SPEAKER_BACKEND", "remote")
+SPEAKER_LOCAL_MODEL_DIR = os.environ.get("SPEAKER_LOCAL_MODEL_DIR", "speaker_models")
+SPEAKER_LOCAL_WORKERS = int(os.environ.get("SPEAKER_LOCAL_WORKERS",
+                                           0 if "AWS_LAMBDA_FUNCTION_NAME" in os.environ else os.cpu_count() or 1))
+
+# speaker service resilience: GETs are retried SPEAKER_GET_RETRIES times with jittered backoff;
+# profile lookups send a hedged second request after SPEAKER_HEDGE_AFTER seconds (unset: never);
+# the circuit breaker opens when SPEAKER_BREAKER_FAILURE_RATE of recent calls failed or took longer
+# than SPEAKER_BREAKER_SLOW_CALL seconds, and refuses calls for SPEAKER_BREAKER_OPEN_SECONDS
+SPEAKER_CONNECT_TIMEOUT = 5
+SPEAKER_READ_TIMEOUT = 30
+SPEAKER_GET_RETRIES = 2
+SPEAKER_HEDGE_AFTER = float(os.environ["SPEAKER_HEDGE_AFTER"]) if os.environ.get("SPEAKER_HEDGE_AFTER") else None
+SPEAKER_BREAKER_FAILURE_RATE = 0.5
+SPEAKER_BREAKER_SLOW_CALL = 10
+SPEAKER_BREAKER_OPEN_SECONDS = 30
+
+# the identify API takes at most SPEAKER_IDENTIFY_CHUNK_SIZE candidate profiles per call; speech
+# logins over more profiles send one call per chunk, SPEAKER_IDENTIFY_WORKERS at a time per process
+SPEAKER_IDENTIFY_CHUNK_SIZE = 10
+SPEAKER_IDENTIFY_WORKERS = 10
+
+# key (hex) signing the poll URLs of speech logins submitted with wait=false, which are bound to the
+# submitting address; every instance behind the same endpoint needs the same key, a random key per
+# process only suits a single process
+SPEECH_OPERATION_KEY = bytes.fromhex(os.environ["SPEECH_OPERATION_KEY"]) if os.environ.get("SPEECH_OPERATION_KEY") \
+    else os.urandom(32)
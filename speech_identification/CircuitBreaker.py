@@ -0,0 +1,121 @@
+"""Circuit breaker guarding the calls the service client helpers make to the service."""
+
+import threading
+import time
+from collections import deque
+
+from speech_identification.IdentificationServiceError import CircuitOpenError
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker over a sliding window of the most recent calls.
+
+    Closed: calls go through, and each is recorded as good or bad (failed, or slower than
+    slow_call_duration). Once at least min_calls are in the window and the share of bad ones reaches
+    failure_rate, the breaker opens. Open: calls fail fast with CircuitOpenError for open_duration.
+    Half-open: up to half_open_calls probe calls go through; the breaker closes if they are all good
+    and opens again on the first bad one.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_rate=0.5, slow_call_duration=10.0, window=20, min_calls=10,
+                 open_duration=30.0, half_open_calls=2):
+        """Constructor of the CircuitBreaker class.
+
+        Arguments:
+        failure_rate -- share of bad calls in the window at which the breaker opens
+        slow_call_duration -- seconds after which a successful call still counts as bad
+        window -- number of most recent calls considered
+        min_calls -- calls needed in the window before the breaker may open
+        open_duration -- seconds calls are refused before probing the service again
+        half_open_calls -- probe calls let through while half-open
+        """
+        self._failure_rate = failure_rate
+        self._slow_call_duration = slow_call_duration
+        self._min_calls = min_calls
+        self._open_duration = open_duration
+        self._half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probes_good = 0
+        self._times_opened = 0
+        self._rejected = 0
+
+    @property
+    def state(self):
+        """Returns the current state: CLOSED, OPEN or HALF_OPEN."""
+        with self._lock:
+            self._advance(time.monotonic())
+            return self._state
+
+    def before_call(self):
+        """Must be called before each call; raises CircuitOpenError if the call must not be made."""
+        now = time.monotonic()
+        with self._lock:
+            self._advance(now)
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.HALF_OPEN and self._probes < self._half_open_calls:
+                self._probes += 1
+                return
+            self._rejected += 1
+            retry_after = max(0.0, self._opened_at + self._open_duration - now)
+        raise CircuitOpenError('Speaker service circuit is open after repeated failures',
+                               retry_after)
+
+    def after_call(self, failed, duration):
+        """Records the outcome of a call let through by before_call.
+
+        Arguments:
+        failed -- True if the call failed in a way that suggests the service is unhealthy
+        duration -- seconds the call took
+        """
+        bad = failed or duration > self._slow_call_duration
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if bad:
+                    self._open(time.monotonic())
+                else:
+                    self._probes_good += 1
+                    if self._probes_good >= self._half_open_calls:
+                        self._state = self.CLOSED
+                        self._outcomes.clear()
+                return
+            if self._state == self.OPEN:
+                # a call started before the breaker opened
+                return
+
+            self._outcomes.append(bad)
+            if len(self._outcomes) >= self._min_calls and \
+                    sum(self._outcomes) >= self._failure_rate * len(self._outcomes):
+                self._open(time.monotonic())
+
+    def stats(self):
+        """Returns a dictionary of the breaker's state and counters."""
+        with self._lock:
+            self._advance(time.monotonic())
+            return {
+                'state': self._state,
+                'recent_calls': len(self._outcomes),
+                'recent_bad_calls': sum(self._outcomes),
+                'times_opened': self._times_opened,
+                'rejected': self._rejected,
+            }
+
+    def _open(self, now):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._times_opened += 1
+        self._outcomes.clear()
+
+    def _advance(self, now):
+        if self._state == self.OPEN and now - self._opened_at >= self._open_duration:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+            self._probes_good = 0
@@ -38,6 +38,8 @@ class EnrollmentResponse:
     _SPEECH_TIME = 'speechTime'
     _ENROLLMENT_STATUS = 'enrollmentStatus'
 
+    __slots__ = ('_total_speech_time', '_remaining_speech_time', '_speech_time', '_enrollment_status')
+
     def __init__(self, response):
         """Constructor of the EnrollmentResponse class.
 
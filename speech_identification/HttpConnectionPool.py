@@ -0,0 +1,150 @@
+"""Keep-alive HTTPS connection pool used by the service client helpers."""
+
+import http.client
+import threading
+import time
+
+
+class HttpConnectionPool:
+    """Thread-safe pool of persistent HTTPS (or, for local stand-ins, HTTP) connections, kept
+    separately per host."""
+
+    _STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                                ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+    _IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE', 'PUT', 'OPTIONS')
+
+    def __init__(self, max_connections=10, connect_timeout=5.0, read_timeout=30.0, idle_timeout=50.0,
+                 observer=None, use_https=True):
+        """Constructor of the HttpConnectionPool class.
+
+        Arguments:
+        max_connections -- maximum number of concurrent connections per host
+        connect_timeout -- seconds allowed for the TCP and TLS handshake, and for waiting on a free connection
+        read_timeout -- seconds allowed between bytes once connected
+        idle_timeout -- seconds after which an idle connection is closed instead of reused
+        observer -- optional callable(host, phase, seconds) receiving the 'connect' (TCP and TLS
+                    handshake), 'send', 'ttfb' and 'read' timings of every request
+        use_https -- False to connect with plain HTTP
+        """
+        self._max_connections = max_connections
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._idle_timeout = idle_timeout
+        self._observer = observer
+        self._connection_class = http.client.HTTPSConnection if use_https else http.client.HTTPConnection
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    def request(self, host, method, url, body=None, headers=None):
+        """Sends a request over a pooled connection and returns the response and its body bytes.
+
+        A reused connection the server has already closed is transparently replaced, provided the
+        body can be sent again and the request cannot run twice: either the method is idempotent or
+        the connection failed before the request was completely sent.
+
+        Arguments:
+        host -- the host to connect to
+        method -- the HTTP method
+        url -- the request path and query string
+        body -- the request body: None, bytes, str or a file-like object
+        headers -- dictionary of request headers
+        """
+        slot = self._get_slot(host)
+        if not slot.acquire(timeout=self._connect_timeout):
+            raise TimeoutError('No connection to {0} available within {1}s'.format(
+                host, self._connect_timeout))
+        try:
+            position = body.tell() if hasattr(body, 'seek') else None
+            while True:
+                conn, reused = self._checkout(host)
+                sent = None
+                try:
+                    start = time.perf_counter()
+                    if conn.sock is None:
+                        conn.connect()
+                        conn.sock.settimeout(self._read_timeout)
+                    connected = time.perf_counter()
+                    conn.request(method, url, body, headers or {})
+                    sent = time.perf_counter()
+                    res = conn.getresponse()
+                    first_byte = time.perf_counter()
+                    data = res.read()
+                    done = time.perf_counter()
+                except self._STALE_CONNECTION_ERRORS:
+                    conn.close()
+                    # a POST the server fully received may have been processed before it hung up
+                    may_have_run = sent is not None and method not in self._IDEMPOTENT_METHODS
+                    if not reused or may_have_run or not self._rewind(body, position):
+                        raise
+                    # the server dropped one idle connection, the others are likely gone too
+                    self._discard_idle(host)
+                    continue
+                except BaseException:
+                    conn.close()
+                    raise
+
+                if res.will_close:
+                    conn.close()
+                else:
+                    self._checkin(host, conn)
+
+                if self._observer is not None:
+                    if not reused:
+                        self._observer(host, 'connect', connected - start)
+                    self._observer(host, 'send', sent - connected)
+                    self._observer(host, 'ttfb', first_byte - sent)
+                    self._observer(host, 'read', done - first_byte)
+                return res, data
+        finally:
+            slot.release()
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+    def _get_slot(self, host):
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = self._slots[host] = threading.BoundedSemaphore(self._max_connections)
+            return slot
+
+    def _checkout(self, host):
+        now = time.monotonic()
+        expired = []
+        try:
+            with self._lock:
+                connections = self._idle.get(host, [])
+                while connections:
+                    conn, last_used = connections.pop()
+                    if now - last_used < self._idle_timeout:
+                        return conn, True
+                    expired.append(conn)
+        finally:
+            for conn in expired:
+                conn.close()
+        return self._connection_class(host, timeout=self._connect_timeout), False
+
+    def _checkin(self, host, conn):
+        with self._lock:
+            self._idle.setdefault(host, []).append((conn, time.monotonic()))
+
+    def _discard_idle(self, host):
+        with self._lock:
+            connections = self._idle.pop(host, [])
+        for conn, _ in connections:
+            conn.close()
+
+    @staticmethod
+    def _rewind(body, position):
+        if body is None or isinstance(body, (bytes, bytearray, str)):
+            return True
+        if position is None:
+            return False
+        body.seek(position)
+        return True
@@ -30,6 +30,8 @@ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import json
+
 class IdentificationProfile:
     """This class encapsulates a user profile."""
 
@@ -41,6 +43,9 @@ class IdentificationProfile:
     _LAST_ACTION_DATE_TIME = 'lastActionDateTime'
     _ENROLLMENT_STATUS = 'enrollmentStatus'
 
+    __slots__ = ('_profile_id', '_locale', '_enrollment_speech_time', '_remaining_enrollment_time',
+                 '_created_date_time', '_last_action_date_time', '_enrollment_status')
+
     def __init__(self, response):
         """Constructor of the IdentificationProfile class.
 
@@ -82,3 +87,24 @@ class IdentificationProfile:
     def get_enrollment_status(self):
         """Returns the enrollment status of the user"""
         return self._enrollment_status
+
+
+def parse_profiles(message, enrollment_status=None):
+    """Parses a profile listing into a list of IdentificationProfile. Each profile is built as soon
+    as its entry is decoded and entries with another enrollment status are dropped right away, so
+    neither the decoded listing nor objects for skipped entries are kept around.
+
+    Arguments:
+    message -- the JSON text of the listing, an array of profile objects
+    enrollment_status -- if given, only profiles with this enrollment status are returned
+    """
+    def build(raw):
+        if IdentificationProfile._PROFILE_ID not in raw:
+            # an object nested in a profile entry
+            return raw
+        if enrollment_status is not None and \
+                raw.get(IdentificationProfile._ENROLLMENT_STATUS) != enrollment_status:
+            return None
+        return IdentificationProfile(raw)
+
+    return [profile for profile in json.loads(message, object_hook=build) if profile is not None]
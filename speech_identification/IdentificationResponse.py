@@ -36,6 +36,8 @@ class IdentificationResponse:
     _IDENTIFIED_PROFILE_ID = 'identifiedProfileId'
     _CONFIDENCE = 'confidence'
 
+    __slots__ = ('_identified_profile_id', '_confidence')
+
     def __init__(self, response):
         """Constructor of the IdentificationResponse class.
 
@@ -52,3 +54,30 @@ class IdentificationResponse:
     def get_confidence(self):
         """Returns the identification confidence"""
         return self._confidence
+
+    def is_match(self):
+        """Returns True if a profile was identified, False if the speaker matched none of them"""
+        return self._identified_profile_id not in (None, _NO_MATCH_PROFILE_ID)
+
+    def is_high_confidence_match(self):
+        """Returns True if a profile was identified with High confidence"""
+        return self.is_match() and self._confidence == _CONFIDENCE_HIGH
+
+
+_NO_MATCH_PROFILE_ID = '00000000-0000-0000-0000-000000000000'
+_CONFIDENCE_HIGH = 'High'
+_CONFIDENCE_RANK = {'Low': 1, 'Normal': 2, _CONFIDENCE_HIGH: 3}
+
+
+def best_identification(identifications):
+    """Merges the identification responses for disjoint sets of candidate profiles into one:
+    the most confident match, the first of equally confident ones, or the first response if no
+    profile matched. Returns None for an empty list.
+
+    Arguments:
+    identifications -- a list of IdentificationResponse
+    """
+    matches = [identification for identification in identifications if identification.is_match()]
+    if not matches:
+        return identifications[0] if identifications else None
+    return max(matches, key=lambda identification: _CONFIDENCE_RANK.get(identification.get_confidence(), 0))
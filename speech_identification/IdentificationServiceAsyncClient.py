@@ -0,0 +1,480 @@
+"""asyncio client for the Identification service, used by the ASGI app."""
+
+import asyncio
+import json
+import logging
+import re
+import time
+import urllib.parse
+
+import aiohttp
+
+from speech_identification import IdentificationProfile
+from speech_identification import IdentificationResponse
+from speech_identification import EnrollmentResponse
+from speech_identification import ProfileCreationResponse
+from speech_identification.IdentificationServiceError import IdentificationServiceError, \
+    ServiceUnavailableError, ServiceTimeoutError, OperationFailedError, error_for_status
+
+
+class IdentificationServiceAsyncClient:
+    """Coroutine counterpart of IdentificationServiceHttpClientHelper. Returns the same response
+    classes and raises the same IdentificationServiceError types; waiting on an operation sleeps on
+    the event loop instead of holding a thread."""
+
+    _STATUS_OK = 200
+    _STATUS_ACCEPTED = 202
+    _BASE_URI = 'westus.api.cognitive.microsoft.com'
+    _IDENTIFICATION_PROFILES_URI = '/spid/v1.0/identificationProfiles'
+    _IDENTIFICATION_URI = '/spid/v1.0/identify'
+    _OPERATIONS_URI = '/spid/v1.0/operations'
+    _SUBSCRIPTION_KEY_HEADER = 'Ocp-Apim-Subscription-Key'
+    _CONTENT_TYPE_HEADER = 'Content-Type'
+    _JSON_CONTENT_HEADER_VALUE = 'application/json'
+    _STREAM_CONTENT_HEADER_VALUE = 'application/octet-stream'
+    _SHORT_AUDIO_PARAMETER_NAME = 'shortAudio'
+    _OPERATION_LOCATION_HEADER = 'Operation-Location'
+    _RETRY_AFTER_HEADER = 'Retry-After'
+    _OPERATION_STATUS_FIELD_NAME = 'status'
+    _OPERATION_PROC_RES_FIELD_NAME = 'processingResult'
+    _OPERATION_MESSAGE_FIELD_NAME = 'message'
+    _OPERATION_STATUS_SUCCEEDED = 'succeeded'
+    _OPERATION_STATUS_FAILED = 'failed'
+    _OPERATION_STATUS_UPDATE_DELAY = 5
+    _OPERATION_STATUS_INITIAL_DELAY = 0.05
+    _OPERATION_STATUS_BACKOFF = 2
+    _OPERATION_TIMEOUT = 60
+    _OPERATION_ID_PATTERN = re.compile(r'^[0-9A-Fa-f-]{36}$')
+    _OPERATION_ID_SEPARATOR = ','
+    _MAX_OPERATION_IDS = 100
+
+    def __init__(self, subscription_key, max_connections=100, connect_timeout=5.0, read_timeout=30.0,
+                 observer=None, base_uri=None, use_https=True, identify_chunk_size=10):
+        """Constructor of the IdentificationServiceAsyncClient class.
+
+        Arguments:
+        subscription_key -- the subscription key string
+        max_connections -- maximum number of concurrent keep-alive connections to the service
+        connect_timeout -- seconds allowed to establish a connection
+        read_timeout -- seconds allowed to wait for response data
+        observer -- optional callable(host, phase, seconds) receiving the 'ttfb' and 'read' time of
+                    every request and the duration of each 'poll' iteration
+        base_uri -- host (and optional port) of the service, defaults to _BASE_URI
+        use_https -- False to talk plain HTTP, e.g. to a local stand-in of the service
+        identify_chunk_size -- most profile IDs sent in one identification request; larger candidate
+                               sets are split into requests of this size sent concurrently, within
+                               max_connections
+        """
+        self._subscription_key = subscription_key
+        self._observer = observer
+        if base_uri:
+            self._BASE_URI = base_uri
+        self._scheme = 'https' if use_https else 'http'
+        self._max_connections = max_connections
+        self._timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self._session = None
+        self._profiles_changed_listeners = []
+        self._identify_chunk_size = identify_chunk_size
+
+    def is_calibrated(self):
+        """Returns True: the service's confidences hold however many profiles are enrolled."""
+        return True
+
+    def add_profiles_changed_listener(self, listener):
+        """Registers a callback invoked with the profile ID whenever a profile is created or
+        enrolled through this client.
+
+        Arguments:
+        listener -- callable taking the profile ID string
+        """
+        self._profiles_changed_listeners.append(listener)
+
+    def _notify_profiles_changed(self, profile_id):
+        for listener in self._profiles_changed_listeners:
+            listener(profile_id)
+
+    async def get_all_profiles(self, enrollment_status=None):
+        """Return a list of all profiles on the server.
+
+        Arguments:
+        enrollment_status -- if given, only profiles with this enrollment status are returned
+        """
+        try:
+            status, reason, headers, message = await self._send_request(
+                'GET', self._url(self._IDENTIFICATION_PROFILES_URI), self._JSON_CONTENT_HEADER_VALUE)
+
+            if status == self._STATUS_OK:
+                return IdentificationProfile.parse_profiles(message, enrollment_status)
+            raise self._error('Error getting all profiles: ', status, reason, headers, message)
+        except:
+            logging.error('Error getting all profiles.')
+            raise
+
+    async def get_profile(self, profile_id):
+        """Get a speaker's profile with given profile ID
+
+        Arguments:
+        profile_id -- the profile ID of the profile
+        """
+        try:
+            status, reason, headers, message = await self._send_request(
+                'GET', self._url('{0}/{1}'.format(self._IDENTIFICATION_PROFILES_URI, profile_id)),
+                self._JSON_CONTENT_HEADER_VALUE)
+
+            if status == self._STATUS_OK:
+                return IdentificationProfile.IdentificationProfile(json.loads(message))
+            raise self._error('Error getting profile: ', status, reason, headers, message)
+        except:
+            logging.error('Error getting profile.')
+            raise
+
+    async def create_profile(self, locale):
+        """Creates a profile on the server and returns the creation response.
+
+        Arguments:
+        locale -- the locale string for the profile
+        """
+        try:
+            status, reason, headers, message = await self._send_request(
+                'POST', self._url(self._IDENTIFICATION_PROFILES_URI), self._JSON_CONTENT_HEADER_VALUE,
+                json.dumps({'locale': '{0}'.format(locale)}))
+
+            if status == self._STATUS_OK:
+                creation = ProfileCreationResponse.ProfileCreationResponse(json.loads(message))
+                self._notify_profiles_changed(creation.get_profile_id())
+                return creation
+            raise self._error('Error creating profile: ', status, reason, headers, message)
+        except:
+            logging.error('Error creating profile.')
+            raise
+
+    async def enroll_profile(self, profile_id, audio, force_short_audio=False):
+        """Enrolls a profile using audio and returns the enrollment response.
+
+        Arguments:
+        profile_id -- the profile ID string of the user to enroll
+        audio -- the audio bytes to use
+        force_short_audio -- instruct the service to waive the recommended minimum audio limit
+                             needed for enrollment
+        """
+        try:
+            request_url = '{0}/{1}/enroll?{2}={3}'.format(
+                self._IDENTIFICATION_PROFILES_URI,
+                urllib.parse.quote(profile_id),
+                self._SHORT_AUDIO_PARAMETER_NAME,
+                force_short_audio)
+
+            status, reason, headers, message = await self._send_request(
+                'POST', self._url(request_url), self._STREAM_CONTENT_HEADER_VALUE, audio)
+
+            if status == self._STATUS_OK:
+                enrollment = EnrollmentResponse.EnrollmentResponse(json.loads(message))
+            elif status == self._STATUS_ACCEPTED:
+                enrollment = EnrollmentResponse.EnrollmentResponse(
+                    await self._poll_operation(headers[self._OPERATION_LOCATION_HEADER]))
+            else:
+                raise self._error('Error enrolling profile: ', status, reason, headers, message)
+
+            self._notify_profiles_changed(profile_id)
+            return enrollment
+        except:
+            logging.error('Error enrolling profile.')
+            raise
+
+    async def identify_file(self, audio, test_profile_ids, force_short_audio=False, timeout=None):
+        """Identifies the speaker of audio among the given profiles and returns the
+        identification response, waiting for the service to finish processing.
+
+        More profiles than identify_chunk_size are split into several identifications sent
+        concurrently; the first High-confidence match among them is returned without waiting for
+        the others, otherwise the most confident match once all have finished.
+
+        Arguments:
+        audio -- the audio bytes to test
+        test_profile_ids -- an array of test profile IDs strings
+        force_short_audio -- instruct the service to waive the recommended minimum audio limit
+                             needed for enrollment
+        timeout -- seconds to wait for processing to finish, defaults to _OPERATION_TIMEOUT
+        """
+        chunks = self._chunk_profile_ids(test_profile_ids)
+        if len(chunks) <= 1:
+            operation_id, identification = await self.submit_identification(
+                audio, test_profile_ids, force_short_audio)
+            if identification is not None:
+                return identification
+
+            try:
+                return IdentificationResponse.IdentificationResponse(
+                    await self._poll_operation(self._operation_url(operation_id), timeout))
+            except:
+                logging.error('Error identifying file.')
+                raise
+
+        try:
+            return await self._gather_identifications(
+                [asyncio.ensure_future(self._identify_chunk(audio, chunk, force_short_audio, timeout))
+                 for chunk in chunks])
+        except:
+            logging.error('Error identifying file.')
+            raise
+
+    async def submit_identification(self, audio, test_profile_ids, force_short_audio=False):
+        """Submits audio for identification without waiting for it to be processed.
+
+        Returns a tuple (operation ID, identification response), as
+        IdentificationServiceHttpClientHelper.submit_identification does.
+
+        Arguments:
+        audio -- the audio bytes to test
+        test_profile_ids -- an array of test profile IDs strings
+        force_short_audio -- instruct the service to waive the recommended minimum audio limit
+                             needed for enrollment
+        """
+        try:
+            if len(test_profile_ids) < 1:
+                raise IdentificationServiceError('Error identifying file: no test profile IDs are provided.')
+            chunks = self._chunk_profile_ids(test_profile_ids)
+            if len(chunks) > self._MAX_OPERATION_IDS:
+                raise IdentificationServiceError(
+                    'Error identifying file: more than {0} profiles cannot be submitted without '
+                    'waiting.'.format(self._MAX_OPERATION_IDS * self._identify_chunk_size))
+            if len(chunks) == 1:
+                return await self._submit_chunk(audio, test_profile_ids, force_short_audio)
+
+            submitted = await asyncio.gather(
+                *[self._submit_chunk(audio, chunk, force_short_audio) for chunk in chunks])
+            operation_ids = [operation_id for operation_id, _ in submitted if operation_id is not None]
+            identifications = [identification for _, identification in submitted if identification is not None]
+            best = IdentificationResponse.best_identification(identifications)
+            if not operation_ids or (best is not None and best.is_high_confidence_match()):
+                return None, best
+            if identifications:
+                # an operation ID cannot carry the answers already given, so wait for the rest
+                return None, await self._gather_identifications(
+                    [asyncio.ensure_future(self._wait_identification(operation_id))
+                     for operation_id in operation_ids], identifications)
+            return self._OPERATION_ID_SEPARATOR.join(operation_ids), None
+        except:
+            logging.error('Error identifying file.')
+            raise
+
+    async def get_identification_result(self, operation_id):
+        """Checks an identification operation once, without waiting.
+
+        Returns the identification response if processing succeeded, or None if the operation is
+        still running. Raises if the operation failed. Operation IDs of identifications submitted
+        in several parts are handled as in
+        IdentificationServiceHttpClientHelper.get_identification_result.
+
+        Arguments:
+        operation_id -- the operation ID returned by submit_identification
+        """
+        operation_ids = operation_id.split(self._OPERATION_ID_SEPARATOR)
+        if len(operation_ids) > self._MAX_OPERATION_IDS or \
+                not all(self._OPERATION_ID_PATTERN.match(part) for part in operation_ids):
+            raise ValueError('Invalid operation ID: ' + operation_id)
+        try:
+            results = await asyncio.gather(
+                *[self._check_operation(self._operation_url(part)) for part in operation_ids],
+                return_exceptions=True)
+            identifications = [IdentificationResponse.IdentificationResponse(result) for result in results
+                               if result is not None and not isinstance(result, Exception)]
+            for identification in identifications:
+                if identification.is_high_confidence_match():
+                    return identification
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            if len(identifications) < len(results):
+                return None
+            return IdentificationResponse.best_identification(identifications)
+        except:
+            logging.error('Error getting the identification result.')
+            raise
+
+    def _chunk_profile_ids(self, test_profile_ids):
+        size = self._identify_chunk_size
+        return [test_profile_ids[i:i + size] for i in range(0, len(test_profile_ids), size)]
+
+    async def _submit_chunk(self, audio, test_profile_ids, force_short_audio):
+        """Sends one identification request and returns a tuple (operation ID, identification
+        response) as submit_identification does
+
+        Arguments:
+        audio -- the audio bytes to test
+        test_profile_ids -- an array of at most identify_chunk_size test profile IDs strings
+        force_short_audio -- instruct the service to waive the recommended minimum audio limit
+        """
+        request_url = '{0}?identificationProfileIds={1}&{2}={3}'.format(
+            self._IDENTIFICATION_URI,
+            urllib.parse.quote(','.join(test_profile_ids)),
+            self._SHORT_AUDIO_PARAMETER_NAME,
+            force_short_audio)
+
+        status, reason, headers, message = await self._send_request(
+            'POST', self._url(request_url), self._STREAM_CONTENT_HEADER_VALUE, audio)
+
+        if status == self._STATUS_OK:
+            return None, IdentificationResponse.IdentificationResponse(json.loads(message))
+        elif status == self._STATUS_ACCEPTED:
+            operation_url = headers[self._OPERATION_LOCATION_HEADER]
+            return urllib.parse.urlparse(operation_url).path.rsplit('/', 1)[-1], None
+        raise self._error('Error identifying file: ', status, reason, headers, message)
+
+    async def _identify_chunk(self, audio, test_profile_ids, force_short_audio, timeout):
+        operation_id, identification = await self._submit_chunk(audio, test_profile_ids, force_short_audio)
+        if identification is not None:
+            return identification
+        return await self._wait_identification(operation_id, timeout)
+
+    async def _wait_identification(self, operation_id, timeout=None):
+        return IdentificationResponse.IdentificationResponse(
+            await self._poll_operation(self._operation_url(operation_id), timeout))
+
+    async def _gather_identifications(self, tasks, identifications=()):
+        """Waits on the tasks of the parts of one identification and returns the first
+        High-confidence match, or once all are done the most confident one. Raises the first
+        error of a part unless another part found a High-confidence match. The remaining tasks
+        are cancelled on return.
+
+        Arguments:
+        tasks -- tasks of _identify_chunk or _wait_identification calls
+        identifications -- responses of parts that were answered without an operation
+        """
+        identifications = list(identifications)
+        error = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    identification = await next_done
+                except Exception as e:
+                    error = error or e
+                    continue
+                if identification.is_high_confidence_match():
+                    return identification
+                identifications.append(identification)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if error is not None:
+            raise error
+        return IdentificationResponse.best_identification(identifications)
+
+    def _url(self, request_url):
+        return '{0}://{1}{2}'.format(self._scheme, self._BASE_URI, request_url)
+
+    def _operation_url(self, operation_id):
+        return self._url('{0}/{1}'.format(self._OPERATIONS_URI, operation_id))
+
+    async def _poll_operation(self, operation_url, timeout=None):
+        """Polls on an operation till it is done, backing off from a few milliseconds up to
+        _OPERATION_STATUS_UPDATE_DELAY between checks
+
+        Arguments:
+        operation_url -- the url to poll for the operation status
+        timeout -- seconds to wait in total, defaults to _OPERATION_TIMEOUT
+        """
+        try:
+            deadline = time.monotonic() + (self._OPERATION_TIMEOUT if timeout is None else timeout)
+            delay = self._OPERATION_STATUS_INITIAL_DELAY
+
+            while True:
+                started = time.perf_counter()
+                result = await self._check_operation(operation_url)
+                if self._observer is not None:
+                    self._observer(urllib.parse.urlparse(operation_url).netloc, 'poll',
+                                   time.perf_counter() - started)
+                if result is not None:
+                    return result
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ServiceTimeoutError('Operation Error: timed out waiting for ' + operation_url)
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * self._OPERATION_STATUS_BACKOFF, self._OPERATION_STATUS_UPDATE_DELAY)
+        except asyncio.CancelledError:
+            raise
+        except:
+            logging.error('Error polling the operation status.')
+            raise
+
+    async def _check_operation(self, operation_url):
+        """Checks the status of an operation once and returns its processing result,
+        or None if it is still running
+
+        Arguments:
+        operation_url -- the url of the operation status
+        """
+        status, reason, headers, message = await self._send_request(
+            'GET', operation_url, self._JSON_CONTENT_HEADER_VALUE)
+
+        if status != self._STATUS_OK:
+            raise self._error('Operation Error: ', status, reason, headers, message)
+
+        operation_response = json.loads(message)
+
+        if operation_response[self._OPERATION_STATUS_FIELD_NAME] == \
+                self._OPERATION_STATUS_SUCCEEDED:
+            return operation_response[self._OPERATION_PROC_RES_FIELD_NAME]
+        elif operation_response[self._OPERATION_STATUS_FIELD_NAME] == \
+                self._OPERATION_STATUS_FAILED:
+            raise OperationFailedError('Operation Error: ' +
+                                       operation_response[self._OPERATION_MESSAGE_FIELD_NAME])
+        return None
+
+    async def _send_request(self, method, url, content_type_value, body=None):
+        """Sends the request to the server then returns the status, reason, headers and the
+        response body string. Transport errors are raised as ServiceUnavailableError or
+        ServiceTimeoutError.
+
+        Arguments:
+        method -- the HTTP method
+        url -- the absolute url of the request
+        content_type_value -- the value of the content type field in the headers
+        body -- the body of the request (needed only in POST methods)
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._max_connections), timeout=self._timeout)
+        headers = {self._CONTENT_TYPE_HEADER: content_type_value,
+                   self._SUBSCRIPTION_KEY_HEADER: self._subscription_key}
+        try:
+            started = time.perf_counter()
+            async with self._session.request(method, url, data=body, headers=headers) as res:
+                first_byte = time.perf_counter()
+                message = await res.text('utf-8')
+                done = time.perf_counter()
+                if self._observer is not None:
+                    host = urllib.parse.urlparse(url).netloc
+                    self._observer(host, 'ttfb', first_byte - started)
+                    self._observer(host, 'read', done - first_byte)
+                return res.status, res.reason, res.headers, message
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError as e:
+            logging.error('Error sending the request.')
+            raise ServiceTimeoutError('Timed out talking to {0}: {1}'.format(self._BASE_URI, e)) from e
+        except (OSError, aiohttp.ClientError) as e:
+            logging.error('Error sending the request.')
+            raise ServiceUnavailableError('Error talking to {0}: {1}'.format(self._BASE_URI, e)) from e
+        except:
+            logging.error('Error sending the request.')
+            raise
+
+    def _error(self, message, status, reason, headers, body):
+        """Returns the exception for an unsuccessful response
+
+        Arguments:
+        message -- the error message prefix
+        status -- the HTTP status
+        reason -- the HTTP reason phrase
+        headers -- the response headers
+        body -- the response body string
+        """
+        return error_for_status(status, message + (body or reason), headers.get(self._RETRY_AFTER_HEADER))
+
+    async def close(self):
+        """Closes the connections held by this client."""
+        session, self._session = self._session, None
+        if session is not None:
+            await session.close()
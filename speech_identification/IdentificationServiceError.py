@@ -0,0 +1,85 @@
+"""Exceptions raised by the Identification service clients, one class per kind of failure."""
+
+
+class IdentificationServiceError(Exception):
+    """Base class of every error raised by the Identification service clients."""
+
+    def __init__(self, message, status=None):
+        """Constructor of the IdentificationServiceError class.
+
+        Arguments:
+        message -- the error message
+        status -- the HTTP status the service answered with, if any
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class RequestRejectedError(IdentificationServiceError):
+    """The service refused the request as invalid (HTTP 4xx); retrying it will not help."""
+
+
+class ProfileNotFoundError(RequestRejectedError):
+    """The profile or operation does not exist (HTTP 404)."""
+
+
+class ServiceThrottledError(IdentificationServiceError):
+    """The service is rate limiting this subscription (HTTP 429)."""
+
+    def __init__(self, message, status=429, retry_after=None):
+        """Constructor of the ServiceThrottledError class.
+
+        Arguments:
+        message -- the error message
+        status -- the HTTP status the service answered with
+        retry_after -- seconds the service asked to wait before retrying, if it said
+        """
+        super().__init__(message, status)
+        self.retry_after = retry_after
+
+
+class ServiceUnavailableError(IdentificationServiceError):
+    """The service could not be reached or failed on its side (connection error or HTTP 5xx)."""
+
+
+class ServiceTimeoutError(ServiceUnavailableError):
+    """The service did not answer, or an operation did not finish, in time."""
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """The request was not sent because recent requests to the service kept failing."""
+
+    def __init__(self, message, retry_after):
+        """Constructor of the CircuitOpenError class.
+
+        Arguments:
+        message -- the error message
+        retry_after -- seconds until the circuit breaker lets a probe request through
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OperationFailedError(IdentificationServiceError):
+    """The service accepted the request but reported its processing as failed."""
+
+
+def error_for_status(status, message, retry_after=None):
+    """Returns the exception matching an unsuccessful HTTP status.
+
+    Arguments:
+    status -- the HTTP status code
+    message -- the error message
+    retry_after -- value of the response's Retry-After header, if any
+    """
+    if status == 404:
+        return ProfileNotFoundError(message, status)
+    if status == 429:
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            retry_after = None
+        return ServiceThrottledError(message, status, retry_after)
+    if 400 <= status < 500:
+        return RequestRejectedError(message, status)
+    return ServiceUnavailableError(message, status)
@@ -30,15 +30,25 @@ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-import http.client
 import urllib.parse
+import http.client
 import json
+import random
+import re
+import socket
+import threading
 import time
-from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, FIRST_COMPLETED, \
+    as_completed, wait
+from contextlib import contextmanager
+from speech_identification import CircuitBreaker
+from speech_identification import HttpConnectionPool
 from speech_identification import IdentificationProfile
 from speech_identification import IdentificationResponse
 from speech_identification import EnrollmentResponse
 from speech_identification import ProfileCreationResponse
+from speech_identification.IdentificationServiceError import IdentificationServiceError, \
+    ServiceUnavailableError, ServiceTimeoutError, CircuitOpenError, OperationFailedError, error_for_status
 import logging
 
 class IdentificationServiceHttpClientHelper:
@@ -49,6 +59,7 @@ class IdentificationServiceHttpClientHelper:
     _BASE_URI = 'westus.api.cognitive.microsoft.com'
     _IDENTIFICATION_PROFILES_URI = '/spid/v1.0/identificationProfiles'
     _IDENTIFICATION_URI = '/spid/v1.0/identify'
+    _OPERATIONS_URI = '/spid/v1.0/operations'
     _SUBSCRIPTION_KEY_HEADER = 'Ocp-Apim-Subscription-Key'
     _CONTENT_TYPE_HEADER = 'Content-Type'
     _JSON_CONTENT_HEADER_VALUE = 'application/json'
@@ -61,35 +72,103 @@ class IdentificationServiceHttpClientHelper:
     _OPERATION_STATUS_SUCCEEDED = 'succeeded'
     _OPERATION_STATUS_FAILED = 'failed'
     _OPERATION_STATUS_UPDATE_DELAY = 5
-
-    def __init__(self, subscription_key):
+    _OPERATION_STATUS_INITIAL_DELAY = 0.05
+    _OPERATION_STATUS_BACKOFF = 2
+    _OPERATION_TIMEOUT = 60
+    _OPERATION_ID_PATTERN = re.compile(r'^[0-9A-Fa-f-]{36}$')
+    _OPERATION_ID_SEPARATOR = ','
+    _MAX_OPERATION_IDS = 100
+    _CANCEL_CHECK_INTERVAL = 0.05
+    _RETRY_AFTER_HEADER = 'Retry-After'
+    _STATUS_TOO_MANY_REQUESTS = 429
+
+    def __init__(self, subscription_key, max_connections=10, connect_timeout=5.0, read_timeout=30.0,
+                 observer=None, base_uri=None, use_https=True, get_retries=2, retry_backoff=0.1,
+                 retry_backoff_max=2.0, hedge_after=None, circuit_breaker=None, identify_chunk_size=10,
+                 identify_workers=None):
         """Constructor of the IdentificationServiceHttpClientHelper class.
 
         Arguments:
         subscription_key -- the subscription key string
+        max_connections -- maximum number of concurrent keep-alive connections per host
+        connect_timeout -- seconds allowed to establish a connection
+        read_timeout -- seconds allowed to wait for response data
+        observer -- optional callable(host, phase, seconds) receiving request phase timings
+                    ('connect', 'send', 'ttfb', 'read') and the duration of each 'poll' iteration
+        base_uri -- host (and optional port) of the service, defaults to _BASE_URI
+        use_https -- False to talk plain HTTP, e.g. to a local stand-in of the service
+        get_retries -- extra attempts for GET requests that hit a connection error, a timeout, an
+                       HTTP 5xx or 429; POSTs and DELETEs are never retried
+        retry_backoff -- base of the exponential backoff between retries, in seconds; each wait is
+                         drawn uniformly between zero and the backoff (full jitter)
+        retry_backoff_max -- longest wait between retries, in seconds
+        hedge_after -- seconds after which get_profile and get_all_profiles send a second, identical
+                       request and use whichever answers first; None disables hedging
+        circuit_breaker -- CircuitBreaker shared by every request, defaults to a new one with its
+                           default thresholds
+        identify_chunk_size -- most profile IDs sent in one identification request; larger candidate
+                               sets are split into requests of this size sent concurrently
+        identify_workers -- threads sending the requests of split identifications, shared by all
+                            identifications; defaults to max_connections
         """
-        print(subscription_key)
         self._subscription_key = subscription_key
+        self._observer = observer
+        if base_uri:
+            self._BASE_URI = base_uri
+        self._use_https = use_https
+        self._connection_pool = HttpConnectionPool.HttpConnectionPool(
+            max_connections, connect_timeout, read_timeout, observer=observer, use_https=use_https)
+        self._profiles_changed_listeners = []
+        self._get_retries = get_retries
+        self._retry_backoff = retry_backoff
+        self._retry_backoff_max = retry_backoff_max
+        self._hedge_after = hedge_after
+        self._hedge_executor = ThreadPoolExecutor(max_connections) if hedge_after is not None else None
+        self._circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker.CircuitBreaker()
+        self._identify_chunk_size = identify_chunk_size
+        self._identify_executor = ThreadPoolExecutor(identify_workers or max_connections)
+
+    def get_circuit_breaker(self):
+        """Returns the circuit breaker guarding requests to the service."""
+        return self._circuit_breaker
+
+    def is_calibrated(self):
+        """Returns True: the service's confidences hold however many profiles are enrolled."""
+        return True
+
+    def add_profiles_changed_listener(self, listener):
+        """Registers a callback invoked with the profile ID whenever a profile is created, deleted,
+        reset or enrolled through this client.
+
+        Arguments:
+        listener -- callable taking the profile ID string
+        """
+        self._profiles_changed_listeners.append(listener)
 
-    def get_all_profiles(self):
-        """Return a list of all profiles on the server."""
+    def _notify_profiles_changed(self, profile_id):
+        for listener in self._profiles_changed_listeners:
+            listener(profile_id)
+
+    def get_all_profiles(self, enrollment_status=None):
+        """Return a list of all profiles on the server.
+
+        Arguments:
+        enrollment_status -- if given, only profiles with this enrollment status are returned
+        """
         try:
             # Send the request
-            res, message = self._send_request(
+            res, message = self._hedged(lambda: self._send_request(
                 'GET',
                 self._BASE_URI,
                 self._IDENTIFICATION_PROFILES_URI,
                 self._JSON_CONTENT_HEADER_VALUE
-            )
+            ))
 
             if res.status == self._STATUS_OK:
                 # Parse the response body
-                profiles_raw = json.loads(message)
-                return [IdentificationProfile.IdentificationProfile(profiles_raw[i])
-                        for i in range(0, len(profiles_raw))]
+                return IdentificationProfile.parse_profiles(message, enrollment_status)
             else:
-                reason = res.reason if not message else message
-                raise Exception('Error getting all profiles: ' + reason)
+                raise self._error('Error getting all profiles: ', res, message)
         except:
             logging.error('Error getting all profiles.')
             raise
@@ -108,19 +187,18 @@ class IdentificationServiceHttpClientHelper:
                 profile_id)
             
             # Send the request
-            res, message = self._send_request(
+            res, message = self._hedged(lambda: self._send_request(
                 'GET',
                 self._BASE_URI,
                 request_url,
-                self._JSON_CONTENT_HEADER_VALUE)
+                self._JSON_CONTENT_HEADER_VALUE))
         
             if res.status == self._STATUS_OK:
                 # Parse the response body
                 profile_raw = json.loads(message)
                 return IdentificationProfile.IdentificationProfile(profile_raw)
             else:
-                reason = res.reason if not message else message
-                raise Exception('Error getting profile: ' + reason)
+                raise self._error('Error getting profile: ', res, message)
         except:
             logging.error('Error getting profile.')
             raise
@@ -143,15 +221,13 @@ class IdentificationServiceHttpClientHelper:
                 self._JSON_CONTENT_HEADER_VALUE,
                 body)
 
-            print(res)
-            print(json.loads(message))
-
             if res.status == self._STATUS_OK:
                 # Parse the response body
-                return ProfileCreationResponse.ProfileCreationResponse(json.loads(message))
+                creation = ProfileCreationResponse.ProfileCreationResponse(json.loads(message))
+                self._notify_profiles_changed(creation.get_profile_id())
+                return creation
             else:
-                reason = res.reason if not message else message
-                raise Exception('Error creating profile: ' + reason)
+                raise self._error('Error creating profile: ', res, message)
         except:
             logging.error('Error creating profile.')
             raise
@@ -176,8 +252,8 @@ class IdentificationServiceHttpClientHelper:
                 self._JSON_CONTENT_HEADER_VALUE)
                 
             if res.status != self._STATUS_OK:
-                reason = res.reason if not message else message
-                raise Exception('Error deleting profile: ' + reason)
+                raise self._error('Error deleting profile: ', res, message)
+            self._notify_profiles_changed(profile_id)
         except:
             logging.error('Error deleting profile')
             raise
@@ -203,19 +279,19 @@ class IdentificationServiceHttpClientHelper:
                 self._JSON_CONTENT_HEADER_VALUE)
             
             if res.status != self._STATUS_OK:
-                reason = res.reason if not message else message
-                raise Exception('Error resetting profile: ' + reason)
+                raise self._error('Error resetting profile: ', res, message)
+            self._notify_profiles_changed(profile_id)
         except:
             logging.error('Error resetting profile')
             raise
                 
-    def enroll_profile(self, profile_id, file_path, force_short_audio = False):
+    def enroll_profile(self, profile_id, audio, force_short_audio = False):
         """Enrolls a profile using an audio file and returns a
         dictionary of the enrollment response.
 
         Arguments:
         profile_id -- the profile ID string of the user to enroll
-        file_path -- the file path string of the audio file to use
+        audio -- the audio to use: a file path string, bytes or a readable binary file-like object
         force_short_audio -- instruct the service to waive the recommended minimum audio limit
                              needed for enrollment
         """
@@ -228,7 +304,7 @@ class IdentificationServiceHttpClientHelper:
                 force_short_audio)
 
             # Prepare the body of the message
-            with open(file_path, 'rb') as body:
+            with self._audio_body(audio) as body:
                 # Send the request
                 res, message = self._send_request(
                     'POST',
@@ -239,106 +315,353 @@ class IdentificationServiceHttpClientHelper:
 
             if res.status == self._STATUS_OK:
                 # Parse the response body
-                return EnrollmentResponse.EnrollmentResponse(json.loads(message))
+                enrollment = EnrollmentResponse.EnrollmentResponse(json.loads(message))
             elif res.status == self._STATUS_ACCEPTED:
                 operation_url = res.getheader(self._OPERATION_LOCATION_HEADER)
 
-                return EnrollmentResponse.EnrollmentResponse(
+                enrollment = EnrollmentResponse.EnrollmentResponse(
                     self._poll_operation(operation_url))
             else:
-                reason = res.reason if not message else message
-                raise Exception('Error enrolling profile: ' + reason)
+                raise self._error('Error enrolling profile: ', res, message)
+
+            self._notify_profiles_changed(profile_id)
+            return enrollment
         except:
             logging.error('Error enrolling profile.')
             raise
 
-    def identify_file(self, file_path, test_profile_ids, force_short_audio = False):
-        """Enrolls a profile using an audio file and returns a
-        dictionary of the enrollment response.
+    def identify_file(self, audio, test_profile_ids, force_short_audio = False,
+                      timeout=None, cancel_event=None):
+        """Identifies the speaker of an audio file among the given profiles and returns
+        the identification response, waiting for the service to finish processing.
+
+        More profiles than identify_chunk_size are split into several identifications sent
+        concurrently; the first High-confidence match among them is returned without waiting for
+        the others, otherwise the most confident match once all have finished.
 
         Arguments:
-        file_path -- the file path of the audio file to test
+        audio -- the audio to test: a file path string, bytes or a readable binary file-like object
         test_profile_ids -- an array of test profile IDs strings
         force_short_audio -- instruct the service to waive the recommended minimum audio limit
                              needed for enrollment
+        timeout -- seconds to wait for processing to finish, defaults to _OPERATION_TIMEOUT
+        cancel_event -- optional threading.Event that abandons the wait when set
         """
+        chunks = self._chunk_profile_ids(test_profile_ids)
+        if len(chunks) <= 1:
+            operation_id, identification = self.submit_identification(
+                audio, test_profile_ids, force_short_audio)
+            if identification is not None:
+                return identification
+
+            try:
+                return IdentificationResponse.IdentificationResponse(
+                    self._poll_operation(self._operation_url(operation_id), timeout, cancel_event))
+            except:
+                logging.error('Error identifying file.')
+                raise
+
         try:
-            # Prepare the request
-            if len(test_profile_ids) < 1:
-                raise Exception('Error identifying file: no test profile IDs are provided.')
-            test_profile_ids_str = ','.join(test_profile_ids)
-            request_url = '{0}?identificationProfileIds={1}&{2}={3}'.format(
-                self._IDENTIFICATION_URI,
-                urllib.parse.quote(test_profile_ids_str),
-                self._SHORT_AUDIO_PARAMETER_NAME,
-                force_short_audio)
+            with self._audio_body(audio) as body:
+                data = self._read_body(body)
+            deadline = time.monotonic() + (self._OPERATION_TIMEOUT if timeout is None else timeout)
+            stop = threading.Event()
+            futures = [self._identify_executor.submit(
+                self._identify_chunk, data, chunk, force_short_audio, deadline, stop) for chunk in chunks]
+            return self._gather_identifications(futures, stop, cancel_event)
+        except:
+            logging.error('Error identifying file.')
+            raise
 
-            # Prepare the body of the message
-            with open(file_path, 'rb') as body:
-                # Send the request
-                res, message = self._send_request(
-                    'POST',
-                    self._BASE_URI,
-                    request_url,
-                    self._STREAM_CONTENT_HEADER_VALUE,
-                    body)
+    def submit_identification(self, audio, test_profile_ids, force_short_audio = False):
+        """Submits an audio file for identification without waiting for it to be processed.
 
-            if res.status == self._STATUS_OK:
-                # Parse the response body
-                return IdentificationResponse.IdentificationResponse(json.loads(message))
-            elif res.status == self._STATUS_ACCEPTED:
-                operation_url = res.getheader(self._OPERATION_LOCATION_HEADER)
+        Returns a tuple (operation ID, identification response). If the service answered right
+        away the response is set and the operation ID is None; otherwise the response is None and
+        the operation ID is passed to get_identification_result. More profiles than
+        identify_chunk_size are submitted as several identifications whose operation IDs are joined
+        into one.
 
-                return IdentificationResponse.IdentificationResponse(
-                    self._poll_operation(operation_url))
-            else:
-                reason = res.reason if not message else message
-                raise Exception('Error identifying file: ' + reason)
+        Arguments:
+        audio -- the audio to test: a file path string, bytes or a readable binary file-like object
+        test_profile_ids -- an array of test profile IDs strings
+        force_short_audio -- instruct the service to waive the recommended minimum audio limit
+                             needed for enrollment
+        """
+        try:
+            if len(test_profile_ids) < 1:
+                raise IdentificationServiceError('Error identifying file: no test profile IDs are provided.')
+            chunks = self._chunk_profile_ids(test_profile_ids)
+            if len(chunks) > self._MAX_OPERATION_IDS:
+                raise IdentificationServiceError(
+                    'Error identifying file: more than {0} profiles cannot be submitted without '
+                    'waiting.'.format(self._MAX_OPERATION_IDS * self._identify_chunk_size))
+
+            with self._audio_body(audio) as body:
+                if len(chunks) == 1:
+                    return self._submit_chunk(body, test_profile_ids, force_short_audio)
+                data = self._read_body(body)
+
+            submitted = list(self._identify_executor.map(
+                lambda chunk: self._submit_chunk(data, chunk, force_short_audio), chunks))
+            operation_ids = [operation_id for operation_id, _ in submitted if operation_id is not None]
+            identifications = [identification for _, identification in submitted if identification is not None]
+            best = IdentificationResponse.best_identification(identifications)
+            if not operation_ids or (best is not None and best.is_high_confidence_match()):
+                return None, best
+            if identifications:
+                # an operation ID cannot carry the answers already given, so wait for the rest
+                deadline = time.monotonic() + self._OPERATION_TIMEOUT
+                stop = threading.Event()
+                futures = [self._identify_executor.submit(self._wait_identification, operation_id, deadline, stop)
+                           for operation_id in operation_ids]
+                return None, self._gather_identifications(futures, stop, identifications=identifications)
+            return self._OPERATION_ID_SEPARATOR.join(operation_ids), None
         except:
             logging.error('Error identifying file.')
             raise
 
-    def _poll_operation(self, operation_url):
-        """Polls on an operation till it is done
+    def get_identification_result(self, operation_id):
+        """Checks an identification operation once, without waiting.
+
+        Returns the identification response if processing succeeded, or None if the operation is
+        still running. Raises if the operation failed. For an identification submitted in several
+        parts, a High-confidence match is returned as soon as any part has one; otherwise the
+        result waits for every part.
 
         Arguments:
-        operation_url -- the url to poll for the operation status
+        operation_id -- the operation ID returned by submit_identification
         """
+        operation_ids = operation_id.split(self._OPERATION_ID_SEPARATOR)
+        if len(operation_ids) > self._MAX_OPERATION_IDS or \
+                not all(self._OPERATION_ID_PATTERN.match(part) for part in operation_ids):
+            raise ValueError('Invalid operation ID: ' + operation_id)
         try:
-            # Parse the operation URL
-            parsed_url = urllib.parse.urlparse(operation_url)
+            if len(operation_ids) == 1:
+                result = self._check_operation(self._operation_url(operation_id))
+                if result is None:
+                    return None
+                return IdentificationResponse.IdentificationResponse(result)
+
+            futures = [self._identify_executor.submit(self._check_operation, self._operation_url(part))
+                       for part in operation_ids]
+            identifications = []
+            running = False
+            error = None
+            for future in futures:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if result is None:
+                    running = True
+                    continue
+                identification = IdentificationResponse.IdentificationResponse(result)
+                if identification.is_high_confidence_match():
+                    return identification
+                identifications.append(identification)
+            if error is not None:
+                raise error
+            if running:
+                return None
+            return IdentificationResponse.best_identification(identifications)
+        except:
+            logging.error('Error getting the identification result.')
+            raise
 
-            while True:
-                # Send the request
-                res, message = self._send_request(
-                    'GET',
-                    parsed_url.netloc,
-                    parsed_url.path,
-                    self._JSON_CONTENT_HEADER_VALUE)
+    def _chunk_profile_ids(self, test_profile_ids):
+        size = self._identify_chunk_size
+        return [test_profile_ids[i:i + size] for i in range(0, len(test_profile_ids), size)]
 
-                if res.status != self._STATUS_OK:
-                    reason = res.reason if not message else message
-                    raise Exception('Operation Error: ' + reason)
+    def _submit_chunk(self, body, test_profile_ids, force_short_audio):
+        """Sends one identification request and returns a tuple (operation ID, identification
+        response) as submit_identification does
 
-                # Parse the response body
-                operation_response = json.loads(message)
-
-                if operation_response[self._OPERATION_STATUS_FIELD_NAME] == \
-                        self._OPERATION_STATUS_SUCCEEDED:
-                    return operation_response[self._OPERATION_PROC_RES_FIELD_NAME]
-                elif operation_response[self._OPERATION_STATUS_FIELD_NAME] == \
-                        self._OPERATION_STATUS_FAILED:
-                    raise Exception('Operation Error: ' +
-                                    operation_response[self._OPERATION_MESSAGE_FIELD_NAME])
+        Arguments:
+        body -- the request body: bytes or a readable binary file-like object
+        test_profile_ids -- an array of at most identify_chunk_size test profile IDs strings
+        force_short_audio -- instruct the service to waive the recommended minimum audio limit
+        """
+        # Prepare the request
+        test_profile_ids_str = ','.join(test_profile_ids)
+        request_url = '{0}?identificationProfileIds={1}&{2}={3}'.format(
+            self._IDENTIFICATION_URI,
+            urllib.parse.quote(test_profile_ids_str),
+            self._SHORT_AUDIO_PARAMETER_NAME,
+            force_short_audio)
+
+        # Send the request
+        res, message = self._send_request(
+            'POST',
+            self._BASE_URI,
+            request_url,
+            self._STREAM_CONTENT_HEADER_VALUE,
+            body)
+
+        if res.status == self._STATUS_OK:
+            # Parse the response body
+            return None, IdentificationResponse.IdentificationResponse(json.loads(message))
+        elif res.status == self._STATUS_ACCEPTED:
+            operation_url = res.getheader(self._OPERATION_LOCATION_HEADER)
+            return urllib.parse.urlparse(operation_url).path.rsplit('/', 1)[-1], None
+        else:
+            raise self._error('Error identifying file: ', res, message)
+
+    def _identify_chunk(self, body, test_profile_ids, force_short_audio, deadline, stop):
+        """Identifies among one chunk of the profiles, runs on the identify executor. Returns None
+        without sending anything if stop was set while the chunk was queued."""
+        if stop.is_set():
+            return None
+        operation_id, identification = self._submit_chunk(body, test_profile_ids, force_short_audio)
+        if identification is not None:
+            return identification
+        return self._wait_identification(operation_id, deadline, stop)
+
+    def _wait_identification(self, operation_id, deadline, stop):
+        return IdentificationResponse.IdentificationResponse(self._poll_operation(
+            self._operation_url(operation_id), max(0.0, deadline - time.monotonic()), stop))
+
+    def _gather_identifications(self, futures, stop, cancel_event=None, identifications=()):
+        """Waits on the futures of the parts of one identification and returns the first
+        High-confidence match, or once all are done the most confident one. Raises the first
+        error of a part unless another part found a High-confidence match. The remaining parts
+        are stopped on return.
+
+        Arguments:
+        futures -- futures of _identify_chunk or _wait_identification calls
+        stop -- the threading.Event the parts poll with
+        cancel_event -- optional threading.Event that abandons the wait when set
+        identifications -- responses of parts that were answered without an operation
+        """
+        identifications = list(identifications)
+        error = None
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, self._CANCEL_CHECK_INTERVAL if cancel_event is not None else None,
+                                     FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set():
+                    raise IdentificationServiceError('Operation Error: cancelled waiting for the identification')
+                for future in done:
+                    try:
+                        identification = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if identification is None:
+                        continue
+                    if identification.is_high_confidence_match():
+                        return identification
+                    identifications.append(identification)
+        finally:
+            stop.set()
+            for future in pending:
+                future.cancel()
+        if error is not None:
+            raise error
+        return IdentificationResponse.best_identification(identifications)
+
+    @staticmethod
+    def _read_body(body):
+        """Returns the bytes of a request body, reading it if it is a file-like object, so that it
+        can be sent more than once"""
+        return body if isinstance(body, (bytes, bytearray)) else body.read()
+
+    @staticmethod
+    @contextmanager
+    def _audio_body(audio):
+        """Yields a request body for audio given as a file path, bytes or a file-like object
+
+        Arguments:
+        audio -- a file path string, bytes or a readable binary file-like object
+        """
+        if isinstance(audio, str):
+            with open(audio, 'rb') as body:
+                yield body
+        else:
+            yield audio
+
+    def _operation_url(self, operation_id):
+        return '{0}://{1}{2}/{3}'.format('https' if self._use_https else 'http',
+                                         self._BASE_URI, self._OPERATIONS_URI, operation_id)
+
+    def _poll_operation(self, operation_url, timeout=None, cancel_event=None):
+        """Polls on an operation till it is done, backing off from a few milliseconds up to
+        _OPERATION_STATUS_UPDATE_DELAY between checks
+
+        Arguments:
+        operation_url -- the url to poll for the operation status
+        timeout -- seconds to wait in total, defaults to _OPERATION_TIMEOUT
+        cancel_event -- optional threading.Event that abandons the wait when set
+        """
+        try:
+            deadline = time.monotonic() + (self._OPERATION_TIMEOUT if timeout is None else timeout)
+            delay = self._OPERATION_STATUS_INITIAL_DELAY
+
+            while True:
+                started = time.perf_counter()
+                result = self._check_operation(operation_url)
+                if self._observer is not None:
+                    self._observer(urllib.parse.urlparse(operation_url).netloc, 'poll',
+                                   time.perf_counter() - started)
+                if result is not None:
+                    return result
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ServiceTimeoutError('Operation Error: timed out waiting for ' + operation_url)
+                delay = min(delay, remaining)
+                if cancel_event is not None:
+                    if cancel_event.wait(delay):
+                        raise IdentificationServiceError('Operation Error: cancelled waiting for ' + operation_url)
                 else:
-                    time.sleep(self._OPERATION_STATUS_UPDATE_DELAY)
+                    time.sleep(delay)
+                delay = min(delay * self._OPERATION_STATUS_BACKOFF, self._OPERATION_STATUS_UPDATE_DELAY)
         except:
-            logging.error('Error polling the operation status.')
+            if cancel_event is None or not cancel_event.is_set():
+                logging.error('Error polling the operation status.')
             raise
 
+    def _check_operation(self, operation_url):
+        """Checks the status of an operation once and returns its processing result,
+        or None if it is still running
+
+        Arguments:
+        operation_url -- the url of the operation status
+        """
+        # Parse the operation URL
+        parsed_url = urllib.parse.urlparse(operation_url)
+
+        # Send the request
+        res, message = self._send_request(
+            'GET',
+            parsed_url.netloc,
+            parsed_url.path,
+            self._JSON_CONTENT_HEADER_VALUE)
+
+        if res.status != self._STATUS_OK:
+            raise self._error('Operation Error: ', res, message)
+
+        # Parse the response body
+        operation_response = json.loads(message)
+
+        if operation_response[self._OPERATION_STATUS_FIELD_NAME] == \
+                self._OPERATION_STATUS_SUCCEEDED:
+            return operation_response[self._OPERATION_PROC_RES_FIELD_NAME]
+        elif operation_response[self._OPERATION_STATUS_FIELD_NAME] == \
+                self._OPERATION_STATUS_FAILED:
+            raise OperationFailedError('Operation Error: ' +
+                                       operation_response[self._OPERATION_MESSAGE_FIELD_NAME])
+        return None
+
     def _send_request(self, method, base_url, request_url, content_type_value, body=None):
         """Sends the request to the server then returns the response and the response body string.
 
+        GET requests that fail in a way worth retrying are sent again, up to get_retries times,
+        after a jittered exponential backoff. Other unsuccessful statuses are returned for the
+        caller to turn into an exception.
+
         Arguments:
         method -- specifies whether the request is a GET or POST request
         base_url -- the base url for the connection
@@ -346,19 +669,103 @@ class IdentificationServiceHttpClientHelper:
         content_type_value -- the value of the content type field in the headers
         body -- the body of the request (needed only in POST methods)
         """
+        # Set the headers
+        headers = {self._CONTENT_TYPE_HEADER: content_type_value,
+                   self._SUBSCRIPTION_KEY_HEADER: self._subscription_key}
+        retries = self._get_retries if method == 'GET' else 0
+
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                res, message = self._send_once(method, base_url, request_url, body, headers)
+            except CircuitOpenError:
+                logging.error('Not sending the request: the circuit breaker is open.')
+                raise
+            except ServiceUnavailableError:
+                if attempt >= retries:
+                    logging.error('Error sending the request.')
+                    raise
+            else:
+                if attempt >= retries or not self._is_retryable(res.status):
+                    return res, message
+                if res.status == self._STATUS_TOO_MANY_REQUESTS:
+                    retry_after = res.getheader(self._RETRY_AFTER_HEADER)
+
+            time.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    def _send_once(self, method, base_url, request_url, body, headers):
+        """Sends one request through the circuit breaker, turning transport errors into
+        ServiceUnavailableError or ServiceTimeoutError."""
+        self._circuit_breaker.before_call()
+        failed = True
+        start = time.perf_counter()
+        try:
+            # Send the request over a pooled keep-alive connection
+            res, data = self._connection_pool.request(base_url, method, request_url, body, headers)
+            failed = self._is_retryable(res.status)
+            return res, data.decode('utf-8')
+        except (socket.timeout, TimeoutError) as e:
+            raise ServiceTimeoutError('Timed out talking to {0}: {1}'.format(base_url, e)) from e
+        except (OSError, http.client.HTTPException) as e:
+            raise ServiceUnavailableError('Error talking to {0}: {1}'.format(base_url, e)) from e
+        finally:
+            self._circuit_breaker.after_call(failed, time.perf_counter() - start)
+
+    def _is_retryable(self, status):
+        return status >= 500 or status == self._STATUS_TOO_MANY_REQUESTS
+
+    def _backoff(self, attempt, retry_after=None):
+        """Returns the seconds to wait before a retry: full jitter over an exponential backoff,
+        but at least what the service asked for in Retry-After, within retry_backoff_max"""
+        delay = random.uniform(0, min(self._retry_backoff_max, self._retry_backoff * 2 ** attempt))
         try:
-            # Set the headers
-            headers = {self._CONTENT_TYPE_HEADER: content_type_value,
-                       self._SUBSCRIPTION_KEY_HEADER: self._subscription_key}
+            if retry_after is not None:
+                delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+        return min(delay, self._retry_backoff_max)
 
-            # Start the connection
-            with closing(http.client.HTTPSConnection(base_url)) as conn:
-                # Send the request
-                conn.request(method, request_url, body, headers)
-                res = conn.getresponse()
-                message = res.read().decode('utf-8')
+    def _hedged(self, send):
+        """Runs send, and if it has not returned after hedge_after seconds runs it a second time
+        in parallel, returning whichever result comes first. The slower request is left to finish
+        in the background.
 
-                return res, message
-        except:
-            logging.error('Error sending the request.')
-            raise
+        Arguments:
+        send -- callable making an idempotent request
+        """
+        if self._hedge_executor is None:
+            return send()
+        first = self._hedge_executor.submit(send)
+        try:
+            return first.result(timeout=self._hedge_after)
+        except FutureTimeout:
+            pass
+        second = self._hedge_executor.submit(send)
+
+        error = None
+        for future in as_completed((first, second)):
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        raise error
+
+    def _error(self, message, res, body):
+        """Returns the exception for an unsuccessful response
+
+        Arguments:
+        message -- the error message prefix
+        res -- the HTTP response
+        body -- the response body string
+        """
+        reason = res.reason if not body else body
+        return error_for_status(res.status, message + reason, res.getheader(self._RETRY_AFTER_HEADER))
+
+    def close(self):
+        """Closes the idle connections held by this client."""
+        self._identify_executor.shutdown(wait=False)
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self._connection_pool.close()
@@ -0,0 +1,487 @@
+"""In-process stand-in for the Identification service: MFCC speaker embeddings computed with NumPy and
+kept on local disk, exposing the same methods and response classes as
+IdentificationServiceHttpClientHelper."""
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from speech_identification import EnrollmentResponse
+from speech_identification import IdentificationProfile
+from speech_identification import IdentificationResponse
+from speech_identification import ProfileCreationResponse
+from speech_identification.IdentificationServiceError import IdentificationServiceError, \
+    ProfileNotFoundError, RequestRejectedError, ServiceTimeoutError
+
+_FRAME_SECONDS = 0.025
+_HOP_SECONDS = 0.010
+_PRE_EMPHASIS = 0.97
+_MEL_FILTERS = 26
+_CEPSTRA = 20
+_VOICED_RANGE_DB = 30.0
+
+
+@lru_cache(maxsize=8)
+def _filters(rate, nfft):
+    """Returns the mel filterbank (filters x bins) and the DCT-II matrix (cepstra x filters) for a rate."""
+    def to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    mel_points = np.linspace(to_mel(0.0), to_mel(rate / 2.0), _MEL_FILTERS + 2)
+    bins = np.floor((nfft + 1) * 700.0 * (10.0 ** (mel_points / 2595.0) - 1.0) / rate).astype(int)
+    fbank = np.zeros((_MEL_FILTERS, nfft // 2 + 1))
+    for i in range(_MEL_FILTERS):
+        left, centre, right = bins[i], bins[i + 1], bins[i + 2]
+        if centre > left:
+            fbank[i, left:centre] = (np.arange(left, centre) - left) / float(centre - left)
+        if right > centre:
+            fbank[i, centre:right] = (right - np.arange(centre, right)) / float(right - centre)
+
+    n = np.arange(_MEL_FILTERS)
+    dct = np.cos(np.pi / _MEL_FILTERS * (n + 0.5) * np.arange(_CEPSTRA)[:, None]) * np.sqrt(2.0 / _MEL_FILTERS)
+    return fbank, dct
+
+
+def _read_samples(audio):
+    """Returns the mono samples, scaled to [-1, 1), and the sample rate of 16-bit PCM WAV bytes."""
+    try:
+        with wave.open(io.BytesIO(audio), 'rb') as wav:
+            rate, channels, width = wav.getframerate(), wav.getnchannels(), wav.getsampwidth()
+            data = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise RequestRejectedError('Invalid audio: ' + str(e))
+    if width != 2:
+        raise RequestRejectedError('Invalid audio: expected 16-bit PCM')
+    samples = np.frombuffer(data, dtype='<i2').astype(np.float64) / 32768.0
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def extract_statistics(audio, min_speech_seconds):
+    """Computes the MFCC and delta-MFCC features of the voiced frames of a clip and returns their
+    sufficient statistics (frame count, sum, sum of squares) plus the seconds of speech found.
+
+    A module-level function so it can run in a worker process.
+
+    Arguments:
+    audio -- 16-bit PCM WAV bytes
+    min_speech_seconds -- least speech accepted, below which RequestRejectedError is raised
+    """
+    samples, rate = _read_samples(audio)
+    frame_length = int(round(_FRAME_SECONDS * rate))
+    hop = int(round(_HOP_SECONDS * rate))
+    nfft = 1 << (frame_length - 1).bit_length()
+    if len(samples) < frame_length:
+        raise RequestRejectedError('Audio too short')
+
+    emphasized = np.append(samples[0], samples[1:] - _PRE_EMPHASIS * samples[:-1])
+    frame_count = 1 + (len(emphasized) - frame_length) // hop
+    frames = np.lib.stride_tricks.as_strided(
+        emphasized, shape=(frame_count, frame_length),
+        strides=(hop * emphasized.strides[0], emphasized.strides[0])) * np.hamming(frame_length)
+    power = np.abs(np.fft.rfft(frames, nfft)) ** 2 / nfft
+
+    # energy-based voice activity detection: keep frames within _VOICED_RANGE_DB of the loud ones
+    energy_db = 10.0 * np.log10(power.sum(axis=1) + 1e-12)
+    voiced = energy_db > np.percentile(energy_db, 95) - _VOICED_RANGE_DB
+    speech_seconds = voiced.sum() * hop / float(rate)
+    if voiced.sum() < 3 or speech_seconds < min_speech_seconds:
+        raise RequestRejectedError('Audio too short: {0:.1f}s of speech found'.format(speech_seconds))
+
+    fbank, dct = _filters(rate, nfft)
+    cepstra = np.log(power[voiced] @ fbank.T + 1e-10) @ dct.T
+    # c0 only tracks loudness
+    cepstra = cepstra[:, 1:]
+    features = np.hstack((cepstra, np.gradient(cepstra, axis=0)))
+    return features.shape[0], features.sum(axis=0), (features ** 2).sum(axis=0), float(speech_seconds)
+
+
+def _embedding(count, total, total_sq):
+    mean = total / count
+    std = np.sqrt(np.maximum(total_sq / count - mean ** 2, 0.0))
+    return np.concatenate((mean, std))
+
+
+class IdentificationServiceLocalClient:
+    """Speaker identification done in this process, for low latency and no network dependency.
+
+    Each profile is one compressed .npz file holding the running feature statistics of its
+    enrollment audio and its metadata; enrolling more audio just adds to the statistics. A speaker's
+    embedding is the mean and standard deviation of those features, and a clip is identified by
+    cosine similarity to the candidates' embeddings after subtracting the mean embedding of every
+    enrolled profile, which removes what all voices (and microphones) have in common. Scores are only
+    calibrated once at least three profiles are enrolled; until then no clip is identified. A match
+    must also lead every other enrolled profile, not only the other candidates, by min_margin, so a
+    single candidate is still compared against the other voices. Feature extraction runs in a
+    process pool.
+
+    Profiles changed by other processes sharing the directory are picked up on their next use.
+    """
+
+    _NO_MATCH = '00000000-0000-0000-0000-000000000000'
+
+    def __init__(self, model_dir, processes=None, enrollment_speech_time=20.0, min_speech_time=1.0,
+                 short_min_speech_time=0.5, high_score=0.8, normal_score=0.6, min_score=0.4, min_margin=0.05,
+                 cohort_ttl=60.0):
+        """Constructor of the IdentificationServiceLocalClient class.
+
+        Arguments:
+        model_dir -- directory the profile files are kept in, created if missing
+        processes -- worker processes for feature extraction, None for one per CPU and 0 to
+                     extract in the calling thread (e.g. on AWS Lambda, which lacks the shared
+                     memory process pools need)
+        enrollment_speech_time -- seconds of speech after which a profile is Enrolled
+        min_speech_time -- least speech a clip must contain
+        short_min_speech_time -- least speech a clip must contain with force_short_audio
+        high_score -- similarity from which a match has High confidence
+        normal_score -- similarity from which a match has Normal confidence
+        min_score -- similarity below which no profile is identified
+        min_margin -- lead over the runner-up among the enrolled profiles below which a match has at
+                      most Low confidence
+        cohort_ttl -- seconds the mean embedding of the enrolled profiles is reused before recomputing
+        """
+        self._model_dir = model_dir
+        os.makedirs(model_dir, exist_ok=True)
+        self._processes = processes
+        self._executor = None
+        self._enrollment_speech_time = enrollment_speech_time
+        self._min_speech_time = min_speech_time
+        self._short_min_speech_time = short_min_speech_time
+        self._high_score = high_score
+        self._normal_score = normal_score
+        self._min_score = min_score
+        self._min_margin = min_margin
+        self._lock = threading.Lock()
+        self._embeddings = {}
+        self._cohort_ttl = cohort_ttl
+        self._cohort = None
+        self._cohort_embeddings = {}
+        self._cohort_time = None
+        self._profiles_changed_listeners = []
+
+    def add_profiles_changed_listener(self, listener):
+        """Registers a callback invoked with the profile ID whenever a profile is created, deleted,
+        reset or enrolled through this client.
+
+        Arguments:
+        listener -- callable taking the profile ID string
+        """
+        self._profiles_changed_listeners.append(listener)
+
+    def _notify_profiles_changed(self, profile_id):
+        self._cohort_time = None
+        for listener in self._profiles_changed_listeners:
+            listener(profile_id)
+
+    def get_circuit_breaker(self):
+        """Returns None: there is no remote service to guard."""
+        return None
+
+    def is_calibrated(self):
+        """Returns whether confidences are meaningful, i.e. at least three profiles are enrolled.
+        Until then every identification answers no match."""
+        return self._cohort_mean() is not None
+
+    def get_all_profiles(self, enrollment_status=None):
+        """Return a list of all profiles.
+
+        Arguments:
+        enrollment_status -- if given, only profiles with this enrollment status are returned
+        """
+        profiles = []
+        for name in sorted(os.listdir(self._model_dir)):
+            if name.endswith('.npz'):
+                try:
+                    raw = self._describe(self._load(name[:-len('.npz')]))
+                except ProfileNotFoundError:
+                    # deleted meanwhile
+                    continue
+                if enrollment_status is None or raw['enrollmentStatus'] == enrollment_status:
+                    profiles.append(IdentificationProfile.IdentificationProfile(raw))
+        return profiles
+
+    def get_profile(self, profile_id):
+        """Get a speaker's profile with given profile ID
+
+        Arguments:
+        profile_id -- the profile ID of the profile
+        """
+        return IdentificationProfile.IdentificationProfile(self._describe(self._load(profile_id)))
+
+    def create_profile(self, locale):
+        """Creates a profile and returns the creation response.
+
+        Arguments:
+        locale -- the locale string for the profile
+        """
+        profile_id = str(uuid.uuid4())
+        now = self._now()
+        size = 2 * (_CEPSTRA - 1)
+        self._save(profile_id, {'locale': locale, 'created': now, 'last_action': now, 'count': 0,
+                                'total': np.zeros(size), 'total_sq': np.zeros(size), 'speech_time': 0.0})
+        self._notify_profiles_changed(profile_id)
+        return ProfileCreationResponse.ProfileCreationResponse({'identificationProfileId': profile_id})
+
+    def delete_profile(self, profile_id):
+        """Deletes a profile
+
+        Arguments:
+        profile_id -- the profile ID string of user to delete
+        """
+        try:
+            os.remove(self._path(profile_id))
+        except FileNotFoundError:
+            raise ProfileNotFoundError('Error deleting profile: profile not found', 404)
+        with self._lock:
+            self._embeddings.pop(profile_id, None)
+        self._notify_profiles_changed(profile_id)
+
+    def reset_enrollments(self, profile_id):
+        """Reset enrollments of a given profile
+
+        Arguments:
+        profile_id -- the profile ID of the profile to reset
+        """
+        with self._lock:
+            model = self._load(profile_id)
+            model.update(count=0, total=np.zeros_like(model['total']), total_sq=np.zeros_like(model['total_sq']),
+                         speech_time=0.0, last_action=self._now())
+            self._save(profile_id, model)
+        self._notify_profiles_changed(profile_id)
+
+    def enroll_profile(self, profile_id, audio, force_short_audio=False):
+        """Enrolls a profile using an audio clip and returns the enrollment response.
+
+        Arguments:
+        profile_id -- the profile ID string of the user to enroll
+        audio -- the audio to use: a file path string, bytes or a readable binary file-like object
+        force_short_audio -- accept clips with less speech than usually required
+        """
+        self._load(profile_id)
+        count, total, total_sq, speech_time = self._extract(audio, force_short_audio, None)
+        with self._lock:
+            model = self._load(profile_id)
+            model.update(count=model['count'] + count, total=model['total'] + total,
+                         total_sq=model['total_sq'] + total_sq, speech_time=model['speech_time'] + speech_time,
+                         last_action=self._now())
+            self._save(profile_id, model)
+        self._notify_profiles_changed(profile_id)
+
+        description = self._describe(model)
+        description['speechTime'] = speech_time
+        return EnrollmentResponse.EnrollmentResponse(description)
+
+    def identify_file(self, audio, test_profile_ids, force_short_audio=False, timeout=None, cancel_event=None):
+        """Identifies the speaker of an audio clip among the given profiles and returns the
+        identification response.
+
+        Arguments:
+        audio -- the audio to test: a file path string, bytes or a readable binary file-like object
+        test_profile_ids -- an array of test profile IDs strings
+        force_short_audio -- accept clips with less speech than usually required
+        timeout -- seconds to wait for feature extraction, None to wait as long as it takes
+        cancel_event -- accepted for compatibility; identification is too quick to need cancelling
+        """
+        if len(test_profile_ids) < 1:
+            raise IdentificationServiceError('Error identifying file: no test profile IDs are provided.')
+        candidates = []
+        for profile_id in test_profile_ids:
+            embedding = self._enrolled_embedding(profile_id)
+            if embedding is not None:
+                candidates.append((profile_id, embedding))
+        if not candidates:
+            raise RequestRejectedError('Error identifying file: none of the test profiles is enrolled.', 400)
+
+        count, total, total_sq, _ = self._extract(audio, force_short_audio, timeout)
+        profile_id, confidence = self._score(_embedding(count, total, total_sq), candidates)
+        return IdentificationResponse.IdentificationResponse(
+            {'identifiedProfileId': profile_id, 'confidence': confidence})
+
+    def submit_identification(self, audio, test_profile_ids, force_short_audio=False):
+        """Identifies a clip right away; returns (None, identification response) like the remote
+        client does when the service answers without an operation.
+
+        Arguments:
+        audio -- the audio to test: a file path string, bytes or a readable binary file-like object
+        test_profile_ids -- an array of test profile IDs strings
+        force_short_audio -- accept clips with less speech than usually required
+        """
+        return None, self.identify_file(audio, test_profile_ids, force_short_audio)
+
+    def get_identification_result(self, operation_id):
+        """Raises ValueError: identifications finish in submit_identification, so there are no operations.
+
+        Arguments:
+        operation_id -- an operation ID
+        """
+        raise ValueError('Unknown operation ID: ' + operation_id)
+
+    def close(self):
+        """Stops the feature extraction processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _extract(self, audio, force_short_audio, timeout):
+        if isinstance(audio, str):
+            with open(audio, 'rb') as f:
+                audio = f.read()
+        elif not isinstance(audio, (bytes, bytearray)):
+            audio = audio.read()
+        min_speech = self._short_min_speech_time if force_short_audio else self._min_speech_time
+
+        executor = self._get_executor()
+        if executor is None:
+            return extract_statistics(audio, min_speech)
+        future = executor.submit(extract_statistics, bytes(audio), min_speech)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise ServiceTimeoutError('Timed out extracting speaker features')
+
+    def _get_executor(self):
+        if self._processes == 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # created inside a request, when server, pool and writer threads may hold locks that a
+                # forked child would inherit locked, so workers start from a clean interpreter instead
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._executor = ProcessPoolExecutor(self._processes, mp_context=context)
+            return self._executor
+
+    def _score(self, embedding, candidates):
+        """Returns the best matching profile ID and the confidence of the match."""
+        centre = self._cohort_mean()
+        if centre is None:
+            # raw similarities of so few voices say nothing about who is speaking
+            return self._NO_MATCH, 'Low'
+
+        ids = [profile_id for profile_id, _ in candidates]
+        scores = self._similarities(embedding, [candidate for _, candidate in candidates], centre)
+        best_index = int(np.argmax(scores))
+        best = scores[best_index]
+
+        rivals = dict(self._cohort_embeddings)
+        rivals.update(candidates)
+        rivals.pop(ids[best_index], None)
+        runner_up = max(self._similarities(embedding, list(rivals.values()), centre)) if rivals else -1.0
+
+        if best < self._min_score:
+            return self._NO_MATCH, 'Low'
+        if best - runner_up < self._min_margin:
+            return ids[best_index], 'Low'
+        if best >= self._high_score:
+            return ids[best_index], 'High'
+        return ids[best_index], 'Normal' if best >= self._normal_score else 'Low'
+
+    @staticmethod
+    def _similarities(embedding, others, centre):
+        """Returns the cosine similarities of an embedding to others, all taken relative to centre."""
+        matrix = np.vstack(others) - centre
+        embedding = embedding - centre
+        return matrix @ embedding / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(embedding) + 1e-12)
+
+    def _cohort_mean(self):
+        """Returns the mean embedding of all enrolled profiles, or None if fewer than three are.
+        The embeddings themselves are kept in _cohort_embeddings."""
+        now = time.monotonic()
+        if self._cohort_time is not None and now - self._cohort_time < self._cohort_ttl:
+            return self._cohort
+        embeddings = {}
+        for name in os.listdir(self._model_dir):
+            if name.endswith('.npz'):
+                profile_id = name[:-len('.npz')]
+                embedding = self._enrolled_embedding(profile_id)
+                if embedding is not None:
+                    embeddings[profile_id] = embedding
+        self._cohort_embeddings = embeddings
+        self._cohort = np.mean(list(embeddings.values()), axis=0) if len(embeddings) >= 3 else None
+        self._cohort_time = now
+        return self._cohort
+
+    def _enrolled_embedding(self, profile_id):
+        """Returns the embedding of an enrolled profile, or None if it is missing or still enrolling."""
+        try:
+            mtime = os.stat(self._path(profile_id)).st_mtime_ns
+        except (FileNotFoundError, ProfileNotFoundError):
+            return None
+        cached = self._embeddings.get(profile_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        try:
+            model = self._load(profile_id)
+        except ProfileNotFoundError:
+            return None
+        if model['count'] == 0 or model['speech_time'] < self._enrollment_speech_time:
+            return None
+        embedding = _embedding(model['count'], model['total'], model['total_sq'])
+        with self._lock:
+            self._embeddings[profile_id] = (mtime, embedding)
+        return embedding
+
+    def _describe(self, model):
+        """Returns the profile fields of a model in the service's response format."""
+        speech_time = model['speech_time']
+        return {
+            'identificationProfileId': model['profile_id'],
+            'locale': model['locale'],
+            'enrollmentSpeechTime': speech_time,
+            'remainingEnrollmentSpeechTime': max(0.0, self._enrollment_speech_time - speech_time),
+            'createdDateTime': model['created'],
+            'lastActionDateTime': model['last_action'],
+            'enrollmentStatus': 'Enrolled' if speech_time >= self._enrollment_speech_time else 'Enrolling',
+        }
+
+    def _path(self, profile_id):
+        try:
+            # also keeps anything but a profile ID out of the file name
+            profile_id = str(uuid.UUID(profile_id))
+        except (TypeError, ValueError):
+            raise ProfileNotFoundError('Invalid profile ID: {0}'.format(profile_id), 404)
+        return os.path.join(self._model_dir, profile_id + '.npz')
+
+    def _load(self, profile_id):
+        try:
+            with np.load(self._path(profile_id)) as data:
+                return {
+                    'profile_id': profile_id,
+                    'locale': str(data['locale']),
+                    'created': str(data['created']),
+                    'last_action': str(data['last_action']),
+                    'count': int(data['count']),
+                    'total': data['total'],
+                    'total_sq': data['total_sq'],
+                    'speech_time': float(data['speech_time']),
+                }
+        except FileNotFoundError:
+            raise ProfileNotFoundError('Profile not found: {0}'.format(profile_id), 404)
+
+    def _save(self, profile_id, model):
+        path = self._path(profile_id)
+        temporary = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+        with open(temporary, 'wb') as f:
+            np.savez_compressed(f, locale=model['locale'], created=model['created'],
+                                last_action=model['last_action'], count=model['count'],
+                                total=model['total'], total_sq=model['total_sq'],
+                                speech_time=model['speech_time'])
+        # readers in other processes see either the old or the new file, never a partial one
+        os.replace(temporary, path)
+
+    @staticmethod
+    def _now():
+        return datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
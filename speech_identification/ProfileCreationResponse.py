@@ -35,6 +35,8 @@ class ProfileCreationResponse:
 
     _PROFILE_ID = 'identificationProfileId'
 
+    __slots__ = ('_profile_id',)
+
     def __init__(self, response):
         """Constructor of the ProfileCreationResponse class.
 
@@ -0,0 +1,24 @@
+/*
+ * 0001_create_auth_tables.sql
+ *
+ * Baseline schema, identical to generate_auth_tables.sql. Guarded so that databases created
+ * before migrations existed can adopt them without changes.
+ *
+ */
+
+
+CREATE TABLE IF NOT EXISTS data_users (
+  first_name TEXT,
+  preferred_first_name TEXT NULL,
+  last_name TEXT,
+  created_date DATE,
+  email TEXT,
+  pwd_hash BYTEA,
+  speech_profile_hash BYTEA
+);
+
+CREATE TABLE IF NOT EXISTS data_tickets (
+  ticket_val_hash BYTEA,
+  issued TIMESTAMP,
+  expiry TIMESTAMP
+);
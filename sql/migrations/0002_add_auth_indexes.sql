@@ -0,0 +1,15 @@
+/*
+ * 0002_add_auth_indexes.sql
+ *
+ * Index the columns check_login_text and check_ticket filter on so that neither is a sequential
+ * scan. Ticket hashes are unique by construction (SHA-256 of 1024 random bits).
+ *
+ */
+
+
+CREATE UNIQUE INDEX IF NOT EXISTS data_users_email_key ON data_users (email);
+
+ALTER TABLE data_tickets ALTER COLUMN ticket_val_hash SET NOT NULL;
+ALTER TABLE data_tickets ADD CONSTRAINT data_tickets_pkey PRIMARY KEY (ticket_val_hash);
+
+CREATE INDEX IF NOT EXISTS data_tickets_expiry_idx ON data_tickets (expiry);
@@ -0,0 +1,13 @@
+/*
+ * 0003_add_speech_profile_index.sql
+ *
+ * Speech logins that name the user look up their enrolled profile by e-mail (data_users_email_key)
+ * and verify the clip against it alone, so a profile must belong to exactly one user: otherwise a
+ * clip of one user would log in as another. The partial index enforces that and also serves the
+ * enrolled profile listing, which filters on the same predicate.
+ *
+ */
+
+
+CREATE UNIQUE INDEX IF NOT EXISTS data_users_speech_profile_key ON data_users (speech_profile_hash)
+  WHERE length(speech_profile_hash) = 16;
@@ -0,0 +1,22 @@
+/*
+ * 0004_create_refresh_tokens.sql
+ *
+ * One row per login session renewed through /auth/refresh. A refresh token carries its session's
+ * family_id, so exchanging one is a single UPDATE by primary key that swaps in the hash of the next
+ * token, and a stale token of a live session is recognised as reuse without keeping old tokens.
+ *
+ * expiry changes on every refresh and is deliberately not indexed, and pages keep free space, so
+ * refreshes are HOT updates that write no index entries; the reaper scans for expired sessions.
+ *
+ */
+
+
+CREATE TABLE IF NOT EXISTS data_refresh_tokens (
+  family_id BYTEA PRIMARY KEY,
+  user_id TEXT NOT NULL,
+  token_hash BYTEA NOT NULL,
+  previous_hash BYTEA,
+  created TIMESTAMP NOT NULL,
+  rotated TIMESTAMP,
+  expiry TIMESTAMP NOT NULL
+) WITH (fillfactor = 80);
@@ -0,0 +1,12 @@
+/*
+ * 0005_add_ticket_user.sql
+ *
+ * Records who an opaque ticket was issued to, so an endpoint acting on an account (binding a speaker
+ * profile on enrollment) can require a ticket of that account rather than trusting a named e-mail.
+ * Signed tickets carry the user in their payload. Rows written before this migration have no user
+ * and only authenticate requests that do not need one.
+ *
+ */
+
+
+ALTER TABLE data_tickets ADD COLUMN IF NOT EXISTS user_id TEXT;
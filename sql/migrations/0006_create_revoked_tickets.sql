@@ -0,0 +1,16 @@
+/*
+ * 0006_create_revoked_tickets.sql
+ *
+ * Signed tickets are verified without a lookup, so logging one out records its ticket id here until
+ * the ticket would have expired anyway. Every process reloads the unexpired rows periodically and
+ * checks signed tickets against that copy; the expiry index serves the reload and the reaper.
+ *
+ */
+
+
+CREATE TABLE IF NOT EXISTS data_revoked_tickets (
+  ticket_id BYTEA PRIMARY KEY,
+  expiry TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS data_revoked_tickets_expiry_idx ON data_revoked_tickets (expiry);
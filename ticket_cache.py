@@ -0,0 +1,90 @@
+"""
+In-process cache of tickets already verified against the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class TicketCache(object):
+    """
+    Bounded LRU cache of positive ticket checks keyed by the ticket's SHA-256 digest.
+
+    An entry never outlives the ticket's own expiry, and is additionally capped by a TTL so that a
+    revocation made by another process is picked up within that window.
+    """
+    def __init__(self, max_entries=10000, ttl=300.0):
+        """
+        :param max_entries: Maximum number of tickets held; least recently used are evicted first.
+        :param ttl: Maximum seconds an entry is trusted, even if the ticket expires later.
+        """
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, ticket_hash):
+        """
+        Look up a verified ticket.
+        :param ticket_hash: SHA-256 digest of the ticket bytes.
+        :return: The ticket's expiry datetime (UTC) if cached and still valid, otherwise None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(ticket_hash)
+            if entry is None:
+                self._misses += 1
+                return None
+            deadline, expiry = entry
+            if deadline <= now:
+                del self._entries[ticket_hash]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(ticket_hash)
+            self._hits += 1
+            return expiry
+
+    def put(self, ticket_hash, expiry):
+        """
+        Remember a ticket that the database reported valid.
+        :param ticket_hash: SHA-256 digest of the ticket bytes.
+        :param expiry: Naive UTC datetime at which the ticket expires.
+        """
+        remaining = (expiry - datetime.utcnow()).total_seconds()
+        if remaining <= 0 or self._max_entries <= 0:
+            return
+        deadline = time.monotonic() + min(remaining, self._ttl)
+
+        with self._lock:
+            self._entries[ticket_hash] = (deadline, expiry)
+            self._entries.move_to_end(ticket_hash)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, ticket_hash):
+        """
+        Drop a ticket from the cache, e.g. when it is revoked.
+        :param ticket_hash: SHA-256 digest of the ticket bytes.
+        """
+        with self._lock:
+            self._entries.pop(ticket_hash, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ :return: Snapshot of cache size and hit/miss counters. """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
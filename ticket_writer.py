@@ -0,0 +1,221 @@
+"""
+Group commit of issued tickets: inserts from concurrent logins are written as one multi-row INSERT
+and a single commit every few milliseconds, instead of one round-trip and WAL flush per login.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+
+BATCH_SIZE = metrics.REGISTRY.histogram(
+    "ticket_writer_batch_size", "Tickets written per INSERT by the ticket writer.", (),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+
+class TicketQueueFull(Exception):
+    """ Raised instead of queueing when too many tickets are already waiting to be written. """
+
+
+class _PendingTicket(object):
+    __slots__ = ("ticket_hash", "issued", "expiry", "user_id", "future", "cancelled", "in_flight")
+
+    def __init__(self, ticket_hash, issued, expiry, user_id):
+        self.ticket_hash = ticket_hash
+        self.issued = issued
+        self.expiry = expiry
+        self.user_id = user_id
+        self.future = Future()
+        self.cancelled = False
+        self.in_flight = False
+
+
+class TicketWriter(object):
+    """
+    Background writer for data_tickets rows.
+
+    Callers submit a row and get a Future that resolves once the batch holding it is committed;
+    waiting on it gives group commit, not waiting gives write-behind. Until its batch is committed
+    a ticket is reported by pending(), so it checks as valid in this process straight away.
+    """
+    def __init__(self, pool, max_batch=500, max_delay=0.005, max_pending=10000, retries=3, execute=None):
+        """
+        :param pool: Connection pool to write through.
+        :param max_batch: Most rows written by one INSERT.
+        :param max_delay: Seconds the first queued row waits for others to join its batch.
+        :param max_pending: Rows allowed queued or in flight; beyond that submit raises TicketQueueFull.
+        :param retries: Attempts at writing a batch before its rows are given up on.
+        :param execute: Optional callable(cur, statement, sql, params), e.g. auth_db.execute.
+        """
+        self._pool = pool
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._max_pending = max_pending
+        self._retries = retries
+        self._execute = execute or (lambda cur, statement, sql, params: cur.execute(sql, params))
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._pending = {}
+        self._closed = False
+        self._batches = 0
+        self._rows = 0
+        self._failed_rows = 0
+        self._thread = threading.Thread(target=self._run, name="ticket-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, ticket_hash, issued, expiry, user_id=None):
+        """
+        Queue a ticket row for insertion.
+        :param ticket_hash: SHA-256 digest of the ticket bytes.
+        :param issued: Naive UTC issue datetime.
+        :param expiry: Naive UTC expiry datetime.
+        :param user_id: E-mail of the user the ticket was issued to.
+        :return: concurrent.futures.Future resolving to True once the row is committed.
+        :raises TicketQueueFull: If max_pending rows are already waiting.
+        """
+        entry = _PendingTicket(ticket_hash, issued, expiry, user_id)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Ticket writer is closed")
+            if len(self._pending) >= self._max_pending:
+                raise TicketQueueFull("Too many tickets waiting to be written")
+            self._pending[ticket_hash] = entry
+            self._queue.append(entry)
+            if len(self._queue) == 1 or len(self._queue) >= self._max_batch:
+                self._cond.notify()
+        return entry.future
+
+    def pending(self, ticket_hash):
+        """
+        :param ticket_hash: SHA-256 digest of the ticket bytes.
+        :return: Expiry of a submitted ticket that is not committed yet, otherwise None.
+        """
+        entry = self._pending.get(ticket_hash)
+        return entry.expiry if entry is not None and not entry.cancelled else None
+
+    def pending_user(self, ticket_hash):
+        """
+        :param ticket_hash: SHA-256 digest of the ticket bytes.
+        :return: User of a submitted ticket that is not committed yet, otherwise None.
+        """
+        entry = self._pending.get(ticket_hash)
+        return entry.user_id if entry is not None and not entry.cancelled else None
+
+    def cancel(self, ticket_hash, timeout=None):
+        """
+        Withdraw a ticket, e.g. on logout. A row not yet taken into a batch is dropped; a row already
+        being written is waited for, so a following DELETE cannot run before the INSERT.
+        :return: True if the row was dropped before reaching the database.
+        """
+        with self._cond:
+            entry = self._pending.get(ticket_hash)
+            if entry is None:
+                return False
+            if not entry.in_flight:
+                entry.cancelled = True
+                del self._pending[ticket_hash]
+                entry.future.set_result(False)
+                return True
+        try:
+            entry.future.result(timeout)
+        except Exception:
+            pass
+        return False
+
+    def flush(self, timeout=None):
+        """ Wait until everything submitted so far has been written or given up on. """
+        with self._cond:
+            futures = [entry.future for entry in self._pending.values()]
+            self._cond.notify()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for future in futures:
+            try:
+                future.result(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except Exception:
+                pass
+
+    def close(self, timeout=None):
+        """ Write what is queued and stop the writer thread. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "batches": self._batches,
+                "rows": self._rows,
+                "failed_rows": self._failed_rows,
+                "avg_batch_size": self._rows / float(self._batches) if self._batches else 0.0
+            }
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            # hold the first row briefly so concurrent logins can join its batch
+            deadline = time.monotonic() + self._max_delay
+            while len(self._queue) < self._max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self._max_batch:
+                entry = self._queue.popleft()
+                if not entry.cancelled:
+                    entry.in_flight = True
+                    batch.append(entry)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        sql = "INSERT INTO data_tickets (ticket_val_hash, issued, expiry, user_id) VALUES " + \
+            ", ".join(["(%s, %s, %s, %s)"] * len(batch))
+        params = []
+        for entry in batch:
+            params.extend((entry.ticket_hash, entry.issued, entry.expiry, entry.user_id))
+
+        error = None
+        for attempt in range(self._retries):
+            try:
+                with self._pool.connection() as conn:
+                    cur = conn.cursor()
+                    self._execute(cur, "issue_tickets_batch", sql, params)
+                    conn.commit()
+                error = None
+                break
+            except Exception as e:
+                error = e
+                logging.exception('Error writing %d tickets (attempt %d).', len(batch), attempt + 1)
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+
+        BATCH_SIZE.labels().observe(len(batch))
+        with self._cond:
+            self._batches += 1
+            if error is None:
+                self._rows += len(batch)
+            else:
+                self._failed_rows += len(batch)
+            for entry in batch:
+                if self._pending.get(entry.ticket_hash) is entry:
+                    del self._pending[entry.ticket_hash]
+        for entry in batch:
+            if error is None:
+                entry.future.set_result(True)
+            else:
+                entry.future.set_exception(error)
@@ -0,0 +1,237 @@
+"""
+Stateless HMAC-signed tickets that can be verified without a database round-trip.
+
+A signed ticket looks like ``v2.<key id>.<payload>.<signature>`` where the payload is the
+base64url-encoded issued time, expiry time (both UNIX seconds), a random 16-byte ticket id and the
+user id. Opaque tickets are hex strings, so the two formats can never be confused.
+"""
+import base64
+import calendar
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+SIGNED_TICKET_VERSION = "v2"
+_PREFIX = SIGNED_TICKET_VERSION + "."
+_CLAIMS = struct.Struct(">II16s")
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def is_signed(ticket):
+    """
+    :return: True if the ticket string is in the signed format rather than opaque hex. Tickets of
+             earlier signed versions count as signed, so they are rejected rather than malformed.
+    """
+    return ticket.startswith("v")
+
+
+def new_refresh_token(family_id=None):
+    """
+    Generate a refresh token: the id of the session (family) it belongs to and a random secret,
+    as ``<family id hex>.<secret hex>``. Only the SHA-256 of the secret is stored.
+    :param family_id: 16-byte id of the session being renewed; a new session if None.
+    :return: Tuple of token string, family id bytes and secret hash bytes.
+    """
+    if family_id is None:
+        family_id = os.urandom(16)
+    secret = os.urandom(32)
+    return "%s.%s" % (family_id.hex(), secret.hex()), family_id, hashlib.sha256(secret).digest()
+
+
+def parse_refresh_token(token):
+    """
+    :return: Tuple of family id bytes and secret hash bytes of a refresh token string.
+    :raises ValueError: If the token is not a string in the refresh token format.
+    """
+    if not isinstance(token, str):
+        raise ValueError("Refresh token must be a string")
+    family_hex, _, secret_hex = token.partition(".")
+    family_id = bytes.fromhex(family_hex)
+    secret = bytes.fromhex(secret_hex)
+    if len(family_id) != 16 or len(secret) != 32:
+        raise ValueError("Malformed refresh token")
+    return family_id, hashlib.sha256(secret).digest()
+
+
+def sign_operation(key, operation_id, submitter):
+    """
+    Bind a pending speech login to the address that submitted it, so only that caller can poll it.
+    :param key: Secret key bytes.
+    :param operation_id: Speaker service operation id.
+    :param submitter: Address of the submitting client, or None.
+    :return: Token string ``<operation id>.<signature>``, safe to use as a URL path segment.
+    """
+    return "%s.%s" % (operation_id, _b64encode(_operation_mac(key, operation_id, submitter)))
+
+
+def verify_operation(key, token, submitter):
+    """
+    :return: Operation id of a token from sign_operation for the same submitter, otherwise None.
+    """
+    operation_id, _, signature = token.rpartition(".")
+    try:
+        signature = _b64decode(signature)
+    except (ValueError, TypeError):
+        return None
+    if not operation_id or not hmac.compare_digest(signature, _operation_mac(key, operation_id, submitter)):
+        return None
+    return operation_id
+
+
+def _operation_mac(key, operation_id, submitter):
+    message = "%s\n%s" % (operation_id, submitter or "")
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()[:16]
+
+
+class SignedTicket(object):
+    """ Claims carried by a verified signed ticket. """
+    def __init__(self, ticket_id, user_id, issued, expiry):
+        self.ticket_id = ticket_id
+        self.user_id = user_id
+        self.issued = issued
+        self.expiry = expiry
+
+
+class TicketSigner(object):
+    """ Issues and verifies signed tickets, supporting several keys at once for rotation. """
+    def __init__(self, keys, active_key_id):
+        """
+        :param keys: Dict of key id -> secret key bytes. Every key listed is accepted on verify.
+        :param active_key_id: Id of the key used to sign new tickets, or None for a signer that only
+                              verifies, e.g. with no keys configured, when every signed ticket is invalid.
+        """
+        if active_key_id is not None and active_key_id not in keys:
+            raise ValueError("Active ticket signing key %r is not configured" % active_key_id)
+        for key_id in keys:
+            if not key_id or "." in key_id:
+                raise ValueError("Invalid ticket signing key id %r" % key_id)
+        self._keys = dict(keys)
+        self._active_key_id = active_key_id
+
+    def _sign(self, key, signing_input):
+        return hmac.new(key, signing_input.encode("ascii"), hashlib.sha256).digest()
+
+    def issue(self, user_id, issued, expiry):
+        """
+        Create a signed ticket.
+        :param user_id: User identifier (e-mail) embedded in the ticket.
+        :param issued: Naive UTC issue datetime.
+        :param expiry: Naive UTC expiry datetime.
+        :return: Ticket string.
+        :raises ValueError: If no active key is configured.
+        """
+        if self._active_key_id is None:
+            raise ValueError("No active ticket signing key is configured")
+        payload = _CLAIMS.pack(calendar.timegm(issued.utctimetuple()), calendar.timegm(expiry.utctimetuple()),
+                               os.urandom(16)) + user_id.encode("utf-8")
+        signing_input = "%s%s.%s" % (_PREFIX, self._active_key_id, _b64encode(payload))
+        signature = self._sign(self._keys[self._active_key_id], signing_input)
+        return "%s.%s" % (signing_input, _b64encode(signature))
+
+    def verify(self, ticket, now=None):
+        """
+        Verify a signed ticket's signature and expiry.
+        :param ticket: Ticket string.
+        :param now: UNIX time to check expiry against, defaults to the current time.
+        :return: SignedTicket if valid, otherwise None.
+        """
+        parts = ticket.split(".")
+        if len(parts) != 4 or parts[0] != SIGNED_TICKET_VERSION:
+            return None
+        key = self._keys.get(parts[1])
+        if key is None:
+            return None
+
+        try:
+            payload = _b64decode(parts[2])
+            signature = _b64decode(parts[3])
+        except (ValueError, TypeError):
+            return None
+        expected = self._sign(key, ticket[:ticket.rindex(".")])
+        if not hmac.compare_digest(signature, expected) or len(payload) < _CLAIMS.size:
+            return None
+
+        issued, expiry, ticket_id = _CLAIMS.unpack_from(payload)
+        if expiry <= (time.time() if now is None else now):
+            return None
+        try:
+            user_id = payload[_CLAIMS.size:].decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+
+        return SignedTicket(ticket_id, user_id,
+                            datetime.utcfromtimestamp(issued), datetime.utcfromtimestamp(expiry))
+
+
+class RevocationList(object):
+    """
+    Compact set of signed tickets revoked before their expiry (early logout).
+
+    Only a 16-byte id per ticket is kept, and each entry is dropped once the ticket would have
+    expired anyway, so the list never grows beyond the tickets revoked within one ticket lifetime.
+    The list is per process: revocations are also written to a shared store, and merged back into
+    the list through update whenever claim_sync reports it is due.
+    """
+    def __init__(self, sync_interval=10.0):
+        """
+        :param sync_interval: Seconds between reloads from the shared store, the longest a ticket
+                              revoked by another process is still accepted by this one.
+        """
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._next_prune = 0.0
+        self._sync_interval = sync_interval
+        self._synced = None
+
+    def revoke(self, signed_ticket):
+        """ :param signed_ticket: SignedTicket returned by TicketSigner.verify. """
+        expires_at = calendar.timegm(signed_ticket.expiry.utctimetuple())
+        with self._lock:
+            self._revoked[signed_ticket.ticket_id] = expires_at
+            self._prune(time.time())
+
+    def update(self, revoked):
+        """
+        Merge revocations read from the shared store.
+        :param revoked: Iterable of (ticket id bytes, naive UTC expiry datetime) pairs.
+        """
+        with self._lock:
+            for ticket_id, expiry in revoked:
+                self._revoked[bytes(ticket_id)] = calendar.timegm(expiry.utctimetuple())
+            self._prune(time.time())
+
+    def claim_sync(self):
+        """
+        :return: True if the list is due to be reloaded from the shared store; the caller is then
+                 expected to do so, and other callers get False until the next interval.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._synced is not None and now - self._synced < self._sync_interval:
+                return False
+            self._synced = now
+            return True
+
+    def is_revoked(self, signed_ticket):
+        return signed_ticket.ticket_id in self._revoked
+
+    def _prune(self, now):
+        if now < self._next_prune:
+            return
+        self._revoked = dict((ticket_id, expires_at) for ticket_id, expires_at in self._revoked.items()
+                             if expires_at > now)
+        self._next_prune = now + 60
+
+    def __len__(self):
+        return len(self._revoked)
@@ -0,0 +1,170 @@
+"""
+WAV header validation and normalisation for audio sent to the speaker service.
+
+The service only accepts 16 kHz, 16-bit, mono PCM, so uploads are checked here before any remote
+call is made. Parsing works on a memoryview of the upload and never copies the sample data.
+"""
+import struct
+from collections import namedtuple
+
+REQUIRED_SAMPLE_RATE = 16000
+REQUIRED_BITS_PER_SAMPLE = 16
+REQUIRED_CHANNELS = 1
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+_CHUNK_HEADER = struct.Struct("<4sI")
+_FMT = struct.Struct("<HHIIHH")
+
+WavInfo = namedtuple("WavInfo", "audio_format channels sample_rate bits_per_sample data_offset data_size")
+
+
+class WavError(ValueError):
+    """ Raised when audio is not a WAV file the speaker service can accept. """
+
+
+def duration(info):
+    """ :return: Length of the audio described by a WavInfo, in seconds. """
+    return info.data_size / float(info.sample_rate * info.channels * (info.bits_per_sample // 8))
+
+
+def parse_wav(audio):
+    """
+    Read the RIFF header and fmt chunk of a WAV file.
+    :param audio: WAV file contents (bytes, bytearray or memoryview).
+    :return: WavInfo describing the sample format and where the sample data lives.
+    :raises WavError: If the data is not a well-formed WAV file.
+    """
+    view = memoryview(audio)
+    if len(view) < 12 or view[0:4] != b"RIFF" or view[8:12] != b"WAVE":
+        raise WavError("Not a RIFF/WAVE file")
+
+    fmt = None
+    offset = 12
+    while offset + _CHUNK_HEADER.size <= len(view):
+        chunk_id, chunk_size = _CHUNK_HEADER.unpack_from(view, offset)
+        body = offset + _CHUNK_HEADER.size
+        if chunk_id == b"fmt ":
+            if chunk_size < _FMT.size or body + _FMT.size > len(view):
+                raise WavError("Truncated fmt chunk")
+            audio_format, channels, sample_rate, _, _, bits_per_sample = _FMT.unpack_from(view, body)
+            if audio_format == _WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # the real format is the first two bytes of the sub-format GUID
+                audio_format = struct.unpack_from("<H", view, body + 24)[0]
+            fmt = (audio_format, channels, sample_rate, bits_per_sample)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise WavError("data chunk before fmt chunk")
+            # some encoders write a placeholder size when streaming; trust the bytes we have
+            data_size = min(chunk_size, len(view) - body)
+            if fmt[1] < 1 or fmt[2] < 1 or fmt[3] < 8 or fmt[3] % 8:
+                raise WavError("Invalid sample format")
+            return WavInfo(fmt[0], fmt[1], fmt[2], fmt[3], body, data_size)
+        # chunks are word aligned
+        offset = body + chunk_size + (chunk_size & 1)
+
+    raise WavError("No data chunk" if fmt is not None else "No fmt chunk")
+
+
+def is_required_format(info):
+    """ :return: True if the audio is already 16 kHz, 16-bit, mono PCM. """
+    return info.audio_format == _WAVE_FORMAT_PCM and info.channels == REQUIRED_CHANNELS and \
+        info.sample_rate == REQUIRED_SAMPLE_RATE and info.bits_per_sample == REQUIRED_BITS_PER_SAMPLE
+
+
+def validate_wav(info, min_duration, max_duration):
+    """
+    Check a parsed WAV file against the speaker service's requirements.
+    :param info: WavInfo from parse_wav.
+    :param min_duration: Shortest accepted audio, in seconds.
+    :param max_duration: Longest accepted audio, in seconds.
+    :raises WavError: Describing the first requirement the audio fails.
+    """
+    if info.audio_format != _WAVE_FORMAT_PCM:
+        raise WavError("Audio must be PCM encoded")
+    if info.channels != REQUIRED_CHANNELS:
+        raise WavError("Audio must be mono, got %d channels" % info.channels)
+    if info.sample_rate != REQUIRED_SAMPLE_RATE:
+        raise WavError("Audio must be sampled at %d Hz, got %d Hz" % (REQUIRED_SAMPLE_RATE, info.sample_rate))
+    if info.bits_per_sample != REQUIRED_BITS_PER_SAMPLE:
+        raise WavError("Audio must be %d-bit, got %d-bit" % (REQUIRED_BITS_PER_SAMPLE, info.bits_per_sample))
+    _check_duration(duration(info), min_duration, max_duration)
+
+
+def normalize_wav(audio, info, min_duration, max_duration):
+    """
+    Convert PCM or float WAV audio of any rate and channel count to 16 kHz, 16-bit, mono PCM.
+    Requires NumPy; downmixing averages the channels and resampling is band-limited (FFT based).
+    :param audio: WAV file contents.
+    :param info: WavInfo from parse_wav.
+    :param min_duration: Shortest accepted audio, in seconds.
+    :param max_duration: Longest accepted audio, in seconds.
+    :return: WAV file bytes in the required format.
+    :raises WavError: If the audio cannot be converted or its duration is out of range.
+    """
+    _check_duration(duration(info), min_duration, max_duration)
+    try:
+        import numpy as np
+    except ImportError:
+        raise WavError("Audio must be 16 kHz, 16-bit mono PCM")
+
+    width = info.bits_per_sample // 8
+    frame = width * info.channels
+    data = memoryview(audio)[info.data_offset:info.data_offset + info.data_size - info.data_size % frame]
+
+    if info.audio_format == _WAVE_FORMAT_IEEE_FLOAT and width in (4, 8):
+        samples = np.frombuffer(data, dtype="<f%d" % width).astype(np.float64)
+    elif info.audio_format == _WAVE_FORMAT_PCM and width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float64) - 128.0) / 128.0
+    elif info.audio_format == _WAVE_FORMAT_PCM and width in (2, 4):
+        samples = np.frombuffer(data, dtype="<i%d" % width) / float(2 ** (8 * width - 1))
+    elif info.audio_format == _WAVE_FORMAT_PCM and width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        packed = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = np.where(packed & 0x800000, packed - 0x1000000, packed) / float(2 ** 23)
+    else:
+        raise WavError("Unsupported sample format")
+
+    mono = samples.reshape(-1, info.channels).mean(axis=1)
+    if info.sample_rate != REQUIRED_SAMPLE_RATE and len(mono):
+        target = int(round(len(mono) * REQUIRED_SAMPLE_RATE / float(info.sample_rate)))
+        spectrum = np.fft.rfft(mono)[:target // 2 + 1]
+        mono = np.fft.irfft(spectrum, target) * (target / float(len(mono)))
+
+    pcm = np.clip(np.round(mono * 32767.0), -32768, 32767).astype("<i2").tobytes()
+    return _wav_header(len(pcm)) + pcm
+
+
+def prepare_wav(audio, min_duration, max_duration, normalize=True):
+    """
+    Validate an upload, converting it to the required format first if it is not already in it.
+    :param audio: WAV file contents.
+    :param min_duration: Shortest accepted audio, in seconds.
+    :param max_duration: Longest accepted audio, in seconds.
+    :param normalize: False to reject audio in any other format instead of converting it.
+    :return: WAV file bytes in the required format.
+    :raises WavError: If the audio is not acceptable.
+    """
+    info = parse_wav(audio)
+    if is_required_format(info) or not normalize:
+        validate_wav(info, min_duration, max_duration)
+        return audio
+    return normalize_wav(audio, info, min_duration, max_duration)
+
+
+def _check_duration(seconds, min_duration, max_duration):
+    if seconds < min_duration:
+        raise WavError("Audio is %.2fs long, at least %.2fs is required" % (seconds, min_duration))
+    if seconds > max_duration:
+        raise WavError("Audio is %.2fs long, at most %.2fs is allowed" % (seconds, max_duration))
+
+
+def _wav_header(data_size):
+    block_align = REQUIRED_CHANNELS * REQUIRED_BITS_PER_SAMPLE // 8
+    return b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVE" + \
+        _CHUNK_HEADER.pack(b"fmt ", _FMT.size) + \
+        _FMT.pack(_WAVE_FORMAT_PCM, REQUIRED_CHANNELS, REQUIRED_SAMPLE_RATE,
+                  REQUIRED_SAMPLE_RATE * block_align, block_align, REQUIRED_BITS_PER_SAMPLE) + \
+        _CHUNK_HEADER.pack(b"data", data_size)